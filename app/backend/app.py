@@ -5,32 +5,19 @@ import logging
 import mimetypes
 import os
 import io
-from asyncio import create_task
+from asyncio import CancelledError, create_task
 from typing import AsyncGenerator
 from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
 from azure.cosmos import CosmosClient
 from datetime import datetime
+from functools import lru_cache
 import aiohttp
 import openai
 from azure.ai.formrecognizer.aio import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
 from azure.monitor.opentelemetry import configure_azure_monitor
 from azure.search.documents.aio import SearchClient
-from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents.indexes.models import (
-    HnswParameters,
-    PrioritizedFields,
-    SearchableField,
-    SearchField,
-    SearchFieldDataType,
-    SearchIndex,
-    SemanticConfiguration,
-    SemanticField,
-    SemanticSettings,
-    SimpleField,
-    VectorSearch,
-    VectorSearchAlgorithmConfiguration,
-)
+from azure.search.documents.indexes.aio import SearchIndexClient
 from azure.storage.blob.aio import BlobServiceClient
 from opentelemetry.instrumentation.aiohttp_client import AioHttpClientInstrumentor
 from opentelemetry.instrumentation.asgi import OpenTelemetryMiddleware
@@ -46,18 +33,34 @@ from quart import (
     send_from_directory,
 )
 
-from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
-from approaches.readdecomposeask import ReadDecomposeAsk
-from approaches.readretrieveread import ReadRetrieveReadApproach
-from approaches.retrievethenread import RetrieveThenReadApproach
+from approaches.registry import (
+    ASK_APPROACH_CLASSES,
+    CHAT_APPROACH_CLASSES,
+    ApproachRegistry,
+    enabled_approaches,
+    lazy_approach,
+)
+from bootstrap import BOOTSTRAPPED_ENV, bootstrap
+from core.admission import AdmissionController
+from core.answercache import AnswerCache
+from core.chunking import CHUNKERS
+from core.filecatalog import FileCatalog
+from core.ingestevents import IngestEventBus
+from core.instrumentation import instrument_stream
+from core.searchcache import CachedSearchClient
+from core.singleflight import SingleFlight, request_key
+from core.startupprofile import emit_startup_profile, startup_step
+from core.uploadstream import UploadTooLargeError, save_multipart_files
+from core.vectorindex import LocalSearchClient, LocalVectorIndex
+from ingestworker import IngestJobRunner, enqueue_ingest_job, get_ingest_job
+from serverconfig import server_config
 from utils import (
-    get_all_files,
     get_data_filepath,
+    get_upload_filepath,
     get_ingest_json,
     set_ingest_json,
-    upload_documents,
     is_ingest_lock,
-    create_ingest_lock,
+    make_chunker,
 )
 # connection_string = "DefaultEndpointsProtocol=https;AccountName=stxlptm4uybarpw;AccountKey=KPqI1EGCMSfN5fffpKcZug6EpjbrWX1DOCya9b+LLjVhx+ZS0dpE3x0KH1QlsmKSuL+2P4ZW8vwe+AStgQ1iwg==;EndpointSuffix=core.windows.net"  # Replace with your Azure Blob Storage connection string
 # blob_service_client = BlobServiceClient.from_connection_string(connection_string)
@@ -65,13 +68,20 @@ from utils import (
 # container_client = blob_service_client.get_container_client(container_name)
 cosmos_endpoint = "https://history-c.documents.azure.com:443/"
 cosmos_key = "xy9CShbxmmkjlet45CyneUC2xg9f1rtro1oyWOC36f4ssB82uOfvWy6hFP69aQKPCPulYY9rjFrQACDbtDWU7g=="
-cosmos_client = CosmosClient(cosmos_endpoint, cosmos_key)
 
 # Initialize the Cosmos DB container
 cosmos_db_name = "ToDoList"
 container_name = "history"
-database = cosmos_client.get_database_client(cosmos_db_name)
-container = database.get_container_client(container_name)
+
+
+@lru_cache(maxsize=None)
+def get_history_container():
+    # Created on first use rather than on import, so importing the app makes no network calls and workers forked
+    # from a process that imported it (see preload.py) do not share a client
+    cosmos_client = CosmosClient(cosmos_endpoint, cosmos_key)
+    database = cosmos_client.get_database_client(cosmos_db_name)
+    return database.get_container_client(container_name)
+
 
 CONFIG_CREDENTIAL = "azure_credential"
 CONFIG_ASK_APPROACHES = "ask_approaches"
@@ -85,25 +95,12 @@ CONFIG_FORM_RECOGNIZER_CLIENT = "form_recognizer_client"
 CONFIG_EMBEDDING_MODEL = "embedding_model"
 CONFIG_OPENAI_HOST = "openai_host"
 CONFIG_AZURE_OPENAI_EMB_DEPLOYMENT = "azure_openai_emb_deployment"
-
-INDEX_FIELDS = [
-    SimpleField(name="id", type="Edm.String", key=True),
-    SearchableField(name="content", type="Edm.String", analyzer_name="en.microsoft"),
-    SearchField(
-        name="embedding",
-        type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-        hidden=False,
-        searchable=True,
-        filterable=False,
-        sortable=False,
-        facetable=False,
-        vector_search_dimensions=1536,
-        vector_search_configuration="default",
-    ),
-    SimpleField(name="category", type="Edm.String", filterable=True, facetable=True),
-    SimpleField(name="sourcepage", type="Edm.String", filterable=True, facetable=True),
-    SimpleField(name="sourcefile", type="Edm.String", filterable=True, facetable=True),
-]
+CONFIG_FILE_CATALOG = "file_catalog"
+CONFIG_INGEST_EVENTS = "ingest_events"
+CONFIG_INGEST_RUNNER = "ingest_runner"
+CONFIG_INGEST_RUNNER_TASK = "ingest_runner_task"
+CONFIG_ANSWER_CACHE = "answer_cache"
+CONFIG_SINGLE_FLIGHT = "single_flight"
 
 bp = Blueprint("routes", __name__, static_folder="static")
 
@@ -143,14 +140,16 @@ async def content_file(path):
 
 @bp.route("/files")
 async def fetch_files():
-    all_files = await get_all_files(current_app.config[CONFIG_BLOB_DOCUMENT_CONTAINER_CLIENT])
-    return jsonify(
-        {
-            "files": all_files,
-            "ingested": await get_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]),
-            "ingest_lock": await is_ingest_lock(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]),
-        }
+    catalog = current_app.config[CONFIG_FILE_CATALOG]
+    await catalog.ensure_fresh(
+        current_app.config[CONFIG_BLOB_CONTAINER_CLIENT], current_app.config[CONFIG_BLOB_DOCUMENT_CONTAINER_CLIENT]
     )
+    if catalog.etag in request.if_none_match:
+        response = await make_response("", 304)
+    else:
+        response = jsonify(catalog.snapshot())
+    response.set_etag(catalog.etag)
+    return response
 
 
 @bp.route("/file/<filename>")
@@ -175,94 +174,159 @@ async def fetch_file(filename):
     return await send_file(blob_file, mimetype=mime_type, as_attachment=False, attachment_filename=filename)
 
 
-@bp.route("/upload-files", methods=["POST"])
-async def upload_files():
-    files = await request.files
-    data_path = get_data_filepath()
+async def loaded_catalog() -> FileCatalog:
+    catalog = current_app.config[CONFIG_FILE_CATALOG]
+    await catalog.ensure_loaded(
+        current_app.config[CONFIG_BLOB_CONTAINER_CLIENT], current_app.config[CONFIG_BLOB_DOCUMENT_CONTAINER_CLIENT]
+    )
+    return catalog
+
+
+def record_uploads(ingest_json: dict, uploaded: list[dict]) -> tuple[dict, list[str]]:
+    # Files whose content hash is unchanged keep their ingestion state, anything else is (re)queued
+    changed, unchanged = {}, []
+    for file in uploaded:
+        properties = ingest_json.get(file["filename"])
+        if properties is not None and properties.get("hash") == file["hash"] and properties.get("operation") != 2:
+            unchanged.append(file["filename"])
+        elif properties is None or (properties.get("status") == 0 and properties.get("operation") == 0):
+            changed[file["filename"]] = {"operation": 0, "status": 0, "hash": file["hash"]}
+        else:
+            changed[file["filename"]] = {**properties, "operation": 1, "status": 0, "hash": file["hash"]}
+    ingest_json.update(changed)
+    return changed, unchanged
+
+
+async def save_uploads():
+    catalog = await loaded_catalog()
+    try:
+        uploaded = await save_multipart_files(
+            request.headers.get("Content-Type"),
+            request.body,
+            get_data_filepath(),
+            get_upload_filepath(),
+            max_size=current_app.config["MAX_CONTENT_LENGTH"],
+        )
+    except UploadTooLargeError as e:
+        return jsonify({"error": str(e)}), 413
+    except ValueError as e:
+        # MultipartUploadError, or a malformed body rejected by the multipart parser
+        return jsonify({"error": str(e)}), 400
     ingest_json = await get_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT])
-    files = files.to_dict(flat=False)
-    for file in files["files"]:
-        await file.save(os.path.join(data_path, file.filename))
-        ingest_json[file.filename] = {"operation": 0, "status": 0}
-    await set_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT], ingest_json)
-    all_files = await get_all_files(current_app.config[CONFIG_BLOB_DOCUMENT_CONTAINER_CLIENT])
+    changed, unchanged = record_uploads(ingest_json, uploaded)
+    for filename in unchanged:
+        # Already indexed from the same content, ingestion will not pick the copy up to remove it
+        if ingest_json[filename].get("status") == 2:
+            os.remove(os.path.join(get_data_filepath(), filename))
+    catalog.add_files([file["filename"] for file in uploaded])
+    if changed:
+        await set_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT], ingest_json, catalog)
+    # Only return what changed, the client merges it into the listing it already has
     return jsonify(
         {
-            "files": all_files,
-            "ingested": ingest_json,
-            "ingest_lock": await is_ingest_lock(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]),
+            "delta": {"files": [file["filename"] for file in uploaded], "ingested": changed},
+            "unchanged": unchanged,
+            "ingest_lock": catalog.ingest_lock,
+            "etag": catalog.etag,
         }
     )
 
 
+@bp.route("/upload-files", methods=["POST"])
+async def upload_files():
+    return await save_uploads()
+
+
 @bp.route("/ingest-files")
 async def ingest_files():
-    if not await is_ingest_lock(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]):
-        await create_ingest_lock(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT])
-        create_task(
-            upload_documents(
-                current_app.config[CONFIG_SEARCH_CLIENT],
-                current_app.config[CONFIG_SEARCH_INDEX],
+    catalog = await loaded_catalog()
+    chunker = request.args.get("chunker")
+    if chunker is not None and chunker not in CHUNKERS:
+        return jsonify({"error": f"chunker must be one of {', '.join(CHUNKERS)}"}), 400
+    if await is_ingest_lock(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]):
+        return jsonify({"error": "Ingest already in progress"}), 403
+    options = {"chunker": chunker} if chunker else {}
+    job = await enqueue_ingest_job(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT], options)
+    current_app.config[CONFIG_INGEST_RUNNER].wake()
+    # Report the lock as taken right away so the client keeps polling until the job is picked up
+    catalog.set_ingest_lock(True)
+    return jsonify({**catalog.snapshot(), "job": job["id"]})
+
+
+@bp.route("/ingest-jobs/<job_id>")
+async def ingest_job_status(job_id):
+    job = await get_ingest_job(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT], job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+async def ingest_event_stream(events, catalog, blob_container, document_container) -> AsyncGenerator[dict, None]:
+    # Ingestion may be running in another worker, so when this worker has nothing to report
+    # fall back to pushing catalog snapshots whenever the reconciled listing changes
+    await catalog.ensure_loaded(blob_container, document_container)
+    yield {"type": "snapshot", **catalog.snapshot()}
+    etag = catalog.etag
+    async for event in events.subscribe(heartbeat_interval=15):
+        if event is not None:
+            yield event
+            continue
+        await catalog.ensure_fresh(blob_container, document_container)
+        if catalog.etag != etag:
+            etag = catalog.etag
+            yield {"type": "snapshot", **catalog.snapshot()}
+        else:
+            yield {"type": "heartbeat"}
+
+
+@bp.route("/ingest-events")
+async def ingest_events():
+    response = await make_response(
+        format_as_ndjson(
+            ingest_event_stream(
+                current_app.config[CONFIG_INGEST_EVENTS],
+                current_app.config[CONFIG_FILE_CATALOG],
                 current_app.config[CONFIG_BLOB_CONTAINER_CLIENT],
                 current_app.config[CONFIG_BLOB_DOCUMENT_CONTAINER_CLIENT],
-                current_app.config[CONFIG_FORM_RECOGNIZER_CLIENT],
-                openai,
-                current_app.config[CONFIG_OPENAI_HOST],
-                current_app.config[CONFIG_AZURE_OPENAI_EMB_DEPLOYMENT],
-                current_app.config[CONFIG_EMBEDDING_MODEL],
             )
         )
-        all_files = await get_all_files(current_app.config[CONFIG_BLOB_DOCUMENT_CONTAINER_CLIENT])
-        return jsonify(
-            {
-                "files": all_files,
-                "ingested": await get_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]),
-                "ingest_lock": await is_ingest_lock(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]),
-            }
-        )
-    return jsonify({"error": "Ingest already in progress"}), 403
+    )
+    response.timeout = None  # type: ignore
+    return response
 
 
 @bp.route("/update-file", methods=["POST"])
 async def update_file():
-    files = await request.files
-    data_path = get_data_filepath()
-    ingest_json = await get_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT])
-    files = files.to_dict(flat=False)
-    for file in files["files"]:
-        await file.save(os.path.join(data_path, file.filename))
-        if ingest_json[file.filename]["status"] == 0:
-            ingest_json[file.filename] = {"operation": 0, "status": 0}
-        else:
-            ingest_json[file.filename] = {"operation": 1, "status": 0}
-    await set_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT], ingest_json)
-    all_files = await get_all_files(current_app.config[CONFIG_BLOB_DOCUMENT_CONTAINER_CLIENT])
-    return jsonify(
-        {
-            "files": all_files,
-            "ingested": ingest_json,
-            "ingest_lock": await is_ingest_lock(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]),
-        }
-    )
+    return await save_uploads()
 
 
 @bp.route("/delete-file", methods=["POST"])
 async def delete_file():
     if not request.is_json:
         return jsonify({"error": "request must be json"}), 415
+    catalog = await loaded_catalog()
     request_json = await request.get_json()
     filename = request_json.get("file")
     ingest_json = await get_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT])
-    ingest_json[filename] = {"operation": 2, "status": 0}
-    await set_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT], ingest_json)
-    all_files = await get_all_files(current_app.config[CONFIG_BLOB_DOCUMENT_CONTAINER_CLIENT])
-    return jsonify(
-        {
-            "files": all_files,
-            "ingested": ingest_json,
-            "ingest_lock": await is_ingest_lock(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]),
-        }
-    )
+    ingest_json[filename] = {**ingest_json.get(filename, {}), "operation": 2, "status": 0}
+    await set_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT], ingest_json, catalog)
+    return jsonify(catalog.snapshot())
+
+
+async def sync_answer_cache():
+    # Cached answers are only valid for the index content they were generated from
+    answer_cache = current_app.config.get(CONFIG_ANSWER_CACHE)
+    if answer_cache is not None:
+        catalog = current_app.config[CONFIG_FILE_CATALOG]
+        await catalog.ensure_index_generation(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT])
+        answer_cache.sync_generation(catalog.index_version)
+
+
+async def coalesce(key: str, compute, route: str):
+    # Identical questions asked at the same time are answered by a single run of the approach
+    if single_flight := current_app.config.get(CONFIG_SINGLE_FLIGHT):
+        return await single_flight.run(key, compute, route)
+    return await compute()
 
 
 @bp.route("/ask", methods=["POST"])
@@ -275,13 +339,19 @@ async def ask():
         impl = current_app.config[CONFIG_ASK_APPROACHES].get(approach)
         if not impl:
             return jsonify({"error": "unknown approach"}), 400
-        # Workaround for: https://github.com/openai/openai-python/issues/371
-        async with aiohttp.ClientSession() as s:
-            openai.aiosession.set(s)
-            r = await impl.run(request_json["question"], request_json.get("overrides") or {})
-            questions = r.get("questions", [])
-            answers = r.get("answers", [])
-            r={"questions": questions, "answers": answers}
+        question, overrides = request_json["question"], request_json.get("overrides") or {}
+
+        async def answer():
+            # Workaround for: https://github.com/openai/openai-python/issues/371
+            async with aiohttp.ClientSession() as s:
+                openai.aiosession.set(s)
+                await sync_answer_cache()
+                return await impl.run(question, overrides)
+
+        r = await coalesce(request_key(approach, question, overrides), answer, "/ask")
+        questions = r.get("questions", [])
+        answers = r.get("answers", [])
+        r={"questions": questions, "answers": answers}
         return jsonify(r)
     except Exception as e:
         logging.exception("Exception in /ask")
@@ -298,13 +368,19 @@ async def chat():
         impl = current_app.config[CONFIG_CHAT_APPROACHES].get(approach)
         if not impl:
             return jsonify({"error": "unknown approach"}), 400
-        # Workaround for: https://github.com/openai/openai-python/issues/371
-        async with aiohttp.ClientSession() as s:
-            openai.aiosession.set(s)
-            r = await impl.run_without_streaming(request_json["history"], request_json.get("overrides", {}))
-            questions = r.get("questions", [])
-            answers = r.get("answers", [])
-            r={"questions": questions, "answers": answers}
+        history, overrides = request_json["history"], request_json.get("overrides", {})
+
+        async def answer():
+            # Workaround for: https://github.com/openai/openai-python/issues/371
+            async with aiohttp.ClientSession() as s:
+                openai.aiosession.set(s)
+                await sync_answer_cache()
+                return await impl.run_without_streaming(history, overrides)
+
+        r = await coalesce(request_key(approach, history, overrides), answer, "/chat")
+        questions = r.get("questions", [])
+        answers = r.get("answers", [])
+        r={"questions": questions, "answers": answers}
         return jsonify(r)
     except Exception as e:
         logging.exception("Exception in /chat")
@@ -314,8 +390,12 @@ async def chat():
         
 
 async def format_as_ndjson(r: AsyncGenerator[dict, None]) -> AsyncGenerator[str, None]:
-    async for event in r:
-        yield json.dumps(event, ensure_ascii=False) + "\n"
+    try:
+        async for event in r:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    finally:
+        # Quart closes the response body when the client disconnects, pass that on to the generator producing it
+        await r.aclose()
 
 
 @bp.route("/chat_stream", methods=["POST"])
@@ -328,8 +408,18 @@ async def chat_stream():
         impl = current_app.config[CONFIG_CHAT_APPROACHES].get(approach)
         if not impl:
             return jsonify({"error": "unknown approach"}), 400
-        response_generator = impl.run_with_streaming(request_json["history"], request_json.get("overrides", {}))
-        response = await make_response(format_as_ndjson(response_generator))
+        await sync_answer_cache()
+        history, overrides = request_json["history"], request_json.get("overrides", {})
+        if single_flight := current_app.config.get(CONFIG_SINGLE_FLIGHT):
+            # Identical questions streamed at the same time share one answer, each client receives all its events
+            response_generator = single_flight.stream(
+                request_key(approach, history, overrides),
+                lambda: impl.run_with_streaming(history, overrides),
+                "/chat_stream",
+            )
+        else:
+            response_generator = impl.run_with_streaming(history, overrides)
+        response = await make_response(format_as_ndjson(instrument_stream(response_generator, approach)))
         response.timeout = None  # type: ignore
         return response
     except Exception as e:
@@ -360,21 +450,21 @@ async def store_qa():
         'createdAt': datetime.utcnow().isoformat(),  
         'updatedAt': datetime.utcnow().isoformat()  
     }
-    container.upsert_item(item)
+    get_history_container().upsert_item(item)
     return 'ok'
 
 @bp.before_app_serving
 async def setup_clients():
     # Replace these with your own values, either in environment variables or directly here
-    AZURE_STORAGE_ACCOUNT = os.environ["AZURE_STORAGE_ACCOUNT"]
+    AZURE_STORAGE_ACCOUNT = os.getenv("AZURE_STORAGE_ACCOUNT")
     AZURE_STORAGE_CONTAINER = os.environ["AZURE_STORAGE_CONTAINER"]
     AZURE_STORAGE_DOCUMENT_CONTAINER = os.environ["AZURE_STORAGE_DOCUMENT_CONTAINER"]
-    AZURE_SEARCH_SERVICE = os.environ["AZURE_SEARCH_SERVICE"]
+    AZURE_SEARCH_SERVICE = os.getenv("AZURE_SEARCH_SERVICE")
     AZURE_SEARCH_INDEX = os.environ["AZURE_SEARCH_INDEX"]
 
     AZURE_STORAGE_ACCOUNT_KEY = os.environ["AZURE_STORAGE_ACCOUNT_KEY"]
     AZURE_SEARCH_SERVICE_KEY = os.environ["AZURE_SEARCH_SERVICE_KEY"]
-    AZURE_FORMRECOGNIZER_SERVICE = os.environ["AZURE_FORMRECOGNIZER_SERVICE"]
+    AZURE_FORMRECOGNIZER_SERVICE = os.getenv("AZURE_FORMRECOGNIZER_SERVICE")
     AZURE_FORMRECOGNIZER_KEY = os.environ["AZURE_FORMRECOGNIZER_KEY"]
     # Shared by all OpenAI deployments
     OPENAI_HOST = os.getenv("OPENAI_HOST", "azure")
@@ -383,12 +473,24 @@ async def setup_clients():
     # Used with Azure OpenAI deployments
     AZURE_OPENAI_KEY = os.environ["AZURE_OPENAI_KEY"]
     AZURE_OPENAI_SERVICE = os.getenv("AZURE_OPENAI_SERVICE")
+    AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT") or f"https://{AZURE_OPENAI_SERVICE}.openai.azure.com"
     AZURE_OPENAI_CHATGPT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHATGPT_DEPLOYMENT")
     AZURE_OPENAI_EMB_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT")
     # Used only with non-Azure OpenAI deployments
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     OPENAI_ORGANIZATION = os.getenv("OPENAI_ORGANIZATION")
 
+    # The endpoints default to the public Azure ones, point them elsewhere to run against local stand-ins
+    # (see benchmarks/mockserver.py)
+    AZURE_SEARCH_ENDPOINT = os.getenv("AZURE_SEARCH_ENDPOINT") or f"https://{AZURE_SEARCH_SERVICE}.search.windows.net"
+    AZURE_STORAGE_ENDPOINT = (
+        os.getenv("AZURE_STORAGE_ENDPOINT") or f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net"
+    )
+    AZURE_FORMRECOGNIZER_ENDPOINT = (
+        os.getenv("AZURE_FORMRECOGNIZER_ENDPOINT")
+        or f"https://{AZURE_FORMRECOGNIZER_SERVICE}.cognitiveservices.azure.com/"
+    )
+
     KB_FIELDS_CONTENT = os.getenv("KB_FIELDS_CONTENT", "content")
     KB_FIELDS_SOURCEPAGE = os.getenv("KB_FIELDS_SOURCEPAGE", "sourcepage")
 
@@ -399,22 +501,20 @@ async def setup_clients():
 
     # Set up clients for Cognitive Search and Storage
     search_index_client = SearchIndexClient(
-        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net/",
+        endpoint=AZURE_SEARCH_ENDPOINT,
         credential=AzureKeyCredential(AZURE_SEARCH_SERVICE_KEY),
     )
-    blob_client = BlobServiceClient(
-        account_url=f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net", credential=AZURE_STORAGE_ACCOUNT_KEY
-    )
+    blob_client = BlobServiceClient(account_url=AZURE_STORAGE_ENDPOINT, credential=AZURE_STORAGE_ACCOUNT_KEY)
     blob_container_client = blob_client.get_container_client(AZURE_STORAGE_CONTAINER)
     blob_document_container_client = blob_client.get_container_client(AZURE_STORAGE_DOCUMENT_CONTAINER)
     form_recognizer_client = DocumentAnalysisClient(
-        endpoint=f"https://{AZURE_FORMRECOGNIZER_SERVICE}.cognitiveservices.azure.com/",
+        endpoint=AZURE_FORMRECOGNIZER_ENDPOINT,
         credential=AzureKeyCredential(AZURE_FORMRECOGNIZER_KEY),
         headers={"x-ms-useragent": "azure-search-chat-demo/1.0.0"},
     )
     # Used by the OpenAI SDK
     if OPENAI_HOST == "azure":
-        openai.api_base = f"https://{AZURE_OPENAI_SERVICE}.openai.azure.com"
+        openai.api_base = AZURE_OPENAI_ENDPOINT
         openai.api_version = "2023-07-01-preview"
         openai.api_type = "azure"
         openai.api_key = AZURE_OPENAI_KEY
@@ -431,101 +531,146 @@ async def setup_clients():
     current_app.config[CONFIG_OPENAI_HOST] = OPENAI_HOST
     current_app.config[CONFIG_EMBEDDING_MODEL] = OPENAI_EMB_MODEL
     current_app.config[CONFIG_AZURE_OPENAI_EMB_DEPLOYMENT] = AZURE_OPENAI_EMB_DEPLOYMENT
-    all_files = await get_all_files(blob_document_container_client)
-    ingest_json = await get_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT])
-    for file in all_files:
-        if file not in ingest_json:
-            ingest_json[file] = {"status": 2}
-    await set_ingest_json(current_app.config[CONFIG_BLOB_CONTAINER_CLIENT], ingest_json)
-    if AZURE_SEARCH_INDEX not in search_index_client.list_index_names():
-        search_index = SearchIndex(
-            name=AZURE_SEARCH_INDEX,
-            fields=INDEX_FIELDS,
-            semantic_settings=SemanticSettings(
-                configurations=[
-                    SemanticConfiguration(
-                        name="default",
-                        prioritized_fields=PrioritizedFields(
-                            title_field=None, prioritized_content_fields=[SemanticField(field_name="content")]
-                        ),
-                    )
-                ]
-            ),
-            vector_search=VectorSearch(
-                algorithm_configurations=[
-                    VectorSearchAlgorithmConfiguration(
-                        name="default", kind="hnsw", hnsw_parameters=HnswParameters(metric="cosine")
-                    )
-                ]
-            ),
-        )
-        print(f"Creating {AZURE_SEARCH_INDEX} search index")
-        search_index_client.create_index(search_index)
-    else:
-        print(f"Search index {AZURE_SEARCH_INDEX} already exists")
+    # The file catalog is loaded on first use rather than by every worker as it boots
+    catalog = FileCatalog(refresh_interval=float(os.getenv("FILE_CATALOG_REFRESH_SECONDS", "10")))
+    current_app.config[CONFIG_FILE_CATALOG] = catalog
+    current_app.config[CONFIG_INGEST_EVENTS] = IngestEventBus()
+    # Under gunicorn the search index and ingest.json are set up once before the workers start, see bootstrap.py
+    if os.getenv(BOOTSTRAPPED_ENV) != "true":
+        with startup_step("bootstrap"):
+            await bootstrap(
+                search_index_client, AZURE_SEARCH_INDEX, blob_container_client, blob_document_container_client
+            )
     search_client = SearchClient(
-        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
+        endpoint=AZURE_SEARCH_ENDPOINT,
         index_name=AZURE_SEARCH_INDEX,
         credential=AzureKeyCredential(AZURE_SEARCH_SERVICE_KEY),
     )
     current_app.config[CONFIG_SEARCH_CLIENT] = search_client
 
-    # Various approaches to integrate GPT and external knowledge, most applications will use a single one of these patterns
-    # or some derivative, here we include several for exploration purposes
-    current_app.config[CONFIG_ASK_APPROACHES] = {
-        "rtr": RetrieveThenReadApproach(
-            search_client,
-            OPENAI_HOST,
-            AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-            OPENAI_CHATGPT_MODEL,
-            AZURE_OPENAI_EMB_DEPLOYMENT,
-            OPENAI_EMB_MODEL,
-            KB_FIELDS_SOURCEPAGE,
-            KB_FIELDS_CONTENT,
-        ),
-        "rrr": ReadRetrieveReadApproach(
+    ingest_runner = IngestJobRunner(
+        blob_container_client,
+        (
             search_client,
+            AZURE_SEARCH_INDEX,
+            blob_container_client,
+            blob_document_container_client,
+            form_recognizer_client,
+            openai,
             OPENAI_HOST,
-            AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-            OPENAI_CHATGPT_MODEL,
             AZURE_OPENAI_EMB_DEPLOYMENT,
             OPENAI_EMB_MODEL,
-            KB_FIELDS_SOURCEPAGE,
-            KB_FIELDS_CONTENT,
         ),
-        "rda": ReadDecomposeAsk(
-            search_client,
-            OPENAI_HOST,
-            AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-            OPENAI_CHATGPT_MODEL,
-            AZURE_OPENAI_EMB_DEPLOYMENT,
+        catalog=current_app.config[CONFIG_FILE_CATALOG],
+        events=current_app.config[CONFIG_INGEST_EVENTS],
+        poll_interval=float(os.getenv("INGEST_POLL_SECONDS", "15")),
+        max_attempts=int(os.getenv("INGEST_MAX_ATTEMPTS", "3")),
+        dedup_policy=os.getenv("DEDUP_POLICY") or None,
+        dedup_threshold=float(os.getenv("DEDUP_THRESHOLD", "0.9")),
+        chunker=os.getenv("INGEST_CHUNKER", "characters"),
+        chunker_factory=lambda name: make_chunker(
+            name,
             OPENAI_EMB_MODEL,
-            KB_FIELDS_SOURCEPAGE,
-            KB_FIELDS_CONTENT,
+            max_tokens=int(os.getenv("CHUNK_MAX_TOKENS", "500")),
+            overlap_tokens=int(os.getenv("CHUNK_OVERLAP_TOKENS", "50")),
         ),
-    }
-    current_app.config[CONFIG_CHAT_APPROACHES] = {
-        "rrr": ChatReadRetrieveReadApproach(
-            search_client,
-            OPENAI_HOST,
-            AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-            OPENAI_CHATGPT_MODEL,
-            AZURE_OPENAI_EMB_DEPLOYMENT,
-            OPENAI_EMB_MODEL,
-            KB_FIELDS_SOURCEPAGE,
-            KB_FIELDS_CONTENT,
+    )
+    current_app.config[CONFIG_INGEST_RUNNER] = ingest_runner
+    if os.getenv("INGEST_WORKER_MODE", "inline") == "inline":
+        current_app.config[CONFIG_INGEST_RUNNER_TASK] = create_task(ingest_runner.run_forever())
+
+    # Vector searches can be served from a local snapshot of the embeddings, see scripts/exportembeddings.py
+    approach_search_client = search_client
+    if os.getenv("LOCAL_VECTOR_INDEX_PATH"):
+        with startup_step("load_local_vector_index"):
+            local_index = LocalVectorIndex.load(os.environ["LOCAL_VECTOR_INDEX_PATH"])
+        approach_search_client = LocalSearchClient(local_index, KB_FIELDS_CONTENT, fallback=search_client)
+
+    # The approaches only read from the index, so their searches can be cached until ingestion changes it
+    if os.getenv("SEARCH_CACHE_ENABLED", "false").lower() == "true":
+
+        async def search_generation():
+            await catalog.ensure_index_generation(blob_container_client)
+            return catalog.index_version
+
+        approach_search_client = CachedSearchClient(
+            approach_search_client,
+            search_generation,
+            max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1000")),
+            ttl=float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "300")),
         )
-    }
+
+    answer_cache = None
+    if os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true":
+        answer_cache = AnswerCache(
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.97")),
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000")),
+        )
+    current_app.config[CONFIG_ANSWER_CACHE] = answer_cache
+    if os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true":
+        current_app.config[CONFIG_SINGLE_FLIGHT] = SingleFlight()
+
+    # Various approaches to integrate GPT and external knowledge, most applications will use a single one of these patterns
+    # or some derivative, here we include several for exploration purposes. Each one is imported and built on first use,
+    # and ASK_APPROACHES / CHAT_APPROACHES can limit a deployment to the ones it serves, e.g. CHAT_APPROACHES=rrr
+    approach_args = (
+        approach_search_client,
+        OPENAI_HOST,
+        AZURE_OPENAI_CHATGPT_DEPLOYMENT,
+        OPENAI_CHATGPT_MODEL,
+        AZURE_OPENAI_EMB_DEPLOYMENT,
+        OPENAI_EMB_MODEL,
+        KB_FIELDS_SOURCEPAGE,
+        KB_FIELDS_CONTENT,
+    )
+    current_app.config[CONFIG_ASK_APPROACHES] = ApproachRegistry(
+        {
+            "rtr": lazy_approach(*ASK_APPROACH_CLASSES["rtr"], *approach_args, answer_cache),
+            "rrr": lazy_approach(*ASK_APPROACH_CLASSES["rrr"], *approach_args),
+            "rda": lazy_approach(*ASK_APPROACH_CLASSES["rda"], *approach_args),
+        },
+        enabled=enabled_approaches(os.getenv("ASK_APPROACHES")),
+    )
+    current_app.config[CONFIG_CHAT_APPROACHES] = ApproachRegistry(
+        {
+            "rrr": lazy_approach(*CHAT_APPROACH_CLASSES["rrr"], *approach_args, answer_cache),
+        },
+        enabled=enabled_approaches(os.getenv("CHAT_APPROACHES")),
+    )
+    # With STARTUP_PROFILE=true, report the time this worker spent on imports and on each step of starting up
+    emit_startup_profile()
+
+
+@bp.after_app_serving
+async def stop_ingest_runner():
+    # Cancelling releases the ingest lock lease so another worker can resume the job right away
+    if task := current_app.config.get(CONFIG_INGEST_RUNNER_TASK):
+        task.cancel()
+        try:
+            await task
+        except CancelledError:
+            pass
 
 
 def create_app():
     if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
-        configure_azure_monitor()
-        AioHttpClientInstrumentor().instrument()
+        with startup_step("configure_azure_monitor"):
+            configure_azure_monitor()
+            AioHttpClientInstrumentor().instrument()
     app = Quart(__name__)
     max_mb_upload = 200
     app.config["MAX_CONTENT_LENGTH"] = max_mb_upload * 1000 * 1024
     app.register_blueprint(bp)
+    # Bound how many questions each worker answers at once, the rest queue briefly or get a 503, see serverconfig.py
+    config = server_config()
+    if config.max_inflight > 0:
+        app.asgi_app = AdmissionController(
+            app.asgi_app,
+            max_inflight=config.max_inflight,
+            max_queued=config.max_queued,
+            queue_timeout=config.queue_timeout,
+            paths=os.getenv("ADMISSION_PATHS", "/ask,/chat,/chat_stream").split(","),
+        )
     app.asgi_app = OpenTelemetryMiddleware(app.asgi_app)
     # Level should be one of https://docs.python.org/3/library/logging.html#logging-levels
     logging.basicConfig(level=os.getenv("APP_LOG_LEVEL", "ERROR"))
@@ -1,12 +1,15 @@
 import json
-from typing import Any, AsyncGenerator
+from typing import Any, AsyncGenerator, Optional
 
 import openai
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.models import QueryType
 
+from core.answercache import AnswerCache
+from core.instrumentation import current_breakdown, mark, stage, start_breakdown
 from core.messagebuilder import MessageBuilder
-from core.modelhelper import get_token_limit
+from core.modelhelper import get_token_limit, num_tokens_from_messages
+from core.sourcepacker import Source, SourcePacker, search_score
 from text import nonewlines
 
 
@@ -61,6 +64,7 @@ If you cannot generate a search query, return just the number 0.
         embedding_model: str,
         sourcepage_field: str,
         content_field: str,
+        answer_cache: Optional[AnswerCache] = None,
     ):
         self.search_client = search_client
         self.openai_host = openai_host
@@ -71,10 +75,16 @@ If you cannot generate a search query, return just the number 0.
         self.sourcepage_field = sourcepage_field
         self.content_field = content_field
         self.chatgpt_token_limit = get_token_limit(chatgpt_model)
+        self.response_token_limit = 1024
+        # Largest share of the prompt the conversation history can keep from the sources
+        self.history_share = 0.25
+        self.source_packer = SourcePacker.for_model(chatgpt_model)
+        self.answer_cache = answer_cache
 
     async def run_until_final_call(
         self, history: list[dict[str, str]], overrides: dict[str, Any], should_stream: bool = False
     ) -> tuple:
+        breakdown = current_breakdown() or start_breakdown("chat")
         has_text = overrides.get("retrieval_mode") in ["text", "hybrid", None]
         has_vector = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
         use_semantic_captions = True if overrides.get("semantic_captions") and has_text else False
@@ -112,16 +122,17 @@ If you cannot generate a search query, return just the number 0.
         )
 
         chatgpt_args = {"deployment_id": self.chatgpt_deployment} if self.openai_host == "azure" else {}
-        chat_completion = await openai.ChatCompletion.acreate(
-            **chatgpt_args,
-            model=self.chatgpt_model,
-            messages=messages,
-            temperature=0.0,
-            max_tokens=32,
-            n=1,
-            functions=functions,
-            function_call="auto",
-        )
+        with stage("query_rewrite", model=self.chatgpt_model, history_length=len(history)):
+            chat_completion = await openai.ChatCompletion.acreate(
+                **chatgpt_args,
+                model=self.chatgpt_model,
+                messages=messages,
+                temperature=0.0,
+                max_tokens=32,
+                n=1,
+                functions=functions,
+                function_call="auto",
+            )
 
         query_text = self.get_search_query(chat_completion, history[-1]["user"])
 
@@ -130,7 +141,10 @@ If you cannot generate a search query, return just the number 0.
         # If retrieval mode includes vectors, compute an embedding for the query
         if has_vector:
             embedding_args = {"deployment_id": self.embedding_deployment} if self.openai_host == "azure" else {}
-            embedding = await openai.Embedding.acreate(**embedding_args, model=self.embedding_model, input=query_text)
+            with stage("embedding", model=self.embedding_model):
+                embedding = await openai.Embedding.acreate(
+                    **embedding_args, model=self.embedding_model, input=query_text
+                )
             query_vector = embedding["data"][0]["embedding"]
         else:
             query_vector = None
@@ -139,38 +153,51 @@ If you cannot generate a search query, return just the number 0.
         if not has_text:
             query_text = None
 
-        # Use semantic L2 reranker if requested and if retrieval mode is text or hybrid (vectors + text)
-        if overrides.get("semantic_ranker") and has_text:
-            r = await self.search_client.search(
-                query_text,
-                filter=filter,
-                query_type=QueryType.SEMANTIC,
-                query_language="en-us",
-                query_speller="lexicon",
-                semantic_configuration_name="default",
-                top=top,
-                query_caption="extractive|highlight-false" if use_semantic_captions else None,
-                vector=query_vector,
-                top_k=50 if query_vector else None,
-                vector_fields="embedding" if query_vector else None,
-            )
-        else:
-            r = await self.search_client.search(
-                query_text,
-                filter=filter,
-                top=top,
-                vector=query_vector,
-                top_k=50 if query_vector else None,
-                vector_fields="embedding" if query_vector else None,
-            )
-        if use_semantic_captions:
-            results = [
-                doc[self.sourcepage_field] + ": " + nonewlines(" . ".join([c.text for c in doc["@search.captions"]]))
-                async for doc in r
-            ]
-        else:
-            results = [doc[self.sourcepage_field] + ": " + nonewlines(doc[self.content_field]) async for doc in r]
-        content = "\n".join(results)
+        with stage(
+            "search",
+            top=top,
+            retrieval_mode=overrides.get("retrieval_mode") or "hybrid",
+            semantic_ranker=bool(overrides.get("semantic_ranker") and has_text),
+        ) as search_stage:
+            # Use semantic L2 reranker if requested and if retrieval mode is text or hybrid (vectors + text)
+            if overrides.get("semantic_ranker") and has_text:
+                r = await self.search_client.search(
+                    query_text,
+                    filter=filter,
+                    query_type=QueryType.SEMANTIC,
+                    query_language="en-us",
+                    query_speller="lexicon",
+                    semantic_configuration_name="default",
+                    top=top,
+                    query_caption="extractive|highlight-false" if use_semantic_captions else None,
+                    vector=query_vector,
+                    top_k=50 if query_vector else None,
+                    vector_fields="embedding" if query_vector else None,
+                )
+            else:
+                r = await self.search_client.search(
+                    query_text,
+                    filter=filter,
+                    top=top,
+                    vector=query_vector,
+                    top_k=50 if query_vector else None,
+                    vector_fields="embedding" if query_vector else None,
+                )
+            if use_semantic_captions:
+                sources = [
+                    Source(
+                        doc[self.sourcepage_field],
+                        nonewlines(" . ".join([c.text for c in doc["@search.captions"]])),
+                        search_score(doc),
+                    )
+                    async for doc in r
+                ]
+            else:
+                sources = [
+                    Source(doc[self.sourcepage_field], nonewlines(doc[self.content_field]), search_score(doc))
+                    async for doc in r
+                ]
+            search_stage.set(results=len(sources))
 
         follow_up_questions_prompt = (
             self.follow_up_questions_prompt_content if overrides.get("suggest_followup_questions") else ""
@@ -191,15 +218,10 @@ If you cannot generate a search query, return just the number 0.
         else:
             system_message = prompt_override.format(follow_up_questions_prompt=follow_up_questions_prompt)
 
-        messages = self.get_messages_from_history(
-            system_message,
-            self.chatgpt_model,
-            history,
-            # Model does not handle lengthy system messages well.
-            # Moved sources to latest user conversation to solve follow up questions prompt.
-            history[-1]["user"] + "\n\nSources:\n" + content,
-            max_tokens=self.chatgpt_token_limit,
-        )
+        with stage("prompt") as prompt_stage:
+            messages, results, source_budget = self.pack_prompt(system_message, history, sources)
+            prompt_stage.set(source_budget=source_budget, sources=len(results), history_length=len(history))
+
         msg_to_display = "\n\n".join([str(message) for message in messages])
 
         extra_info = {
@@ -207,34 +229,126 @@ If you cannot generate a search query, return just the number 0.
             "thoughts": f"Searched for:<br>{query_text}<br><br>Conversations:<br>"
             + msg_to_display.replace("\n", "<br>"),
         }
+        if overrides.get("latency_breakdown"):
+            extra_info["latency"] = breakdown.to_dict()
 
         chat_coroutine = openai.ChatCompletion.acreate(
             **chatgpt_args,
             model=self.chatgpt_model,
             messages=messages,
             temperature=overrides.get("temperature") or 0.7,
-            max_tokens=1024,
+            max_tokens=self.response_token_limit,
             n=1,
             stream=should_stream,
         )
         return (extra_info, chat_coroutine)
 
+    def pack_prompt(
+        self, system_message: str, history: list[dict[str, str]], sources: list[Source]
+    ) -> tuple[list, list[str], int]:
+        """
+        Fits the sources and the conversation history in what the system message, the question and the answer leave
+        of the context window. Up to `history_share` of it is set aside for the history before the sources are packed,
+        the history then gets whatever the sources left. Returns the messages, the packed sources and their budget.
+        """
+        question = history[-1]["user"] + "\n\nSources:\n"
+        prompt_budget = self.chatgpt_token_limit - self.response_token_limit
+        available = prompt_budget - self.source_packer.count(system_message) - self.source_packer.count(question) - 8
+        history_tokens = sum(
+            self.source_packer.count(text) + 4 for turn in history[:-1] for text in turn.values() if text
+        )
+        source_budget = available - min(history_tokens, int(available * self.history_share))
+        results = self.source_packer.pack(sources, source_budget)
+
+        messages = self.get_messages_from_history(
+            system_message,
+            self.chatgpt_model,
+            history,
+            # Model does not handle lengthy system messages well.
+            # Moved sources to latest user conversation to solve follow up questions prompt.
+            question + "\n".join(results),
+            max_tokens=prompt_budget,
+        )
+        return messages, results, source_budget
+
+    async def lookup_cached_answer(
+        self, history: list[dict[str, str]], overrides: dict[str, Any]
+    ) -> tuple[Optional[tuple], Optional[dict[str, Any]]]:
+        # Later turns depend on the rest of the conversation, so only opening questions are cached
+        if self.answer_cache is None or len(history) != 1:
+            return None, None
+        embedding_args = {"deployment_id": self.embedding_deployment} if self.openai_host == "azure" else {}
+        with stage("embedding", model=self.embedding_model):
+            embedding = await openai.Embedding.acreate(
+                **embedding_args, model=self.embedding_model, input=history[-1]["user"]
+            )
+        cache_key = (embedding["data"][0]["embedding"], AnswerCache.make_scope("chat", overrides))
+        with stage("answer_cache") as cache_stage:
+            cached = self.answer_cache.lookup(*cache_key)
+            # Remembered so the answer is not stored if the index changes before it is generated
+            cache_key += (self.answer_cache.generation,)
+            cache_stage.set(cache_hit=cached is not None)
+        if cached is not None and overrides.get("latency_breakdown"):
+            cached["latency"] = current_breakdown().to_dict()
+        return cache_key, cached
+
     async def run_without_streaming(self, history: list[dict[str, str]], overrides: dict[str, Any]) -> dict[str, Any]:
+        breakdown = start_breakdown("chat")
+        cache_key, cached = await self.lookup_cached_answer(history, overrides)
+        if cached is not None:
+            return cached
         extra_info, chat_coroutine = await self.run_until_final_call(history, overrides, should_stream=False)
-        chat_resp = await chat_coroutine
+        with stage("completion", model=self.chatgpt_model) as completion_stage:
+            chat_resp = await chat_coroutine
+            usage = chat_resp.get("usage") or {}
+            completion_stage.set(
+                prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens")
+            )
         chat_content = chat_resp.choices[0].message.content
         extra_info["answer"] = chat_content
+        if cache_key is not None:
+            vector, scope, generation = cache_key
+            self.answer_cache.store(
+                vector, scope, {key: value for key, value in extra_info.items() if key != "latency"}, generation
+            )
+        if overrides.get("latency_breakdown"):
+            extra_info["latency"] = breakdown.to_dict()
         return extra_info
 
     async def run_with_streaming(
         self, history: list[dict[str, str]], overrides: dict[str, Any]
     ) -> AsyncGenerator[dict, None]:
+        start_breakdown("chat")
+        cache_key, cached = await self.lookup_cached_answer(history, overrides)
+        if cached is not None:
+            answer = cached.pop("answer")
+            yield cached
+            yield {
+                "choices": [{"index": 0, "delta": {"role": self.ASSISTANT, "content": answer}, "finish_reason": "stop"}]
+            }
+            return
         extra_info, chat_coroutine = await self.run_until_final_call(history, overrides, should_stream=True)
         yield extra_info
-        async for event in await chat_coroutine:
-            # "2023-07-01-preview" API version has a bug where first response has empty choices
-            if event["choices"]:
-                yield event
+        answer = []
+        stream = await chat_coroutine
+        try:
+            async for event in stream:
+                # "2023-07-01-preview" API version has a bug where first response has empty choices
+                if event["choices"]:
+                    if not answer:
+                        mark("first_token")
+                    answer.append(event["choices"][0]["delta"].get("content") or "")
+                    yield event
+        finally:
+            # Closing the OpenAI stream, when the client went away, releases its connection and stops generation
+            if aclose := getattr(stream, "aclose", None):
+                await aclose()
+        mark("last_token")
+        # Only reached when the whole answer was streamed, an interrupted answer is not cached
+        if cache_key is not None:
+            extra_info.pop("latency", None)
+            vector, scope, generation = cache_key
+            self.answer_cache.store(vector, scope, {**extra_info, "answer": "".join(answer)}, generation)
 
     def get_messages_from_history(
         self,
@@ -258,12 +372,15 @@ If you cannot generate a search query, return just the number 0.
         message_builder.append_message(self.USER, user_content, index=append_index)
 
         for h in reversed(history[:-1]):
-            if bot_msg := h.get("bot"):
-                message_builder.append_message(self.ASSISTANT, bot_msg, index=append_index)
-            if user_msg := h.get("user"):
-                message_builder.append_message(self.USER, user_msg, index=append_index)
-            if message_builder.token_length > max_tokens:
+            turn = [(role, h.get(key)) for role, key in ((self.ASSISTANT, "bot"), (self.USER, "user")) if h.get(key)]
+            turn_tokens = sum(
+                num_tokens_from_messages({"role": role, "content": content}, model_id) for role, content in turn
+            )
+            # Older turns are left out once the next one would no longer fit
+            if message_builder.token_length + turn_tokens > max_tokens:
                 break
+            for role, content in turn:
+                message_builder.append_message(role, content, index=append_index)
 
         messages = message_builder.messages
         return messages
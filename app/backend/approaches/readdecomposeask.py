@@ -12,6 +12,9 @@ from langchain.prompts import BasePromptTemplate, PromptTemplate
 from langchain.tools.base import BaseTool
 
 from approaches.approach import AskApproach
+from core.instrumentation import stage, start_breakdown
+from core.modelhelper import get_token_limit
+from core.sourcepacker import Source, SourcePacker, search_score
 from langchainadapters import HtmlCallbackHandler
 from text import nonewlines
 
@@ -36,6 +39,9 @@ class ReadDecomposeAsk(AskApproach):
         self.sourcepage_field = sourcepage_field
         self.content_field = content_field
         self.openai_host = openai_host
+        # The agent may search several times, each observation gets an eighth of the context window
+        self.source_token_budget = get_token_limit(openai_model) // 8
+        self.source_packer = SourcePacker.for_model(openai_model)
 
     async def search(self, query_text: str, overrides: dict[str, Any]) -> tuple[list[str], str]:
         has_text = overrides.get("retrieval_mode") in ["text", "hybrid", None]
@@ -48,7 +54,10 @@ class ReadDecomposeAsk(AskApproach):
         # If retrieval mode includes vectors, compute an embedding for the query
         if has_vector:
             embedding_args = {"deployment_id": self.embedding_deployment} if self.openai_host == "azure" else {}
-            embedding = await openai.Embedding.acreate(**embedding_args, model=self.embedding_model, input=query_text)
+            with stage("embedding", model=self.embedding_model):
+                embedding = await openai.Embedding.acreate(
+                    **embedding_args, model=self.embedding_model, input=query_text
+                )
             query_vector = embedding["data"][0]["embedding"]
         else:
             query_vector = None
@@ -57,36 +66,51 @@ class ReadDecomposeAsk(AskApproach):
         if not has_text:
             query_text = ""
 
-        if overrides.get("semantic_ranker") and has_text:
-            r = await self.search_client.search(
-                query_text,
-                filter=filter,
-                query_type=QueryType.SEMANTIC,
-                query_language="en-us",
-                query_speller="lexicon",
-                semantic_configuration_name="default",
-                top=top,
-                query_caption="extractive|highlight-false" if use_semantic_captions else None,
-                vector=query_vector,
-                top_k=50 if query_vector else None,
-                vector_fields="embedding" if query_vector else None,
-            )
-        else:
-            r = await self.search_client.search(
-                query_text,
-                filter=filter,
-                top=top,
-                vector=query_vector,
-                top_k=50 if query_vector else None,
-                vector_fields="embedding" if query_vector else None,
-            )
-        if use_semantic_captions:
-            self.results = [
-                doc[self.sourcepage_field] + ":" + nonewlines(" . ".join([c.text for c in doc["@search.captions"]]))
-                async for doc in r
-            ]
-        else:
-            results = [doc[self.sourcepage_field] + ":" + nonewlines(doc[self.content_field][:500]) async for doc in r]
+        with stage(
+            "search",
+            top=top,
+            retrieval_mode=overrides.get("retrieval_mode") or "hybrid",
+            semantic_ranker=bool(overrides.get("semantic_ranker") and has_text),
+        ) as search_stage:
+            if overrides.get("semantic_ranker") and has_text:
+                r = await self.search_client.search(
+                    query_text,
+                    filter=filter,
+                    query_type=QueryType.SEMANTIC,
+                    query_language="en-us",
+                    query_speller="lexicon",
+                    semantic_configuration_name="default",
+                    top=top,
+                    query_caption="extractive|highlight-false" if use_semantic_captions else None,
+                    vector=query_vector,
+                    top_k=50 if query_vector else None,
+                    vector_fields="embedding" if query_vector else None,
+                )
+            else:
+                r = await self.search_client.search(
+                    query_text,
+                    filter=filter,
+                    top=top,
+                    vector=query_vector,
+                    top_k=50 if query_vector else None,
+                    vector_fields="embedding" if query_vector else None,
+                )
+            if use_semantic_captions:
+                sources = [
+                    Source(
+                        doc[self.sourcepage_field],
+                        nonewlines(" . ".join([c.text for c in doc["@search.captions"]])),
+                        search_score(doc),
+                    )
+                    async for doc in r
+                ]
+            else:
+                sources = [
+                    Source(doc[self.sourcepage_field], nonewlines(doc[self.content_field]), search_score(doc))
+                    async for doc in r
+                ]
+            search_stage.set(results=len(sources))
+        results = self.source_packer.pack(sources, self.source_token_budget, separator=":")
         return results, "\n".join(results)
 
     async def lookup(self, q: str) -> Optional[str]:
@@ -110,6 +134,7 @@ class ReadDecomposeAsk(AskApproach):
         return None
 
     async def run(self, q: str, overrides: dict[str, Any]) -> dict[str, Any]:
+        breakdown = start_breakdown("rda")
         search_results = None
 
         async def search_and_store(q: str) -> Any:
@@ -165,13 +190,17 @@ class ReadDecomposeAsk(AskApproach):
 
         agent = ReAct.from_llm_and_tools(llm, tools)
         chain = AgentExecutor.from_agent_and_tools(agent, tools, verbose=True, callback_manager=cb_manager)
-        result = await chain.arun(q)
+        with stage("agent", model=self.openai_model):
+            result = await chain.arun(q)
 
         # Replace substrings of the form <file.ext> with [file.ext] so that the frontend can render them as links, match them with a regex to avoid
         # generalizing too much and disrupt HTML snippets if present
         result = re.sub(r"<([a-zA-Z0-9_ \-\.]+)>", r"[\1]", result)
 
-        return {"data_points": search_results or [], "answer": result, "thoughts": cb_handler.get_and_reset_log()}
+        answer = {"data_points": search_results or [], "answer": result, "thoughts": cb_handler.get_and_reset_log()}
+        if overrides.get("latency_breakdown"):
+            answer["latency"] = breakdown.to_dict()
+        return answer
 
 
 # Modified version of langchain's ReAct prompt that includes instructions and examples for how to cite information sources
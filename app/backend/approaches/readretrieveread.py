@@ -9,10 +9,15 @@ from langchain.chains import LLMChain
 from langchain.llms.openai import AzureOpenAI, OpenAI
 
 from approaches.approach import AskApproach
+from core.instrumentation import stage, start_breakdown
+from core.modelhelper import get_token_limit
+from core.sourcepacker import Source, SourcePacker, search_score
 from langchainadapters import HtmlCallbackHandler
 from lookuptool import CsvLookupTool
 from text import nonewlines
 
+EMPLOYEE_INFO_CSV = "data/employeeinfo.csv"
+
 
 class ReadRetrieveReadApproach(AskApproach):
     """
@@ -67,6 +72,9 @@ Thought: {agent_scratchpad}"""
         self.sourcepage_field = sourcepage_field
         self.content_field = content_field
         self.openai_host = openai_host
+        # The agent may search several times, each observation gets an eighth of the context window
+        self.source_token_budget = get_token_limit(openai_model) // 8
+        self.source_packer = SourcePacker.for_model(openai_model)
 
     async def retrieve(self, query_text: str, overrides: dict[str, Any]) -> Any:
         has_text = overrides.get("retrieval_mode") in ["text", "hybrid", None]
@@ -79,7 +87,10 @@ Thought: {agent_scratchpad}"""
         # If retrieval mode includes vectors, compute an embedding for the query
         if has_vector:
             embedding_args = {"deployment_id": self.embedding_deployment} if self.openai_host == "azure" else {}
-            embedding = await openai.Embedding.acreate(**embedding_args, model=self.embedding_model, input=query_text)
+            with stage("embedding", model=self.embedding_model):
+                embedding = await openai.Embedding.acreate(
+                    **embedding_args, model=self.embedding_model, input=query_text
+                )
             query_vector = embedding["data"][0]["embedding"]
         else:
             query_vector = None
@@ -88,41 +99,57 @@ Thought: {agent_scratchpad}"""
         if not has_text:
             query_text = ""
 
-        # Use semantic ranker if requested and if retrieval mode is text or hybrid (vectors + text)
-        if overrides.get("semantic_ranker") and has_text:
-            r = await self.search_client.search(
-                query_text,
-                filter=filter,
-                query_type=QueryType.SEMANTIC,
-                query_language="en-us",
-                query_speller="lexicon",
-                semantic_configuration_name="default",
-                top=top,
-                query_caption="extractive|highlight-false" if use_semantic_captions else None,
-                vector=query_vector,
-                top_k=50 if query_vector else None,
-                vector_fields="embedding" if query_vector else None,
-            )
-        else:
-            r = await self.search_client.search(
-                query_text,
-                filter=filter,
-                top=top,
-                vector=query_vector,
-                top_k=50 if query_vector else None,
-                vector_fields="embedding" if query_vector else None,
-            )
-        if use_semantic_captions:
-            results = [
-                doc[self.sourcepage_field] + ":" + nonewlines(" -.- ".join([c.text for c in doc["@search.captions"]]))
-                async for doc in r
-            ]
-        else:
-            results = [doc[self.sourcepage_field] + ":" + nonewlines(doc[self.content_field][:250]) async for doc in r]
+        with stage(
+            "search",
+            top=top,
+            retrieval_mode=overrides.get("retrieval_mode") or "hybrid",
+            semantic_ranker=bool(overrides.get("semantic_ranker") and has_text),
+        ) as search_stage:
+            # Use semantic ranker if requested and if retrieval mode is text or hybrid (vectors + text)
+            if overrides.get("semantic_ranker") and has_text:
+                r = await self.search_client.search(
+                    query_text,
+                    filter=filter,
+                    query_type=QueryType.SEMANTIC,
+                    query_language="en-us",
+                    query_speller="lexicon",
+                    semantic_configuration_name="default",
+                    top=top,
+                    query_caption="extractive|highlight-false" if use_semantic_captions else None,
+                    vector=query_vector,
+                    top_k=50 if query_vector else None,
+                    vector_fields="embedding" if query_vector else None,
+                )
+            else:
+                r = await self.search_client.search(
+                    query_text,
+                    filter=filter,
+                    top=top,
+                    vector=query_vector,
+                    top_k=50 if query_vector else None,
+                    vector_fields="embedding" if query_vector else None,
+                )
+            if use_semantic_captions:
+                sources = [
+                    Source(
+                        doc[self.sourcepage_field],
+                        nonewlines(" -.- ".join([c.text for c in doc["@search.captions"]])),
+                        search_score(doc),
+                    )
+                    async for doc in r
+                ]
+            else:
+                sources = [
+                    Source(doc[self.sourcepage_field], nonewlines(doc[self.content_field]), search_score(doc))
+                    async for doc in r
+                ]
+            search_stage.set(results=len(sources))
+        results = self.source_packer.pack(sources, self.source_token_budget, separator=":")
         content = "\n".join(results)
         return results, content
 
     async def run(self, q: str, overrides: dict[str, Any]) -> dict[str, Any]:
+        breakdown = start_breakdown("rrr")
         retrieve_results = None
 
         async def retrieve_and_store(q: str) -> Any:
@@ -150,7 +177,7 @@ Thought: {agent_scratchpad}"""
             suffix=overrides.get("prompt_template_suffix") or self.template_suffix,
             input_variables=["input", "agent_scratchpad"],
         )
-        if self.openai_type == "azure":
+        if self.openai_host == "azure":
             llm = AzureOpenAI(
                 deployment_name=self.openai_deployment,
                 temperature=overrides.get("temperature", 0.3),
@@ -167,12 +194,16 @@ Thought: {agent_scratchpad}"""
         agent_exec = AgentExecutor.from_agent_and_tools(
             agent=ZeroShotAgent(llm_chain=chain), tools=tools, verbose=True, callback_manager=cb_manager
         )
-        result = await agent_exec.arun(q)
+        with stage("agent", model=self.openai_model):
+            result = await agent_exec.arun(q)
 
         # Remove references to tool names that might be confused with a citation
         result = result.replace("[CognitiveSearch]", "").replace("[Employee]", "")
 
-        return {"data_points": retrieve_results or [], "answer": result, "thoughts": cb_handler.get_and_reset_log()}
+        answer = {"data_points": retrieve_results or [], "answer": result, "thoughts": cb_handler.get_and_reset_log()}
+        if overrides.get("latency_breakdown"):
+            answer["latency"] = breakdown.to_dict()
+        return answer
 
 
 class EmployeeInfoTool(CsvLookupTool):
@@ -180,7 +211,7 @@ class EmployeeInfoTool(CsvLookupTool):
 
     def __init__(self, employee_name: str, callbacks: Callbacks = None):
         super().__init__(
-            filename="data/employeeinfo.csv",
+            filename=EMPLOYEE_INFO_CSV,
             key_field="name",
             name="Employee",
             description="useful for answering questions about the employee, their benefits and other personal information",
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from importlib import import_module
+from typing import Any, Callable, Iterable
+
+# The module and class of each approach id, so they can be imported without building the approaches
+ASK_APPROACH_CLASSES = {
+    "rtr": ("approaches.retrievethenread", "RetrieveThenReadApproach"),
+    "rrr": ("approaches.readretrieveread", "ReadRetrieveReadApproach"),
+    "rda": ("approaches.readdecomposeask", "ReadDecomposeAsk"),
+}
+CHAT_APPROACH_CLASSES = {
+    "rrr": ("approaches.chatreadretrieveread", "ChatReadRetrieveReadApproach"),
+}
+
+
+def lazy_approach(module: str, class_name: str, *args) -> Callable[[], Any]:
+    """
+    Returns a factory that imports `module` and builds `class_name` with `args` when called
+    """
+
+    def build():
+        return getattr(import_module(module), class_name)(*args)
+
+    return build
+
+
+class ApproachRegistry:
+    """
+    Maps approach ids to approaches that are only built, and whose modules are only imported, the first time the id
+    is requested. Most deployments only serve one or two approaches, so a worker does not pay for importing
+    LangChain or building the others. When `enabled` is given, the other ids are unknown to the registry.
+    """
+
+    def __init__(self, factories: dict[str, Callable[[], Any]], enabled: Iterable[str] | None = None):
+        if enabled is not None:
+            enabled = set(enabled)
+            if unknown := enabled - factories.keys():
+                raise ValueError(f"Unknown approaches {', '.join(sorted(unknown))}, expected {', '.join(factories)}")
+            factories = {approach_id: factory for approach_id, factory in factories.items() if approach_id in enabled}
+        self.factories = factories
+        self.approaches: dict[str, Any] = {}
+
+    def get(self, approach_id: str) -> Any | None:
+        if approach_id not in self.approaches:
+            factory = self.factories.get(approach_id)
+            if factory is None:
+                return None
+            self.approaches[approach_id] = factory()
+        return self.approaches[approach_id]
+
+
+def enabled_approaches(value: str | None) -> list[str] | None:
+    """
+    Parses a comma separated allow-list such as "rtr,rrr", an unset or empty value enables every approach
+    """
+    if not value:
+        return None
+    return [approach_id.strip() for approach_id in value.split(",") if approach_id.strip()]
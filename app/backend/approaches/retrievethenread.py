@@ -1,11 +1,15 @@
-from typing import Any
+from typing import Any, Optional
 
 import openai
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.models import QueryType
 
 from approaches.approach import AskApproach
+from core.answercache import AnswerCache
+from core.instrumentation import stage, start_breakdown
 from core.messagebuilder import MessageBuilder
+from core.modelhelper import get_token_limit
+from core.sourcepacker import Source, SourcePacker, search_score
 from text import nonewlines
 
 
@@ -47,6 +51,7 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
         embedding_model: str,
         sourcepage_field: str,
         content_field: str,
+        answer_cache: Optional[AnswerCache] = None,
     ):
         self.search_client = search_client
         self.openai_host = openai_host
@@ -56,8 +61,13 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
         self.embedding_deployment = embedding_deployment
         self.sourcepage_field = sourcepage_field
         self.content_field = content_field
+        self.answer_cache = answer_cache
+        self.chatgpt_token_limit = get_token_limit(chatgpt_model)
+        self.response_token_limit = 1024
+        self.source_packer = SourcePacker.for_model(chatgpt_model)
 
     async def run(self, q: str, overrides: dict[str, Any]) -> dict[str, Any]:
+        breakdown = start_breakdown("rtr")
         has_text = overrides.get("retrieval_mode") in ["text", "hybrid", None]
         has_vector = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
         use_semantic_captions = True if overrides.get("semantic_captions") and has_text else False
@@ -65,76 +75,123 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
         exclude_category = overrides.get("exclude_category") or None
         filter = "category ne '{}'".format(exclude_category.replace("'", "''")) if exclude_category else None
 
-        # If retrieval mode includes vectors, compute an embedding for the query
-        if has_vector:
+        # If retrieval mode includes vectors or answers are cached, compute an embedding for the query
+        if has_vector or self.answer_cache is not None:
             embedding_args = {"deployment_id": self.embedding_deployment} if self.openai_host == "azure" else {}
-            embedding = await openai.Embedding.acreate(**embedding_args, model=self.embedding_model, input=q)
-            query_vector = embedding["data"][0]["embedding"]
+            with stage("embedding", model=self.embedding_model):
+                embedding = await openai.Embedding.acreate(**embedding_args, model=self.embedding_model, input=q)
+            question_vector = embedding["data"][0]["embedding"]
         else:
-            query_vector = None
+            question_vector = None
+
+        if self.answer_cache is not None:
+            cache_scope = AnswerCache.make_scope("ask", overrides)
+            cache_generation = self.answer_cache.generation
+            with stage("answer_cache") as cache_stage:
+                cached = self.answer_cache.lookup(question_vector, cache_scope)
+                cache_stage.set(cache_hit=cached is not None)
+            if cached is not None:
+                if overrides.get("latency_breakdown"):
+                    return {**cached, "latency": breakdown.to_dict()}
+                return cached
+
+        query_vector = question_vector if has_vector else None
 
         # Only keep the text query if the retrieval mode uses text, otherwise drop it
         query_text = q if has_text else ""
 
-        # Use semantic ranker if requested and if retrieval mode is text or hybrid (vectors + text)
-        if overrides.get("semantic_ranker") and has_text:
-            r = await self.search_client.search(
-                query_text,
-                filter=filter,
-                query_type=QueryType.SEMANTIC,
-                query_language="en-us",
-                query_speller="lexicon",
-                semantic_configuration_name="default",
-                top=top,
-                query_caption="extractive|highlight-false" if use_semantic_captions else None,
-                vector=query_vector,
-                top_k=50 if query_vector else None,
-                vector_fields="embedding" if query_vector else None,
-            )
-        else:
-            r = await self.search_client.search(
-                query_text,
-                filter=filter,
-                top=top,
-                vector=query_vector,
-                top_k=50 if query_vector else None,
-                vector_fields="embedding" if query_vector else None,
+        with stage(
+            "search",
+            top=top,
+            retrieval_mode=overrides.get("retrieval_mode") or "hybrid",
+            semantic_ranker=bool(overrides.get("semantic_ranker") and has_text),
+        ) as search_stage:
+            # Use semantic ranker if requested and if retrieval mode is text or hybrid (vectors + text)
+            if overrides.get("semantic_ranker") and has_text:
+                r = await self.search_client.search(
+                    query_text,
+                    filter=filter,
+                    query_type=QueryType.SEMANTIC,
+                    query_language="en-us",
+                    query_speller="lexicon",
+                    semantic_configuration_name="default",
+                    top=top,
+                    query_caption="extractive|highlight-false" if use_semantic_captions else None,
+                    vector=query_vector,
+                    top_k=50 if query_vector else None,
+                    vector_fields="embedding" if query_vector else None,
+                )
+            else:
+                r = await self.search_client.search(
+                    query_text,
+                    filter=filter,
+                    top=top,
+                    vector=query_vector,
+                    top_k=50 if query_vector else None,
+                    vector_fields="embedding" if query_vector else None,
+                )
+            if use_semantic_captions:
+                sources = [
+                    Source(
+                        doc[self.sourcepage_field],
+                        nonewlines(" . ".join([c.text for c in doc["@search.captions"]])),
+                        search_score(doc),
+                    )
+                    async for doc in r
+                ]
+            else:
+                sources = [
+                    Source(doc[self.sourcepage_field], nonewlines(doc[self.content_field]), search_score(doc))
+                    async for doc in r
+                ]
+            search_stage.set(results=len(sources))
+
+        with stage("prompt") as prompt_stage:
+            message_builder = MessageBuilder(
+                overrides.get("prompt_template") or self.system_chat_template, self.chatgpt_model
             )
-        if use_semantic_captions:
-            results = [
-                doc[self.sourcepage_field] + ": " + nonewlines(" . ".join([c.text for c in doc["@search.captions"]]))
-                async for doc in r
-            ]
-        else:
-            results = [doc[self.sourcepage_field] + ": " + nonewlines(doc[self.content_field]) async for doc in r]
-        content = "\n".join(results)
-
-        message_builder = MessageBuilder(
-            overrides.get("prompt_template") or self.system_chat_template, self.chatgpt_model
-        )
 
-        # add user question
-        user_content = q + "\n" + f"Sources:\n {content}"
-        message_builder.append_message("user", user_content)
-
-        # Add shots/samples. This helps model to mimic response and make sure they match rules laid out in system message.
-        message_builder.append_message("assistant", self.answer)
-        message_builder.append_message("user", self.question)
+            # add user question, its sources are filled in once the rest of the prompt is known
+            user_content = q + "\n" + "Sources:\n "
+            message_builder.append_message("user", user_content)
+
+            # Add shots/samples. This helps model to mimic response and make sure they match rules laid out in system message.
+            message_builder.append_message("assistant", self.answer)
+            message_builder.append_message("user", self.question)
+
+            # Fill the rest of the context window with the best sources, leaving room for the answer
+            source_budget = self.chatgpt_token_limit - self.response_token_limit - message_builder.token_length
+            results = self.source_packer.pack(sources, source_budget)
+            content = "\n".join(results)
+            message_builder.messages[-1]["content"] += content
+            prompt_stage.set(
+                instruction_tokens=message_builder.token_length, source_budget=source_budget, sources=len(results)
+            )
 
         messages = message_builder.messages
         chatgpt_args = {"deployment_id": self.chatgpt_deployment} if self.openai_host == "azure" else {}
-        chat_completion = await openai.ChatCompletion.acreate(
-            **chatgpt_args,
-            model=self.chatgpt_model,
-            messages=messages,
-            temperature=overrides.get("temperature") or 0.3,
-            max_tokens=1024,
-            n=1,
-        )
-
-        return {
+        with stage("completion", model=self.chatgpt_model) as completion_stage:
+            chat_completion = await openai.ChatCompletion.acreate(
+                **chatgpt_args,
+                model=self.chatgpt_model,
+                messages=messages,
+                temperature=overrides.get("temperature") or 0.3,
+                max_tokens=self.response_token_limit,
+                n=1,
+            )
+            usage = chat_completion.get("usage") or {}
+            completion_stage.set(
+                prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens")
+            )
+
+        answer = {
             "data_points": results,
             "answer": chat_completion.choices[0].message.content,
             "thoughts": f"Question:<br>{query_text}<br><br>Prompt:<br>"
             + "\n\n".join([str(message) for message in messages]),
         }
+        if self.answer_cache is not None:
+            self.answer_cache.store(question_vector, cache_scope, answer, cache_generation)
+        if overrides.get("latency_breakdown"):
+            answer = {**answer, "latency": breakdown.to_dict()}
+        return answer
@@ -0,0 +1,189 @@
+"""
+One-time startup work shared by all web workers: creating the search index if it does not exist yet, and recording
+the documents found in blob storage in ingest.json.
+
+gunicorn runs it once in its master process before forking the workers (see on_starting in gunicorn.conf.py) and
+sets APP_BOOTSTRAPPED for the workers, so worker boots and recycles only create clients. Without gunicorn, e.g.
+with `quart run`, setup_clients runs it instead. Across several instances a lease on bootstrap.lock keeps the
+work to one instance at a time, and as every step is idempotent an instance that finds the lease taken skips it.
+
+It can also be run on its own, e.g. as a deployment step, with the same environment as the app:
+
+    python bootstrap.py
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ResourceExistsError
+from azure.search.documents.indexes.aio import SearchIndexClient
+from azure.search.documents.indexes.models import (
+    HnswParameters,
+    PrioritizedFields,
+    SearchableField,
+    SearchField,
+    SearchFieldDataType,
+    SearchIndex,
+    SemanticConfiguration,
+    SemanticField,
+    SemanticSettings,
+    SimpleField,
+    VectorSearch,
+    VectorSearchAlgorithmConfiguration,
+)
+from azure.storage.blob.aio import BlobServiceClient
+
+from utils import get_all_files, get_ingest_json, set_ingest_json
+
+BOOTSTRAPPED_ENV = "APP_BOOTSTRAPPED"
+BOOTSTRAP_LOCK_BLOB = "bootstrap.lock"
+BOOTSTRAP_LEASE_SECONDS = 60
+
+INDEX_FIELDS = [
+    SimpleField(name="id", type="Edm.String", key=True, sortable=True),
+    SearchableField(name="content", type="Edm.String", analyzer_name="en.microsoft"),
+    SearchField(
+        name="embedding",
+        type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+        hidden=False,
+        searchable=True,
+        filterable=False,
+        sortable=False,
+        facetable=False,
+        vector_search_dimensions=1536,
+        vector_search_configuration="default",
+    ),
+    SimpleField(name="category", type="Edm.String", filterable=True, facetable=True),
+    SimpleField(name="sourcepage", type="Edm.String", filterable=True, facetable=True),
+    SimpleField(name="sourcefile", type="Edm.String", filterable=True, facetable=True),
+]
+
+
+def search_index_definition(name: str) -> SearchIndex:
+    return SearchIndex(
+        name=name,
+        fields=INDEX_FIELDS,
+        semantic_settings=SemanticSettings(
+            configurations=[
+                SemanticConfiguration(
+                    name="default",
+                    prioritized_fields=PrioritizedFields(
+                        title_field=None, prioritized_content_fields=[SemanticField(field_name="content")]
+                    ),
+                )
+            ]
+        ),
+        vector_search=VectorSearch(
+            algorithm_configurations=[
+                VectorSearchAlgorithmConfiguration(
+                    name="default", kind="hnsw", hnsw_parameters=HnswParameters(metric="cosine")
+                )
+            ]
+        ),
+    )
+
+
+async def ensure_search_index(index_client, name: str) -> bool:
+    """
+    Create the search index unless it exists, returns whether it was created
+    """
+    if name in [index_name async for index_name in index_client.list_index_names()]:
+        print(f"Search index {name} already exists")
+        return False
+    print(f"Creating {name} search index")
+    try:
+        await index_client.create_index(search_index_definition(name))
+    except ResourceExistsError:
+        # Another instance created it in the meantime
+        return False
+    return True
+
+
+async def reconcile_ingest_state(blob_container, document_container) -> list[str]:
+    """
+    Record documents that are in storage but not in ingest.json as ingested, e.g. the ones uploaded by prepdocs.py.
+    ingest.json is only rewritten when something was added, returns the added files.
+    """
+    all_files, ingest_json = await asyncio.gather(get_all_files(document_container), get_ingest_json(blob_container))
+    added = [file for file in all_files if file not in ingest_json]
+    if added:
+        for file in added:
+            ingest_json[file] = {"status": 2}
+        await set_ingest_json(blob_container, ingest_json)
+    return added
+
+
+async def acquire_bootstrap_lease(blob_container, lease_duration: int = BOOTSTRAP_LEASE_SECONDS):
+    """
+    Returns None if another instance is bootstrapping. The lease is not renewed: past `lease_duration` another
+    instance may start bootstrapping too, which is harmless as the steps are idempotent.
+    """
+    blob_client = blob_container.get_blob_client(BOOTSTRAP_LOCK_BLOB)
+    try:
+        if not await blob_client.exists():
+            await blob_client.upload_blob(b"", overwrite=True)
+        return await blob_client.acquire_lease(lease_duration=lease_duration)
+    except HttpResponseError as e:
+        if e.status_code in (409, 412):
+            return None
+        raise
+
+
+async def bootstrap(index_client, index_name: str, blob_container, document_container) -> bool:
+    """
+    Run the one-time startup work, returns False if it was skipped because another instance is running it
+    """
+    lease = await acquire_bootstrap_lease(blob_container)
+    if lease is None:
+        logging.info("Another instance is bootstrapping, skipping")
+        return False
+    try:
+        await ensure_search_index(index_client, index_name)
+        added = await reconcile_ingest_state(blob_container, document_container)
+        if added:
+            print(f"Recorded {len(added)} documents found in storage in ingest.json")
+    finally:
+        try:
+            await lease.release()
+        except HttpResponseError:
+            # The lease expired and was taken by another instance
+            pass
+    return True
+
+
+async def bootstrap_from_env() -> bool:
+    """
+    Bootstrap with clients built from the same environment variables as setup_clients in app.py
+    """
+    search_endpoint = (
+        os.getenv("AZURE_SEARCH_ENDPOINT") or f"https://{os.getenv('AZURE_SEARCH_SERVICE')}.search.windows.net"
+    )
+    storage_endpoint = (
+        os.getenv("AZURE_STORAGE_ENDPOINT") or f"https://{os.getenv('AZURE_STORAGE_ACCOUNT')}.blob.core.windows.net"
+    )
+    index_client = SearchIndexClient(
+        endpoint=search_endpoint, credential=AzureKeyCredential(os.environ["AZURE_SEARCH_SERVICE_KEY"])
+    )
+    blob_client = BlobServiceClient(account_url=storage_endpoint, credential=os.environ["AZURE_STORAGE_ACCOUNT_KEY"])
+    async with index_client, blob_client:
+        return await bootstrap(
+            index_client,
+            os.environ["AZURE_SEARCH_INDEX"],
+            blob_client.get_container_client(os.environ["AZURE_STORAGE_CONTAINER"]),
+            blob_client.get_container_client(os.environ["AZURE_STORAGE_DOCUMENT_CONTAINER"]),
+        )
+
+
+def run_bootstrap():
+    """
+    Bootstrap and mark it done in the environment, which the worker processes forked afterwards inherit
+    """
+    asyncio.run(bootstrap_from_env())
+    os.environ[BOOTSTRAPPED_ENV] = "true"
+
+
+if __name__ == "__main__":
+    asyncio.run(bootstrap_from_env())
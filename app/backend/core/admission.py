@@ -0,0 +1,81 @@
+import asyncio
+import json
+import math
+import time
+from typing import Iterable
+
+from opentelemetry import metrics
+
+meter = metrics.get_meter(__name__)
+
+ADMISSION_QUEUE_TIME = meter.create_histogram(
+    "app.admission.queue_time", unit="ms", description="Time requests waited to be admitted"
+)
+ADMISSION_REJECTED = meter.create_counter(
+    "app.admission.rejected", description="Requests turned away because the worker was at its limit, by reason"
+)
+
+
+class AdmissionController:
+    """
+    ASGI middleware that serves at most `max_inflight` requests to `paths` at once. Further requests wait, first in
+    first out, in a queue of at most `max_queued` for up to `queue_timeout` seconds. A request that finds the queue
+    full or waits too long is answered with a 503 and a Retry-After header, without reaching the app.
+    A streamed response keeps its slot until it has been sent completely.
+    """
+
+    def __init__(self, app, max_inflight: int, max_queued: int, queue_timeout: float, paths: Iterable[str]):
+        self.app = app
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.paths = frozenset(paths)
+        self.inflight = 0
+        self.queued = 0
+        # Created on first use so it belongs to the worker's event loop
+        self.semaphore = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_inflight)
+        if self.semaphore.locked():
+            if self.queued >= self.max_queued:
+                await self.reject(scope, send, "queue_full")
+                return
+            self.queued += 1
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                await self.reject(scope, send, "queue_timeout")
+                return
+            finally:
+                self.queued -= 1
+            ADMISSION_QUEUE_TIME.record((time.perf_counter() - start) * 1000, {"path": scope["path"]})
+        else:
+            await self.semaphore.acquire()
+        self.inflight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.inflight -= 1
+            self.semaphore.release()
+
+    async def reject(self, scope, send, reason: str):
+        ADMISSION_REJECTED.add(1, {"path": scope["path"], "reason": reason})
+        body = json.dumps({"error": "The server is busy, please retry shortly"}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(self.queue_timeout / 2))).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import json
+import time
+from typing import Any
+
+import numpy as np
+
+
+class AnswerCache:
+    """
+    Caches answers by the embedding of the question that produced them.
+    A lookup returns the stored answer of the most similar question asked with the same approach and overrides,
+    provided the cosine similarity reaches `threshold`. Embeddings are kept normalized in a float32 matrix so a
+    lookup is a single matrix-vector product, and the least recently used entry is evicted once `max_entries`
+    answers are cached. Every entry is dropped when the index generation changes, e.g. after an ingestion, and an
+    answer is only stored if the generation is still the one its question was looked up in.
+    """
+
+    def __init__(self, threshold: float = 0.97, max_entries: int = 1000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.generation: str | None = None
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        self.vectors: np.ndarray | None = None
+        self.scopes = np.zeros(self.max_entries, dtype=np.int32)
+        self.last_used = np.zeros(self.max_entries, dtype=np.float64)
+        self.values: list[dict[str, Any] | None] = [None] * self.max_entries
+        self.scope_ids: dict[str, int] = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    @staticmethod
+    def make_scope(approach: str, overrides: dict[str, Any]) -> str:
+        return approach + ":" + json.dumps(overrides, sort_keys=True)
+
+    def sync_generation(self, generation: str):
+        if generation != self.generation:
+            self.clear()
+            self.generation = generation
+
+    def lookup(self, vector: list[float], scope: str) -> dict[str, Any] | None:
+        scope_id = self.scope_ids.get(scope)
+        if scope_id is None or self.size == 0:
+            self.misses += 1
+            return None
+        similarities = self.vectors[: self.size] @ self._normalize(vector)
+        similarities[self.scopes[: self.size] != scope_id] = -np.inf
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.last_used[best] = time.monotonic()
+        return {**self.values[best]}
+
+    def store(self, vector: list[float], scope: str, value: dict[str, Any], generation: str | None = None):
+        if generation != self.generation:
+            # The index changed while the answer was generated, it may be based on sources that are gone
+            return
+        normalized = self._normalize(vector)
+        if self.vectors is None or self.vectors.shape[1] != normalized.shape[0]:
+            self.clear()
+            self.vectors = np.zeros((self.max_entries, normalized.shape[0]), dtype=np.float32)
+        if self.size < self.max_entries:
+            slot = self.size
+            self.size += 1
+        else:
+            slot = int(np.argmin(self.last_used))
+        self.vectors[slot] = normalized
+        self.scopes[slot] = self.scope_ids.setdefault(scope, len(self.scope_ids))
+        self.last_used[slot] = time.monotonic()
+        self.values[slot] = value
+
+    @staticmethod
+    def _normalize(vector: list[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import bisect
+import itertools
+import re
+from abc import ABC, abstractmethod
+from typing import Iterator, NamedTuple
+
+CHUNKERS = ("characters", "tokens")
+
+TABLE_RE = re.compile(r"<table.*?</table>", re.DOTALL | re.IGNORECASE)
+TABLE_ROW_RE = re.compile(r"<tr.*?</tr>", re.DOTALL | re.IGNORECASE)
+# A sentence ends with its punctuation and trailing whitespace, a paragraph with a line break
+SENTENCE_RE = re.compile(r".+?(?:[.!?]+(?:\s+|$)|\n+|$)", re.DOTALL)
+
+
+class Chunk(NamedTuple):
+    content: str
+    pagenum: int
+    token_count: int | None = None
+
+
+class Chunker(ABC):
+    @abstractmethod
+    def split(self, page_map: list[tuple[int, int, str]], filename: str) -> Iterator[Chunk]:
+        """
+        Split the text of a document, given as (page number, offset, text) tuples, into chunks
+        """
+        ...
+
+
+class Piece(NamedTuple):
+    start: int
+    text: str
+    tokens: int
+    paragraph_start: bool
+    table: bool
+
+
+class TokenChunker(Chunker):
+    """
+    Packs whole sentences into chunks of at most `max_tokens` tokens, never splitting a sentence or a table row
+    unless it is longer than a chunk on its own. A chunk is closed early at a paragraph break once it is at least
+    three quarters full, and the next chunk repeats the last sentences of the previous one, up to `overlap_tokens`.
+    Chunks are packed by the token counts of their pieces, while the token count of each chunk is that of its text.
+    """
+
+    def __init__(self, encoding, max_tokens: int = 500, overlap_tokens: int = 50):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.encoding = encoding
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def pieces(self, text: str) -> Iterator[Piece]:
+        position = 0
+        for table in TABLE_RE.finditer(text):
+            yield from self.sentence_pieces(text, position, table.start())
+            yield from self.table_pieces(text, table.start(), table.end())
+            position = table.end()
+        yield from self.sentence_pieces(text, position, len(text))
+
+    def sentence_pieces(self, text: str, start: int, end: int) -> Iterator[Piece]:
+        paragraph_start = True
+        for sentence in SENTENCE_RE.finditer(text, start, end):
+            if sentence.group():
+                yield from self.fit(Piece(sentence.start(), sentence.group(), 0, paragraph_start, False))
+                paragraph_start = sentence.group().endswith("\n")
+
+    def table_pieces(self, text: str, start: int, end: int) -> Iterator[Piece]:
+        table = text[start:end]
+        tokens = self.count(table)
+        if tokens <= self.max_tokens:
+            yield Piece(start, table, tokens, True, True)
+            return
+        # Split oversized tables by rows, each part being a table of its own
+        rows = list(TABLE_ROW_RE.finditer(table))
+        opening = table[: rows[0].start()] if rows else "<table>"
+        for row in rows:
+            part = opening + row.group() + "</table>"
+            yield from self.fit(Piece(start + row.start(), part, 0, True, True))
+
+    def fit(self, piece: Piece) -> Iterator[Piece]:
+        tokens = self.encoding.encode(piece.text)
+        if len(tokens) <= self.max_tokens:
+            yield piece._replace(tokens=len(tokens))
+            return
+        # A single sentence or row longer than a chunk is cut at token boundaries
+        offset = piece.start
+        start = 0
+        while start < len(tokens):
+            end = self.clean_cut(piece.text, offset - piece.start, tokens, start)
+            text = self.encoding.decode(tokens[start:end])
+            yield piece._replace(start=offset, text=text, tokens=end - start)
+            offset += len(text)
+            start = end
+
+    def clean_cut(self, text: str, position: int, tokens: list[int], start: int) -> int:
+        """
+        End of the longest run of at most `max_tokens` tokens from `start` that decodes to whole characters of
+        `text` at `position`, rather than cutting a multibyte character spread over several tokens. When a single
+        character spans more tokens than that, the run is extended to the end of the character instead.
+        """
+        limit = min(start + self.max_tokens, len(tokens))
+        for end in itertools.chain(range(limit, start, -1), range(limit + 1, len(tokens) + 1)):
+            if text.startswith(self.encoding.decode(tokens[start:end]), position):
+                return end
+        return len(tokens)
+
+    def split(self, page_map: list[tuple[int, int, str]], filename: str) -> Iterator[Chunk]:
+        print(f"Splitting '{filename}' into sections of at most {self.max_tokens} tokens")
+        all_text = "".join(p[2] for p in page_map)
+        page_offsets = [p[1] for p in page_map]
+
+        def find_page(offset):
+            return page_map[max(bisect.bisect_right(page_offsets, offset) - 1, 0)][0]
+
+        chunk: list[Piece] = []
+        tokens = 0
+        for piece in self.pieces(all_text):
+            overflow = tokens + piece.tokens > self.max_tokens
+            paragraph_break = piece.paragraph_start and tokens >= self.max_tokens * 3 / 4
+            if chunk and (overflow or paragraph_break):
+                yield self.chunk(chunk, find_page(chunk[0].start))
+                chunk = self.overlap(chunk, self.max_tokens - piece.tokens)
+                tokens = sum(p.tokens for p in chunk)
+            chunk.append(piece)
+            tokens += piece.tokens
+        if chunk:
+            yield self.chunk(chunk, find_page(chunk[0].start))
+
+    def chunk(self, pieces: list[Piece], pagenum: int) -> Chunk:
+        # Tokens can merge across piece boundaries, so the joined text is counted rather than its pieces summed
+        content = "".join(p.text for p in pieces)
+        return Chunk(content, pagenum, self.count(content))
+
+    def overlap(self, chunk: list[Piece], room: int) -> list[Piece]:
+        # Repeat trailing sentences, tables are never repeated
+        budget = min(self.overlap_tokens, room)
+        overlap: list[Piece] = []
+        for piece in reversed(chunk):
+            if piece.table or piece.tokens > budget:
+                break
+            overlap.insert(0, piece)
+            budget -= piece.tokens
+        return overlap
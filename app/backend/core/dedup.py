@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import io
+import re
+import zlib
+from typing import Any
+
+import numpy as np
+
+DEDUP_POLICIES = ("keep_first", "drop", "reference")
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+SHINGLE_SIZE = 5
+
+TAG_RE = re.compile(r"<[^>]+>")
+WORD_RE = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """
+    Hash the overlapping word `size`-grams of `text`, ignoring case, punctuation and HTML markup
+    """
+    words = WORD_RE.findall(TAG_RE.sub(" ", text).lower())
+    shingles = {" ".join(words[i : i + size]) for i in range(max(len(words) - size + 1, 1))}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64)
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures with `num_perm` universal hash functions of the form (a * x + b) mod p.
+    Shingle hashes are 32 bits and a, b are below 2**31, so the products never overflow 64 bits.
+    """
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        return ((np.outer(shingle_hashes(text), self.a) + self.b) % MERSENNE_PRIME).min(axis=0)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures of every section in the corpus, bucketed by LSH bands so near-duplicates of a new
+    section can be found without comparing against every section.
+    Each entry records the file it belongs to and, for duplicates, the id of the canonical section it duplicates.
+    """
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 64, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.reset(np.zeros((0, num_perm), dtype=np.uint64), [], [], [])
+
+    def reset(self, signatures: np.ndarray, ids: list[str], files: list[str], duplicate_of: list[str]):
+        # Signatures live in a buffer that grows geometrically, only the first len(ids) rows are in use
+        self._signatures = np.array(signatures, dtype=np.uint64).reshape(-1, self.num_perm)
+        self.ids = ids
+        self.files = files
+        self.duplicate_of = duplicate_of
+        self.buckets: list[dict[bytes, list[int]]] = [{} for _ in range(self.bands)]
+        for row in range(len(ids)):
+            if not duplicate_of[row]:
+                self._add_to_buckets(row)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def signatures(self) -> np.ndarray:
+        return self._signatures[: len(self.ids)]
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        return [band.tobytes() for band in signature.reshape(self.bands, -1)]
+
+    def _add_to_buckets(self, row: int):
+        for bucket, key in zip(self.buckets, self._band_keys(self.signatures[row])):
+            bucket.setdefault(key, []).append(row)
+
+    def find(self, signature: np.ndarray) -> str | None:
+        """
+        Return the id of the canonical section most similar to `signature`, if the estimated Jaccard similarity
+        reaches the threshold
+        """
+        candidates = set()
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+        if not candidates:
+            return None
+        rows = np.fromiter(candidates, dtype=np.int64)
+        similarities = (self.signatures[rows] == signature).mean(axis=1)
+        best = int(np.argmax(similarities))
+        return self.ids[rows[best]] if similarities[best] >= self.threshold else None
+
+    def add(self, section_id: str, filename: str, signature: np.ndarray, duplicate_of: str = ""):
+        if len(self.ids) == len(self._signatures):
+            grown = np.zeros((max(2 * len(self.ids), 64), self.num_perm), dtype=np.uint64)
+            grown[: len(self.ids)] = self.signatures
+            self._signatures = grown
+        self._signatures[len(self.ids)] = signature
+        self.ids.append(section_id)
+        self.files.append(filename)
+        self.duplicate_of.append(duplicate_of)
+        if not duplicate_of:
+            self._add_to_buckets(len(self.ids) - 1)
+
+    def remove_file(self, filename: str) -> set[str]:
+        """
+        Forget the sections of `filename` and return the other files holding duplicates of them,
+        whose copies were deduplicated against sections that no longer exist
+        """
+        removed_ids = {section_id for section_id, file in zip(self.ids, self.files) if file == filename}
+        if not removed_ids:
+            return set()
+        affected = {
+            file for file, duplicate_of in zip(self.files, self.duplicate_of) if duplicate_of in removed_ids
+        } - {filename}
+        self._keep([row for row, file in enumerate(self.files) if file != filename])
+        return affected
+
+    def remove_sections(self, section_ids: set[str]):
+        """
+        Forget sections that were never indexed, with the entries recorded as duplicates of them
+        """
+        self._keep(
+            [
+                row
+                for row, (section_id, duplicate_of) in enumerate(zip(self.ids, self.duplicate_of))
+                if section_id not in section_ids and duplicate_of not in section_ids
+            ]
+        )
+
+    def _keep(self, rows: list[int]):
+        self.reset(
+            self.signatures[rows],
+            [self.ids[row] for row in rows],
+            [self.files[row] for row in rows],
+            [self.duplicate_of[row] for row in rows],
+        )
+
+    def to_bytes(self) -> bytes:
+        stream = io.BytesIO()
+        np.savez_compressed(
+            stream,
+            signatures=self.signatures,
+            ids=np.array(self.ids, dtype=str),
+            files=np.array(self.files, dtype=str),
+            duplicate_of=np.array(self.duplicate_of, dtype=str),
+        )
+        return stream.getvalue()
+
+    def load_bytes(self, data: bytes):
+        arrays = np.load(io.BytesIO(data))
+        self.reset(
+            arrays["signatures"].astype(np.uint64),
+            arrays["ids"].tolist(),
+            arrays["files"].tolist(),
+            arrays["duplicate_of"].tolist(),
+        )
+
+
+class SectionDeduplicator:
+    """
+    Applies a dedup policy to the sections of a document before they are embedded:
+    - keep_first: later near-duplicates of a section already in the corpus are dropped
+    - drop: like keep_first, and sections repeated within the document itself (headers, footers, legal
+      boilerplate) are dropped entirely
+    - reference: near-duplicates are kept but carry a `duplicate_of` back-reference to the canonical section,
+      so they reuse its embedding instead of being embedded again
+    """
+
+    def __init__(self, policy: str, index: NearDuplicateIndex, hasher: MinHasher | None = None):
+        if policy not in DEDUP_POLICIES:
+            raise ValueError(f"Unknown dedup policy '{policy}', expected one of {', '.join(DEDUP_POLICIES)}")
+        self.policy = policy
+        self.index = index
+        self.hasher = hasher or MinHasher(index.num_perm)
+
+    def deduplicate(self, filename: str, sections: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        kept = []
+        repeated_in_document = set()
+        document_ids = set()
+        for section in sections:
+            signature = self.hasher.signature(section["content"])
+            canonical = self.index.find(signature)
+            if canonical is None:
+                self.index.add(section["id"], filename, signature)
+                document_ids.add(section["id"])
+                kept.append(section)
+                continue
+            self.index.add(section["id"], filename, signature, duplicate_of=canonical)
+            if canonical in document_ids:
+                repeated_in_document.add(canonical)
+            if self.policy == "reference":
+                kept.append({**section, "duplicate_of": canonical})
+        if self.policy == "drop":
+            kept = [section for section in kept if section["id"] not in repeated_in_document]
+            # Otherwise copies in later files would be dropped as duplicates of sections that are not in the index
+            self.index.remove_sections(repeated_in_document)
+        print(f"\tDeduplication kept {len(kept)} of {len(sections)} sections from '{filename}'")
+        return kept
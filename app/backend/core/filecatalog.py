@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any
+
+from utils import get_all_files, get_index_generation, get_ingest_json, is_ingest_lock
+
+
+class FileCatalog:
+    """
+    In-memory copy of the document listing served by /files.
+    The upload, update, delete and ingest code paths keep it current as they change the listing, and it is
+    reconciled with the storage containers whenever it is older than `refresh_interval` seconds, which picks up
+    changes made by other workers. The ETag is derived from the content so every worker agrees on it.
+    It also tracks the search index generation, which only needs the small generation blob and is checked every
+    `generation_interval` seconds.
+    """
+
+    def __init__(self, refresh_interval: float = 10, generation_interval: float = 2, settle_seconds: float = 5):
+        self.refresh_interval = refresh_interval
+        self.generation_interval = generation_interval
+        self.settle_seconds = settle_seconds
+        self.files: set[str] = set()
+        self.ingested: dict[str, Any] = {}
+        self.ingest_lock = False
+        self.index_generation: dict[str, Any] | None = None
+        self.refreshed_at: float | None = None
+        self.generation_checked_at: float | None = None
+        self._etag: str | None = None
+        self._refresh_lock = asyncio.Lock()
+        self._generation_lock = asyncio.Lock()
+
+    def reset(self, files, ingested: dict[str, Any], ingest_lock: bool):
+        self.files = set(files)
+        self.ingested = dict(ingested)
+        self.ingest_lock = ingest_lock
+        self.refreshed_at = time.monotonic()
+        self._etag = None
+
+    async def refresh(self, blob_container, document_container):
+        files, ingested, ingest_lock = await asyncio.gather(
+            get_all_files(document_container), get_ingest_json(blob_container), is_ingest_lock(blob_container)
+        )
+        self.reset(files, ingested, ingest_lock)
+
+    async def ensure_fresh(self, blob_container, document_container):
+        if self.is_fresh():
+            return
+        async with self._refresh_lock:
+            # Another request may have refreshed the catalog while we were waiting for the lock
+            if not self.is_fresh():
+                await self.refresh(blob_container, document_container)
+
+    async def ensure_loaded(self, blob_container, document_container):
+        # Workers start with an empty catalog and load it on first use, after that it is only kept current
+        if self.refreshed_at is None:
+            await self.ensure_fresh(blob_container, document_container)
+
+    async def ensure_index_generation(self, blob_container):
+        if self.is_generation_fresh():
+            return
+        async with self._generation_lock:
+            if not self.is_generation_fresh():
+                self.set_index_generation(await get_index_generation(blob_container))
+
+    def is_generation_fresh(self) -> bool:
+        return (
+            self.generation_checked_at is not None
+            and time.monotonic() - self.generation_checked_at < self.generation_interval
+        )
+
+    def is_fresh(self) -> bool:
+        return self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.refresh_interval
+
+    def add_files(self, filenames):
+        self.files.update(filenames)
+        self._etag = None
+
+    def remove_file(self, filename: str):
+        self.files.discard(filename)
+        self.ingested.pop(filename, None)
+        self._etag = None
+
+    def set_ingested(self, ingested: dict[str, Any]):
+        self.ingested = dict(ingested)
+        self._etag = None
+
+    def set_index_generation(self, generation: dict[str, Any] | None):
+        self.index_generation = generation
+        self.generation_checked_at = time.monotonic()
+
+    def set_ingest_lock(self, ingest_lock: bool):
+        self.ingest_lock = ingest_lock
+        self._etag = None
+
+    def snapshot(self) -> dict[str, Any]:
+        return {"files": sorted(self.files), "ingested": self.ingested, "ingest_lock": self.ingest_lock}
+
+    @property
+    def index_version(self) -> str:
+        """
+        Changes whenever sections are added to or removed from the search index, in any worker. Sections indexed in
+        the last `settle_seconds` may not be searchable yet, so until then the version is a different one and what
+        is cached in the meantime is not served once they are.
+        """
+        if self.index_generation is None:
+            return ""
+        if time.time() - self.index_generation["updated"] < self.settle_seconds:
+            return self.index_generation["id"] + "-settling"
+        return self.index_generation["id"]
+
+    @property
+    def etag(self) -> str:
+        if self._etag is None:
+            payload = json.dumps(self.snapshot(), sort_keys=True).encode("utf-8")
+            self._etag = hashlib.sha1(payload).hexdigest()
+        return self._etag
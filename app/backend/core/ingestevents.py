@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, AsyncGenerator
+
+
+class IngestEventBus:
+    """
+    Fans out ingestion progress events (stage transitions, page counts, sections embedded and indexed, errors)
+    to every subscriber of the /ingest-events stream in this worker.
+    A subscriber that falls behind by more than `max_queue` events loses its oldest events rather than
+    slowing down ingestion.
+    """
+
+    def __init__(self, max_queue: int = 1000):
+        self.max_queue = max_queue
+        self.subscribers: set[asyncio.Queue] = set()
+
+    def publish(self, event: dict[str, Any]):
+        event = {**event, "time": time.time()}
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def subscribe(self, heartbeat_interval: float | None = None) -> AsyncGenerator[dict | None, None]:
+        """
+        Yield published events as they arrive, or None when nothing was published for `heartbeat_interval` seconds
+        """
+        queue: asyncio.Queue = asyncio.Queue(self.max_queue)
+        self.subscribers.add(queue)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), heartbeat_interval)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            self.subscribers.discard(queue)
+
+
+def publish_event(events: IngestEventBus | None, event_type: str, filename: str | None = None, **data: Any):
+    if events is not None:
+        events.publish({"type": event_type, "file": filename, **data})
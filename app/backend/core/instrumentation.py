@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Iterator
+
+from opentelemetry import metrics, trace
+
+tracer = trace.get_tracer(__name__)
+meter = metrics.get_meter(__name__)
+
+STAGE_DURATION = meter.create_histogram(
+    "rag.stage.duration", unit="ms", description="Duration of each stage of answering a question"
+)
+STREAM_TIME_TO_FIRST_TOKEN = meter.create_histogram(
+    "rag.stream.time_to_first_token", unit="ms", description="Time until the first token of a streamed answer"
+)
+STREAM_TOKEN_GAP = meter.create_histogram(
+    "rag.stream.inter_token_gap", unit="ms", description="Time between consecutive tokens of a streamed answer"
+)
+STREAM_DURATION = meter.create_histogram(
+    "rag.stream.duration", unit="ms", description="Duration of a streamed answer, by how it ended"
+)
+STREAM_TOKEN_RATE = meter.create_histogram(
+    "rag.stream.tokens_per_second", unit="{token}/s", description="Tokens per second after the first token"
+)
+STREAM_DISCONNECTS = meter.create_counter(
+    "rag.stream.disconnects", description="Streamed answers abandoned by the client before they completed"
+)
+
+_breakdown: ContextVar[LatencyBreakdown | None] = ContextVar("latency_breakdown", default=None)
+
+
+class LatencyBreakdown:
+    """
+    Durations of the stages of one request, in the order they finished, and the offsets of point in time
+    events (such as the first token of a streamed answer) from the start of the request
+    """
+
+    def __init__(self, approach: str):
+        self.approach = approach
+        self.start = time.perf_counter()
+        self.stages: list[dict[str, Any]] = []
+        self.marks: dict[str, float] = {}
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def add(self, name: str, duration_ms: float, attributes: dict[str, Any]):
+        self.stages.append({"stage": name, "duration_ms": round(duration_ms, 2), **attributes})
+
+    def mark(self, name: str):
+        self.marks[name] = round(self.elapsed_ms(), 2)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"approach": self.approach, "total_ms": round(self.elapsed_ms(), 2), "stages": self.stages, **self.marks}
+
+
+def start_breakdown(approach: str) -> LatencyBreakdown:
+    """
+    Start recording the stages of the current request, stages run in the same task or its children are added to it
+    """
+    breakdown = LatencyBreakdown(approach)
+    _breakdown.set(breakdown)
+    return breakdown
+
+
+def current_breakdown() -> LatencyBreakdown | None:
+    return _breakdown.get()
+
+
+def mark(name: str):
+    """
+    Record a point in time event on the current span and in the current breakdown
+    """
+    trace.get_current_span().add_event(f"rag.{name}")
+    if (breakdown := _breakdown.get()) is not None:
+        breakdown.mark(name)
+
+
+class Stage:
+    def __init__(self, name: str, span: trace.Span, attributes: dict[str, Any]):
+        self.name = name
+        self.span = span
+        self.attributes: dict[str, Any] = {}
+        self.set(**attributes)
+
+    def set(self, **attributes: Any):
+        attributes = {key: value for key, value in attributes.items() if value is not None}
+        self.attributes.update(attributes)
+        self.span.set_attributes({f"rag.{key}": value for key, value in attributes.items()})
+
+
+def metric_attributes(name: str, attributes: dict[str, Any]) -> dict[str, Any]:
+    # Counts vary with every request, only keep the low cardinality attributes on the histogram
+    result = {key: value for key, value in attributes.items() if isinstance(value, (str, bool))}
+    result["stage"] = name
+    if (breakdown := _breakdown.get()) is not None:
+        result["approach"] = breakdown.approach
+    return result
+
+
+@contextmanager
+def stage(name: str, **attributes: Any) -> Iterator[Stage]:
+    """
+    Time a stage of the pipeline as a `rag.<name>` span, a sample of the rag.stage.duration histogram and an entry
+    of the current breakdown. Attributes known only once the stage ran can be added with `Stage.set`.
+    """
+    with tracer.start_as_current_span(f"rag.{name}") as span:
+        current = Stage(name, span, attributes)
+        start = time.perf_counter()
+        try:
+            yield current
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            STAGE_DURATION.record(duration_ms, metric_attributes(name, current.attributes))
+            if (breakdown := _breakdown.get()) is not None:
+                breakdown.add(name, duration_ms, current.attributes)
+
+
+def delta_content(event: dict[str, Any]) -> str | None:
+    choices = event.get("choices")
+    return (choices[0].get("delta") or {}).get("content") if choices else None
+
+
+async def instrument_stream(events: AsyncGenerator[dict, None], approach: str) -> AsyncGenerator[dict, None]:
+    """
+    Pass through the events of a streamed answer, recording time to first token, the gaps between tokens, tokens per
+    second and how the stream ended as metrics and as events of a rag.stream span.
+    When the client goes away Quart cancels the response and closes this generator, which closes `events` in turn
+    so the approach stops reading the answer from OpenAI.
+    """
+    span = tracer.start_span("rag.stream", attributes={"rag.approach": approach})
+    start = time.perf_counter()
+    first = last = None
+    tokens = 0
+    # Cancellation and GeneratorExit are not Exceptions, anything that ends the stream early other than an error
+    # means the client disconnected
+    outcome = "disconnected"
+    try:
+        async for event in events:
+            if delta_content(event):
+                now = time.perf_counter()
+                if first is None:
+                    first = now
+                    STREAM_TIME_TO_FIRST_TOKEN.record((now - start) * 1000, {"approach": approach})
+                    span.add_event("rag.first_token")
+                else:
+                    STREAM_TOKEN_GAP.record((now - last) * 1000, {"approach": approach})
+                last = now
+                tokens += 1
+            yield event
+        outcome = "completed"
+    except Exception as e:
+        outcome = "error"
+        span.record_exception(e)
+        raise
+    finally:
+        attributes = {"approach": approach, "outcome": outcome}
+        STREAM_DURATION.record((time.perf_counter() - start) * 1000, attributes)
+        if tokens > 1 and last > first:
+            STREAM_TOKEN_RATE.record((tokens - 1) / (last - first), attributes)
+        if outcome == "disconnected":
+            STREAM_DISCONNECTS.add(1, {"approach": approach})
+            span.add_event("rag.client_disconnected")
+        span.set_attributes({"rag.tokens": tokens, "rag.outcome": outcome})
+        span.end()
+        await events.aclose()
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+import numpy as np
+
+
+class MaterializedSearchResults:
+    """
+    Materialized search results that can be iterated like the paged results of the async SearchClient
+    """
+
+    def __init__(self, documents: list[dict[str, Any]]):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class CachedSearchClient:
+    """
+    Wraps a SearchClient so repeated searches with identical parameters are answered from memory.
+    Entries are keyed on the normalized search arguments, with vectors reduced to a fingerprint of their float32
+    bytes, and tagged with the index generation returned by `generation`. An entry is only served while the
+    generation is unchanged, and never after `ttl` seconds, which covers the delay before newly indexed
+    documents become searchable. Calls other than search are passed through to the wrapped client.
+    """
+
+    def __init__(
+        self,
+        search_client,
+        generation: Callable[[], Awaitable[str]],
+        max_entries: int = 1000,
+        ttl: float | None = 300,
+    ):
+        self.search_client = search_client
+        self.generation = generation
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[str, float, list[dict[str, Any]]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.search_client, name)
+
+    @staticmethod
+    def make_key(search_text: str | None, **kwargs: Any) -> str:
+        params = {name: value for name, value in kwargs.items() if value is not None}
+        if params.get("vector") is not None:
+            vector = np.asarray(params["vector"], dtype=np.float32)
+            params["vector"] = hashlib.sha1(vector.tobytes()).hexdigest()
+        return json.dumps([search_text or None, params], sort_keys=True, default=str)
+
+    async def search(self, search_text: str | None = None, **kwargs: Any) -> MaterializedSearchResults:
+        key = self.make_key(search_text, **kwargs)
+        generation = await self.generation()
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry_generation, created, documents = entry
+            if entry_generation == generation and (self.ttl is None or time.monotonic() - created < self.ttl):
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return MaterializedSearchResults(documents)
+            del self.entries[key]
+        self.misses += 1
+        results = await self.search_client.search(search_text, **kwargs)
+        documents = [document async for document in results]
+        self.entries[key] = (generation, time.monotonic(), documents)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return MaterializedSearchResults(documents)
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any, AsyncGenerator, Awaitable, Callable, TypeVar
+
+from opentelemetry import metrics
+
+meter = metrics.get_meter(__name__)
+
+SINGLE_FLIGHT_COALESCED = meter.create_counter(
+    "rag.singleflight.coalesced", description="Requests answered by joining an identical request already running"
+)
+
+T = TypeVar("T")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+def request_key(approach: str, question: Any, overrides: dict[str, Any]) -> str:
+    """
+    Key of a question, or of a conversation given as its history, asked with an approach and overrides.
+    Questions that only differ in case and whitespace share a key.
+    """
+    if isinstance(question, str):
+        question = normalize_text(question)
+    else:
+        question = [
+            {role: normalize_text(text) if isinstance(text, str) else text for role, text in turn.items()}
+            for turn in question
+        ]
+    return json.dumps([approach, question, overrides or {}], sort_keys=True)
+
+
+class Broadcast:
+    """
+    Events of one streamed answer, kept so subscribers that join late still receive every event from the start
+    """
+
+    def __init__(self):
+        self.events: list[dict] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+        self.on_abandoned: Callable[[], None] = lambda: None
+
+    async def pump(self, events: AsyncGenerator[dict, None]):
+        try:
+            async for event in events:
+                self.events.append(event)
+                self.changed.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.changed.set()
+            await events.aclose()
+
+    async def subscribe(self) -> AsyncGenerator[dict, None]:
+        # Counted once iterated: a response that is never sent, e.g. because the request failed before its body
+        # was streamed, never runs the `finally` below and must not keep the work alive
+        self.subscribers += 1
+        position = 0
+        try:
+            while True:
+                if position < len(self.events):
+                    position += 1
+                    yield self.events[position - 1]
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    self.changed.clear()
+                    await self.changed.wait()
+        finally:
+            self.subscribers -= 1
+            # The last subscriber went away, e.g. every client disconnected, so stop generating the answer
+            if self.subscribers == 0 and not self.done:
+                self.on_abandoned()
+                self.task.cancel()
+
+
+class Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical requests that are running at the same time, so a burst of the same question costs one run of
+    the approach. The first request for a key starts the work in its own task, requests for the same key arriving
+    before it finishes wait for its result, or for streamed answers receive its events. Nothing is kept once the work
+    is done: the next request for the key runs it again. The work is cancelled only when every request waiting for it
+    went away.
+    """
+
+    def __init__(self):
+        self.calls: dict[str, Call] = {}
+        self.streams: dict[str, Broadcast] = {}
+        self.coalesced = 0
+
+    @staticmethod
+    def _forget(entries: dict, key: str, entry: Any):
+        if entries.get(key) is entry:
+            del entries[key]
+
+    def _joined(self, route: str):
+        self.coalesced += 1
+        SINGLE_FLIGHT_COALESCED.add(1, {"route": route})
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[T]], route: str = "") -> T:
+        call = self.calls.get(key)
+        if call is None:
+            call = Call(asyncio.create_task(compute()))
+            self.calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self.calls, key, call))
+        else:
+            self._joined(route)
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Requests arriving from now on start over rather than join the cancelled work
+                self._forget(self.calls, key, call)
+                call.task.cancel()
+
+    def stream(
+        self, key: str, events: Callable[[], AsyncGenerator[dict, None]], route: str = ""
+    ) -> AsyncGenerator[dict, None]:
+        broadcast = self.streams.get(key)
+        if broadcast is None:
+            broadcast = Broadcast()
+            broadcast.task = asyncio.create_task(broadcast.pump(events()))
+            broadcast.on_abandoned = lambda: self._forget(self.streams, key, broadcast)
+            self.streams[key] = broadcast
+            broadcast.task.add_done_callback(lambda _: self._forget(self.streams, key, broadcast))
+        else:
+            self._joined(route)
+        return broadcast.subscribe()
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import Callable, NamedTuple
+
+import tiktoken
+
+from .modelhelper import get_oai_chatmodel_tiktok
+
+SENTENCE_RE = re.compile(r".+?(?:[.!?]+(?:\s+|$)|$)", re.DOTALL)
+
+# Below this many tokens a truncated source carries too little context to be worth including
+MIN_SOURCE_TOKENS = 20
+
+
+class Source(NamedTuple):
+    name: str
+    content: str
+    score: float = 0
+
+
+class SourcePacker:
+    """
+    Packs retrieved sources into a token budget, highest scoring first.
+    Sources that fit are included whole, the first one that does not fit is truncated at a sentence boundary and
+    the remaining ones are left out. Token counts are cached by text, so a section retrieved again is not re-encoded.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int], cache_size: int = 4096):
+        self.count = lru_cache(maxsize=cache_size)(count_tokens)
+
+    @classmethod
+    def for_model(cls, model: str, cache_size: int = 4096) -> SourcePacker:
+        encoding = None
+
+        def count_tokens(text: str) -> int:
+            nonlocal encoding
+            if encoding is None:
+                encoding = tiktoken.encoding_for_model(get_oai_chatmodel_tiktok(model))
+            return len(encoding.encode(text))
+
+        return cls(count_tokens, cache_size)
+
+    def truncate(self, text: str, budget: int) -> str | None:
+        """
+        Return the longest run of whole leading sentences of `text` that fits in `budget` tokens
+        """
+        truncated = ""
+        tokens = 0
+        for sentence in SENTENCE_RE.findall(text):
+            sentence_tokens = self.count(sentence)
+            if tokens + sentence_tokens > budget:
+                break
+            truncated += sentence
+            tokens += sentence_tokens
+        return truncated or None
+
+    def pack(self, sources: list[Source], budget: int, separator: str = ": ") -> list[str]:
+        packed = []
+        remaining = budget
+        for source in sorted(sources, key=lambda source: source.score, reverse=True):
+            # One extra token for the line break between sources
+            prefix_tokens = self.count(source.name + separator) + 1
+            content_tokens = self.count(source.content)
+            if prefix_tokens + content_tokens <= remaining:
+                packed.append(source.name + separator + source.content)
+                remaining -= prefix_tokens + content_tokens
+                continue
+            if remaining - prefix_tokens >= MIN_SOURCE_TOKENS:
+                truncated = self.truncate(source.content, remaining - prefix_tokens)
+                if truncated is not None:
+                    packed.append(source.name + separator + truncated)
+            break
+        return packed
+
+
+def search_score(doc) -> float:
+    # The semantic reranker score is the one results are ordered by when semantic ranking is used
+    return doc.get("@search.reranker_score") or doc.get("@search.score") or 0
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from importlib.abc import Loader, MetaPathFinder
+from typing import Any, Iterator
+
+logger = logging.getLogger(__name__)
+# The report is asked for explicitly with STARTUP_PROFILE, so it is logged whatever APP_LOG_LEVEL is
+logger.setLevel(logging.INFO)
+
+# Namespace packages whose second component is the library, e.g. azure.search or opentelemetry.sdk
+NAMESPACE_PACKAGES = {"azure", "opentelemetry"}
+
+
+def package_of(module: str) -> str:
+    parts = module.split(".")
+    return ".".join(parts[:2]) if parts[0] in NAMESPACE_PACKAGES and len(parts) > 1 else parts[0]
+
+
+class TimedLoader(Loader):
+    """
+    Wraps a module's loader to time executing the module, which includes importing the modules it imports
+    """
+
+    def __init__(self, loader: Loader, profile: StartupProfile):
+        self.loader = loader
+        self.profile = profile
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # Code that inspects __loader__, such as pkg_resources, expects the original loader
+        module.__loader__ = self.loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self.loader
+        self.profile.enter_import()
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profile.exit_import(module.__name__, time.perf_counter() - start)
+
+
+class ImportTimer(MetaPathFinder):
+    """
+    Finds modules with the other finders on sys.meta_path and wraps their loaders in a TimedLoader
+    """
+
+    def __init__(self, profile: StartupProfile):
+        self.profile = profile
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = TimedLoader(spec.loader, self.profile)
+        return spec
+
+
+class StartupProfile:
+    """
+    Records how long each module took to import, like `python -X importtime`, and how long each step of the app's
+    initialization took, from the moment it is started until `emit` reports them. A module's self time excludes the
+    modules it imported, its cumulative time includes them. Only the `top` slowest modules and packages are reported.
+    """
+
+    def __init__(self, top: int = 30):
+        self.top = top
+        self.start = time.perf_counter()
+        self.imports: list[dict[str, Any]] = []
+        self.steps: list[dict[str, Any]] = []
+        # Time spent importing the children of each module being imported
+        self.child_time: list[float] = []
+        self.timer = ImportTimer(self)
+
+    def install(self):
+        sys.meta_path.insert(0, self.timer)
+
+    def uninstall(self):
+        if self.timer in sys.meta_path:
+            sys.meta_path.remove(self.timer)
+
+    def enter_import(self):
+        self.child_time.append(0.0)
+
+    def exit_import(self, module: str, duration: float):
+        children = self.child_time.pop()
+        if self.child_time:
+            self.child_time[-1] += duration
+        self.imports.append(
+            {"module": module, "self_ms": (duration - children) * 1000, "cumulative_ms": duration * 1000}
+        )
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append({"step": name, "duration_ms": round((time.perf_counter() - start) * 1000, 2)})
+
+    def packages(self) -> dict[str, float]:
+        totals: dict[str, float] = {}
+        for entry in self.imports:
+            package = package_of(entry["module"])
+            totals[package] = totals.get(package, 0.0) + entry["self_ms"]
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def report(self) -> dict[str, Any]:
+        slowest = sorted(self.imports, key=lambda entry: entry["cumulative_ms"], reverse=True)[: self.top]
+        return {
+            "pid": os.getpid(),
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 2),
+            "import_ms": round(sum(entry["self_ms"] for entry in self.imports), 2),
+            "modules_imported": len(self.imports),
+            "packages": {package: round(ms, 2) for package, ms in list(self.packages().items())[: self.top]},
+            "slowest_imports": [
+                {
+                    "module": entry["module"],
+                    "self_ms": round(entry["self_ms"], 2),
+                    "cumulative_ms": round(entry["cumulative_ms"], 2),
+                }
+                for entry in slowest
+            ],
+            "steps": self.steps,
+        }
+
+    def emit(self) -> dict[str, Any]:
+        """
+        Stop recording imports and report everything recorded as one JSON log line and as OpenTelemetry metrics.
+        The metrics are recorded now rather than as the imports happen, as the meter provider is only set up
+        once the app is created.
+        """
+        self.uninstall()
+        report = self.report()
+        logger.info("startup profile %s", json.dumps(report))
+
+        from opentelemetry import metrics
+
+        meter = metrics.get_meter(__name__)
+        meter.create_histogram(
+            "app.startup.duration", unit="ms", description="Time from starting the startup profile until it reported"
+        ).record(report["total_ms"])
+        import_duration = meter.create_histogram(
+            "app.startup.import.duration", unit="ms", description="Time spent importing the modules of each package"
+        )
+        for package, ms in report["packages"].items():
+            import_duration.record(ms, {"package": package})
+        step_duration = meter.create_histogram(
+            "app.startup.step.duration", unit="ms", description="Duration of each step of initializing the app"
+        )
+        for step in self.steps:
+            step_duration.record(step["duration_ms"], {"step": step["step"]})
+        return report
+
+
+_profile: StartupProfile | None = None
+
+
+def start_startup_profile() -> StartupProfile | None:
+    """
+    Start profiling when STARTUP_PROFILE is true. Modules imported before this is called are not included,
+    so it should run before anything else is imported.
+    """
+    global _profile
+    if os.getenv("STARTUP_PROFILE", "false").lower() == "true" and _profile is None:
+        _profile = StartupProfile(top=int(os.getenv("STARTUP_PROFILE_TOP", "30")))
+        _profile.install()
+    return _profile
+
+
+@contextmanager
+def startup_step(name: str) -> Iterator[None]:
+    """
+    Time a step of initializing the app, does nothing unless the startup profile was started
+    """
+    if _profile is None:
+        yield
+    else:
+        with _profile.step(name):
+            yield
+
+
+def emit_startup_profile() -> dict[str, Any] | None:
+    """
+    Report the startup profile, once
+    """
+    global _profile
+    profile, _profile = _profile, None
+    return profile.emit() if profile is not None else None
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import uuid
+from typing import Any, AsyncIterable
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData,
+)
+
+
+class MultipartUploadError(ValueError):
+    pass
+
+
+class UploadTooLargeError(MultipartUploadError):
+    pass
+
+
+class _PartWriter:
+    """
+    Writes one file part to a temporary file in `temp_path`, hashing it as the chunks arrive,
+    and moves it into `data_path` once the whole body has been received.
+    File operations run in the default executor so a slow disk does not block the event loop.
+    """
+
+    def __init__(self, data_path: str, temp_path: str, filename: str):
+        self.filename = filename
+        self.path = os.path.join(data_path, filename)
+        self.temp_path = os.path.join(temp_path, f"{filename}.{uuid.uuid4().hex}.part")
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.stream = None
+
+    @staticmethod
+    async def _run(func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def open(self):
+        self.stream = await self._run(open, self.temp_path, "wb")
+
+    async def write(self, data: bytes):
+        await self._run(self.stream.write, data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+    async def close(self):
+        await self._run(self.stream.close)
+
+    async def commit(self) -> dict[str, Any]:
+        await self._run(os.replace, self.temp_path, self.path)
+        return {"filename": self.filename, "hash": self.sha256.hexdigest(), "size": self.size}
+
+    def _discard(self):
+        if self.stream is not None:
+            self.stream.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    async def discard(self):
+        await self._run(self._discard)
+
+
+async def save_multipart_files(
+    content_type: str | None,
+    body: AsyncIterable[bytes],
+    data_path: str,
+    temp_path: str,
+    field_name: str = "files",
+    max_form_memory_size: int | None = 500 * 1024,
+    max_size: int | None = None,
+) -> list[dict[str, Any]]:
+    """
+    Save the files posted under `field_name` in a multipart/form-data body into `data_path` without
+    buffering the body, and return the name, sha256 hash and size of each saved file.
+    Files are written to `temp_path` as they arrive and only replace existing files of the same name once the
+    whole body has been received, which must not be larger than `max_size` bytes. On any error none are saved.
+    """
+    mimetype, options = parse_options_header(content_type)
+    if mimetype != "multipart/form-data" or "boundary" not in options:
+        raise MultipartUploadError("request must be multipart/form-data")
+    os.makedirs(temp_path, exist_ok=True)
+    decoder = MultipartDecoder(options["boundary"].encode("latin-1"), max_form_memory_size)
+    received = []
+    writer = None
+    skip_part = False
+    size = 0
+
+    async def drain():
+        nonlocal writer, skip_part
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, (NeedData, Epilogue)):
+                return
+            if isinstance(event, File):
+                # Only keep the base name so a crafted filename cannot escape the data directory
+                filename = os.path.basename(event.filename or "")
+                skip_part = event.name != field_name or not filename
+                if not skip_part:
+                    writer = _PartWriter(data_path, temp_path, filename)
+                    received.append(writer)
+                    await writer.open()
+            elif isinstance(event, Field):
+                skip_part = True
+            elif isinstance(event, Data) and not skip_part:
+                await writer.write(event.data)
+                if not event.more_data:
+                    await writer.close()
+                    writer = None
+
+    try:
+        async for chunk in body:
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise UploadTooLargeError(f"upload is larger than {max_size} bytes")
+            decoder.receive_data(chunk)
+            await drain()
+        decoder.receive_data(None)
+        await drain()
+        if writer is not None:
+            raise MultipartUploadError("multipart body ended in the middle of a file")
+    except BaseException:
+        for part in received:
+            await part.discard()
+        raise
+    return [await part.commit() for part in received]
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import json
+import operator
+import os
+import re
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from core.searchcache import MaterializedSearchResults
+
+VECTORS_FILENAME = "embeddings.npy"
+SECTIONS_FILENAME = "sections.jsonl"
+
+FILTER_CLAUSE = re.compile(r"\s*(\w+)\s+(eq|ne|gt|lt)\s+'((?:[^']|'')*)'\s*")
+FILTER_OPERATORS = {"eq": operator.eq, "ne": operator.ne, "gt": operator.gt, "lt": operator.lt}
+
+
+class LocalCaption(NamedTuple):
+    text: str
+
+
+def parse_filter(filter: str | None) -> list[tuple[str, str, str]]:
+    """
+    Parse the subset of OData filters used by the approaches and the ingestion scripts: `field eq 'value'`,
+    `ne`, `gt` and `lt` clauses joined with `and`
+    """
+    if not filter:
+        return []
+    clauses = []
+    for clause in re.split(r"\s+and\s+", filter.strip()):
+        match = FILTER_CLAUSE.fullmatch(clause)
+        if match is None:
+            raise ValueError(f"Unsupported filter for the local vector index: {filter}")
+        field, op, value = match.groups()
+        clauses.append((field, op, value.replace("''", "'")))
+    return clauses
+
+
+class LocalVectorIndex:
+    """
+    Exact nearest neighbour search over a snapshot of the section embeddings.
+    The snapshot is a directory holding a float32 `embeddings.npy` matrix, which is memory-mapped rather than
+    loaded, and a `sections.jsonl` file with the fields of each section in the same row order.
+    """
+
+    def __init__(self, vectors: np.ndarray, sections: list[dict[str, Any]]):
+        if len(vectors) != len(sections):
+            raise ValueError(f"Snapshot has {len(vectors)} vectors but {len(sections)} sections")
+        self.vectors = vectors
+        self.sections = sections
+        norms = np.linalg.norm(vectors, axis=1).astype(np.float32) if len(vectors) else np.zeros(0, np.float32)
+        norms[norms == 0] = 1
+        self.inverse_norms = 1 / norms
+        self._columns: dict[str, np.ndarray] = {}
+
+    @classmethod
+    def load(cls, path: str) -> LocalVectorIndex:
+        vectors = np.load(os.path.join(path, VECTORS_FILENAME), mmap_mode="r")
+        with open(os.path.join(path, SECTIONS_FILENAME), encoding="utf-8") as f:
+            sections = [json.loads(line) for line in f if line.strip()]
+        return cls(vectors, sections)
+
+    def __len__(self) -> int:
+        return len(self.sections)
+
+    def column(self, field: str) -> np.ndarray:
+        if field not in self._columns:
+            self._columns[field] = np.array([section.get(field) for section in self.sections], dtype=object)
+        return self._columns[field]
+
+    def filter_mask(self, filter: str | None) -> np.ndarray | None:
+        mask = None
+        for field, op, value in parse_filter(filter):
+            clause = FILTER_OPERATORS[op](self.column(field), value).astype(bool)
+            mask = clause if mask is None else mask & clause
+        return mask
+
+    def search(self, vector: list[float], top: int, filter: str | None = None) -> list[tuple[int, float]]:
+        """
+        Return the row and cosine similarity of the `top` sections most similar to `vector` that match `filter`
+        """
+        if len(self) == 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        scores = (self.vectors @ query) * self.inverse_norms / (query_norm or 1)
+        mask = self.filter_mask(filter)
+        if mask is not None:
+            scores[~mask] = -np.inf
+        top = min(top, len(scores))
+        rows = np.argpartition(-scores, top - 1)[:top]
+        rows = rows[np.argsort(-scores[rows])]
+        return [(int(row), float(scores[row])) for row in rows if scores[row] != -np.inf]
+
+
+class LocalSearchClient:
+    """
+    Serves the approaches' searches from a LocalVectorIndex.
+    Searches with a vector are answered locally (the text part of a hybrid query is ignored), searches without one
+    go to `fallback` as there is no local full text index.
+    """
+
+    def __init__(self, index: LocalVectorIndex, content_field: str = "content", fallback=None):
+        self.index = index
+        self.content_field = content_field
+        self.fallback = fallback
+
+    async def search(
+        self,
+        search_text: str | None = None,
+        filter: str | None = None,
+        top: int | None = None,
+        vector: list[float] | None = None,
+        top_k: int | None = None,
+        query_caption: str | None = None,
+        **kwargs: Any,
+    ):
+        if vector is None:
+            if self.fallback is None:
+                raise ValueError("The local vector index can only serve searches with a vector")
+            return await self.fallback.search(
+                search_text, filter=filter, top=top, query_caption=query_caption, **kwargs
+            )
+        # Like the service, keep the top_k nearest neighbours and return the first `top` of them
+        matches = self.index.search(vector, min(top or 50, top_k or 50), filter)
+        documents = []
+        for row, score in matches:
+            document = {**self.index.sections[row], "@search.score": score}
+            if query_caption:
+                document["@search.captions"] = [LocalCaption(document.get(self.content_field) or "")]
+            documents.append(document)
+        return MaterializedSearchResults(documents)
@@ -1,4 +1,6 @@
-import multiprocessing
+import os
+
+from serverconfig import server_config
 
 max_requests = 1000
 max_requests_jitter = 50
@@ -8,6 +10,20 @@ bind = "0.0.0.0"
 timeout = 230
 # https://learn.microsoft.com/en-us/troubleshoot/azure/app-service/web-apps-performance-faqs#why-does-my-request-time-out-after-230-seconds
 
-num_cpus = multiprocessing.cpu_count()
-workers = (num_cpus * 2) + 1
+# One async worker per CPU of the container, as long as its memory allows, see serverconfig.py
+server_settings = server_config()
+workers = server_settings.workers
+keepalive = server_settings.keepalive
 worker_class = "uvicorn.workers.UvicornWorker"
+
+
+def on_starting(server):
+    # Create the search index and reconcile ingest.json once, before forking the workers, see bootstrap.py
+    from bootstrap import run_bootstrap
+
+    run_bootstrap()
+    # Workers forked afterwards share the app's immutable state instead of each loading it, see preload.py
+    if os.getenv("PRELOAD_SHARED_STATE", "false").lower() == "true":
+        from preload import preload_shared_state
+
+        preload_shared_state()
@@ -0,0 +1,236 @@
+"""
+Runs queued ingestion jobs independently of the request that queued them.
+
+/ingest-files only records a job in the blob container. Every web worker runs an IngestJobRunner in the
+background (INGEST_WORKER_MODE=inline, the default), and whichever one acquires the lease on ingest.lock
+processes the queued jobs while renewing the lease as a heartbeat. If that worker is recycled or crashes,
+the lease expires and another runner resumes the job, re-processing the files that were interrupted.
+Queued and running jobs also have a marker blob, so an idle runner only lists those markers each poll.
+
+To keep ingestion out of the web workers entirely, set INGEST_WORKER_MODE=external for the web app and run
+a dedicated worker process with the same environment:
+
+    python ingestworker.py
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Callable
+
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+
+from core.chunking import CHUNKERS
+from core.dedup import DEDUP_POLICIES
+from utils import (
+    INGEST_LOCK_LEASE_SECONDS,
+    create_ingest_lock,
+    delete_ingest_lock,
+    get_ingest_json,
+    set_ingest_json,
+    upload_documents,
+)
+
+JOB_BLOB_PREFIX = "ingest-jobs/"
+# An empty marker blob per queued or running job, so that polling while idle is a single listing that comes back empty
+PENDING_BLOB_PREFIX = "ingest-jobs-pending/"
+MAX_FINISHED_JOBS = 20
+
+
+def job_blob_name(job_id: str) -> str:
+    return f"{JOB_BLOB_PREFIX}{job_id}.json"
+
+
+def pending_blob_name(job_id: str) -> str:
+    return f"{PENDING_BLOB_PREFIX}{job_id}"
+
+
+async def get_ingest_job(container_client, job_id: str) -> dict[str, Any] | None:
+    try:
+        blob = await container_client.get_blob_client(job_blob_name(job_id)).download_blob()
+    except ResourceNotFoundError:
+        return None
+    filestream = io.BytesIO()
+    await blob.readinto(filestream)
+    return json.loads(filestream.getvalue().decode("utf-8"))
+
+
+async def save_ingest_job(container_client, job: dict[str, Any]):
+    filestream = io.BytesIO(json.dumps(job).encode("utf-8"))
+    await container_client.upload_blob(job_blob_name(job["id"]), filestream, overwrite=True)
+
+
+async def enqueue_ingest_job(container_client, options: dict[str, Any] | None = None) -> dict[str, Any]:
+    job = {"id": uuid.uuid4().hex, "state": "queued", "created": time.time(), "options": options or {}}
+    await save_ingest_job(container_client, job)
+    await container_client.upload_blob(pending_blob_name(job["id"]), b"", overwrite=True)
+    return job
+
+
+async def list_ingest_jobs(container_client) -> list[dict[str, Any]]:
+    jobs = []
+    async for name in container_client.list_blob_names(name_starts_with=JOB_BLOB_PREFIX):
+        job = await get_ingest_job(container_client, name[len(JOB_BLOB_PREFIX) : -len(".json")])
+        if job is not None:
+            jobs.append(job)
+    return sorted(jobs, key=lambda job: job["created"])
+
+
+async def has_pending_jobs(container_client) -> bool:
+    async for _ in container_client.list_blob_names(name_starts_with=PENDING_BLOB_PREFIX):
+        return True
+    return False
+
+
+class IngestJobRunner:
+    """
+    Processes queued ingestion jobs while holding the ingest lock lease.
+    `ingest_args` are the positional arguments of utils.upload_documents up to the embedding model.
+    """
+
+    def __init__(
+        self,
+        blob_container,
+        ingest_args: tuple,
+        catalog=None,
+        events=None,
+        poll_interval: float = 15,
+        lease_duration: int = INGEST_LOCK_LEASE_SECONDS,
+        max_attempts: int = 3,
+        dedup_policy: str | None = None,
+        dedup_threshold: float = 0.9,
+        chunker: str = "characters",
+        chunker_factory: Callable[[str], Any] | None = None,
+    ):
+        self.blob_container = blob_container
+        self.ingest_args = ingest_args
+        self.catalog = catalog
+        self.events = events
+        self.poll_interval = poll_interval
+        self.lease_duration = lease_duration
+        self.max_attempts = max_attempts
+        if dedup_policy is not None and dedup_policy not in DEDUP_POLICIES:
+            raise ValueError(f"Unknown dedup policy '{dedup_policy}', expected one of {', '.join(DEDUP_POLICIES)}")
+        self.dedup_policy = dedup_policy
+        self.dedup_threshold = dedup_threshold
+        if chunker not in CHUNKERS:
+            raise ValueError(f"Unknown chunker '{chunker}', expected one of {', '.join(CHUNKERS)}")
+        self.chunker = chunker
+        self.chunker_factory = chunker_factory
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+        self._wakeup = asyncio.Event()
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run_pending()
+            except Exception:
+                logging.exception("Ingestion job runner failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def run_pending(self):
+        if not await has_pending_jobs(self.blob_container):
+            return
+        lease = await create_ingest_lock(self.blob_container, self.catalog, self.lease_duration)
+        if lease is None:
+            return
+        # Jobs left running belong to a worker whose lease expired, they are resumed
+        work = asyncio.create_task(self.run_jobs(await self.pending_jobs()))
+        try:
+            while not work.done():
+                done, _ = await asyncio.wait({work}, timeout=self.lease_duration / 3)
+                if not done:
+                    try:
+                        await lease.renew()
+                    except HttpResponseError:
+                        logging.error("Lost the ingest lock lease, stopping ingestion")
+                        work.cancel()
+            if not work.cancelled():
+                work.result()
+        finally:
+            work.cancel()
+            await delete_ingest_lock(self.blob_container, self.catalog, lease)
+        await self.prune_jobs()
+
+    async def pending_jobs(self) -> list[dict[str, Any]]:
+        """
+        The queued and running jobs, only their own blobs are downloaded
+        """
+        jobs, stale = [], []
+        async for name in self.blob_container.list_blob_names(name_starts_with=PENDING_BLOB_PREFIX):
+            job = await get_ingest_job(self.blob_container, name[len(PENDING_BLOB_PREFIX) :])
+            if job is not None and job["state"] in ("queued", "running"):
+                jobs.append(job)
+            else:
+                # The worker that finished the job stopped before removing its marker
+                stale.append(name)
+        for name in stale:
+            await self.blob_container.delete_blob(name)
+        return sorted(jobs, key=lambda job: job["created"])
+
+    async def run_jobs(self, jobs: list[dict[str, Any]]):
+        if not jobs:
+            return
+        await self.reset_interrupted_files()
+        for job in jobs:
+            job.update({"state": "running", "started": time.time(), "worker": self.worker})
+            await save_ingest_job(self.blob_container, job)
+        # A single pass ingests every pending file, so all the queued jobs complete together
+        # with the options of the most recent one
+        chunker = jobs[-1].get("options", {}).get("chunker") or self.chunker
+        results = await upload_documents(
+            *self.ingest_args,
+            self.catalog,
+            self.events,
+            max_attempts=self.max_attempts,
+            dedup_policy=self.dedup_policy,
+            dedup_threshold=self.dedup_threshold,
+            chunker=self.chunker_factory(chunker) if self.chunker_factory else None,
+        )
+        failed = any(result["error"] is not None for result in results.values())
+        for job in jobs:
+            job.update({"state": "failed" if failed else "succeeded", "finished": time.time(), "files": results})
+            await save_ingest_job(self.blob_container, job)
+            await self.blob_container.delete_blob(pending_blob_name(job["id"]))
+
+    async def reset_interrupted_files(self):
+        ingest_json = await get_ingest_json(self.blob_container)
+        interrupted = [filename for filename, properties in ingest_json.items() if properties.get("status") == 1]
+        if interrupted:
+            for filename in interrupted:
+                ingest_json[filename] = {**ingest_json[filename], "status": 0}
+            await set_ingest_json(self.blob_container, ingest_json, self.catalog)
+
+    async def prune_jobs(self):
+        jobs = await list_ingest_jobs(self.blob_container)
+        finished = [job for job in jobs if job["state"] in ("succeeded", "failed")]
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            await self.blob_container.delete_blob(job_blob_name(job["id"]))
+
+
+async def main():
+    from app import CONFIG_INGEST_RUNNER, create_app
+
+    app = create_app()
+    await app.startup()
+    try:
+        await app.config[CONFIG_INGEST_RUNNER].run_forever()
+    finally:
+        await app.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,6 @@
 import csv
+import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Union
 
@@ -6,6 +8,19 @@ from langchain.agents import Tool
 from langchain.callbacks.manager import Callbacks
 
 
+@lru_cache(maxsize=None)
+def load_lookup_table(path: str, key_field: str) -> dict[str, str]:
+    """
+    Rows of a CSV file keyed on `key_field`, read once per process and shared by every tool looking them up
+    """
+    data = {}
+    with open(path, newline="") as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            data[row[key_field]] = "\n".join([f"{i}:{row[i]}" for i in row])
+    return data
+
+
 class CsvLookupTool(Tool):
     data: dict[str, str] = {}
 
@@ -18,10 +33,7 @@ class CsvLookupTool(Tool):
         callbacks: Callbacks = None,
     ):
         super().__init__(name, self.lookup, description, callbacks=callbacks)
-        with open(filename, newline="") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                self.data[row[key_field]] = "\n".join([f"{i}:{row[i]}" for i in row])
+        self.data = load_lookup_table(os.path.abspath(filename), key_field)
 
     def lookup(self, key: str) -> str:
         return self.data.get(key, "")
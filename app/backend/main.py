@@ -1,3 +1,10 @@
-from app import create_app
+from core.startupprofile import start_startup_profile, startup_step
 
-app = create_app()
+# Started before the app is imported so its imports are included, see core/startupprofile.py
+start_startup_profile()
+
+with startup_step("import_app"):
+    from app import create_app
+
+with startup_step("create_app"):
+    app = create_app()
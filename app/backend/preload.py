@@ -0,0 +1,62 @@
+"""
+Loading the app's immutable state in the gunicorn master process, so the workers forked from it share those memory
+pages copy-on-write instead of each loading their own copy.
+
+With PRELOAD_SHARED_STATE=true, on_starting in gunicorn.conf.py calls preload_shared_state, which imports the app
+module with the SDKs it uses, the enabled approaches with their prompt templates (and LangChain for the ones that
+use it), and loads the tiktoken encodings and the CSV lookup tables. No app is created and no client is built: the
+workers still create them after the fork in setup_clients, as connection pools, event loops and the exporter
+threads of Azure Monitor cannot be shared across processes. For the same reason gunicorn's preload_app is not used.
+
+The objects are then moved to the permanent generation with gc.freeze, so garbage collections in the workers do
+not write to the shared pages.
+"""
+from __future__ import annotations
+
+import gc
+import os
+from importlib import import_module
+
+import tiktoken
+
+from approaches.registry import (
+    ASK_APPROACH_CLASSES,
+    CHAT_APPROACH_CLASSES,
+    enabled_approaches,
+)
+from core.modelhelper import get_oai_chatmodel_tiktok
+
+
+def approach_modules() -> set[str]:
+    """
+    The modules of the approaches enabled by ASK_APPROACHES and CHAT_APPROACHES
+    """
+    modules = set()
+    for classes, variable in ((ASK_APPROACH_CLASSES, "ASK_APPROACHES"), (CHAT_APPROACH_CLASSES, "CHAT_APPROACHES")):
+        enabled = enabled_approaches(os.getenv(variable))
+        modules.update(
+            module for approach_id, (module, _) in classes.items() if enabled is None or approach_id in enabled
+        )
+    return modules
+
+
+def preload_shared_state():
+    import app  # noqa: F401
+
+    modules = approach_modules()
+    for module in sorted(modules):
+        import_module(module)
+
+    tiktoken.encoding_for_model(get_oai_chatmodel_tiktok(os.environ["AZURE_OPENAI_CHATGPT_MODEL"]))
+    tiktoken.encoding_for_model(os.getenv("AZURE_OPENAI_EMB_MODEL_NAME", "text-embedding-ada-002"))
+
+    if ASK_APPROACH_CLASSES["rrr"][0] in modules:
+        from approaches.readretrieveread import EMPLOYEE_INFO_CSV
+        from lookuptool import load_lookup_table
+
+        if os.path.exists(EMPLOYEE_INFO_CSV):
+            load_lookup_table(os.path.abspath(EMPLOYEE_INFO_CSV), "name")
+
+    gc.collect()
+    gc.freeze()
+    print(f"Preloaded {len(modules)} approach modules, {gc.get_freeze_count()} objects frozen")
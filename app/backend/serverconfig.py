@@ -0,0 +1,112 @@
+"""
+Sizing of the web server for an app that spends nearly all of its time awaiting Azure OpenAI, Cognitive Search and
+Blob Storage. Every uvicorn worker runs an event loop that serves many requests at once, so the sync worker formula
+of 2 * CPUs + 1 mostly multiplies memory. Instead one worker is run per CPU the container may use, fewer if the
+container's memory limit cannot hold them, and each worker admits a bounded number of requests to the routes that
+call OpenAI (see core/admission.py). Requests beyond that wait in a short queue and are turned away with a 503 once
+it is full, so a load spike shows up as fast rejections rather than every request slowing down until it times out.
+
+The CPU and memory limits are read from the cgroup (v2 or v1) the process runs in, falling back to the machine's.
+Each value can be set with an environment variable:
+
+    WEB_CONCURRENCY            number of workers
+    WORKER_MEMORY_MB           memory to budget for each worker, 300 by default
+    MAX_INFLIGHT_REQUESTS      requests each worker serves at once, 32 by default, 0 turns admission control off
+    TOTAL_INFLIGHT_REQUESTS    requests served at once across all workers, e.g. to match the OpenAI quota,
+                               takes precedence over MAX_INFLIGHT_REQUESTS
+    MAX_QUEUED_REQUESTS        requests each worker queues beyond those, twice the in-flight limit by default
+    QUEUE_TIMEOUT_SECONDS      how long a request may wait in the queue, 10 by default
+    KEEPALIVE_SECONDS          how long idle keep-alive connections are kept open, 5 by default
+    ADMISSION_PATHS            the routes admission control applies to, /ask,/chat,/chat_stream by default
+"""
+import math
+import os
+from typing import Mapping, NamedTuple, Optional
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# Memory left for the OS and the gunicorn master
+MEMORY_HEADROOM = 0.8
+
+
+class ServerConfig(NamedTuple):
+    workers: int
+    max_inflight: int
+    max_queued: int
+    queue_timeout: float
+    keepalive: int
+
+
+def read_value(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit(root: str = CGROUP_ROOT) -> Optional[float]:
+    """
+    The number of CPUs the cgroup's quota allows, None without a quota
+    """
+    if (cpu_max := read_value(os.path.join(root, "cpu.max"))) is not None:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+    quota = read_value(os.path.join(root, "cpu", "cpu.cfs_quota_us"))
+    period = read_value(os.path.join(root, "cpu", "cpu.cfs_period_us"))
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def cgroup_memory_limit(root: str = CGROUP_ROOT) -> Optional[int]:
+    """
+    The cgroup's memory limit in bytes, None without a limit
+    """
+    limit = read_value(os.path.join(root, "memory.max"))
+    if limit is None:
+        limit = read_value(os.path.join(root, "memory", "memory.limit_in_bytes"))
+    if limit is None or limit == "max":
+        return None
+    # cgroup v1 reports a huge number rather than no limit
+    return int(limit) if int(limit) < 2**60 else None
+
+
+def available_cpus(root: str = CGROUP_ROOT) -> float:
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    if (limit := cgroup_cpu_limit(root)) is not None:
+        return min(cpus, limit)
+    return cpus
+
+
+def available_memory(root: str = CGROUP_ROOT) -> Optional[int]:
+    if (limit := cgroup_memory_limit(root)) is not None:
+        return limit
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def server_config(environ: Mapping[str, str] = os.environ, root: str = CGROUP_ROOT) -> ServerConfig:
+    if environ.get("WEB_CONCURRENCY"):
+        workers = int(environ["WEB_CONCURRENCY"])
+    else:
+        workers = math.ceil(available_cpus(root))
+        worker_memory = int(environ.get("WORKER_MEMORY_MB", "300")) * 1024 * 1024
+        if (memory := available_memory(root)) is not None:
+            workers = min(workers, int(memory * MEMORY_HEADROOM // worker_memory))
+    workers = max(workers, 1)
+
+    if environ.get("TOTAL_INFLIGHT_REQUESTS"):
+        max_inflight = math.ceil(int(environ["TOTAL_INFLIGHT_REQUESTS"]) / workers)
+    else:
+        max_inflight = int(environ.get("MAX_INFLIGHT_REQUESTS", "32"))
+    return ServerConfig(
+        workers=workers,
+        max_inflight=max_inflight,
+        max_queued=int(environ.get("MAX_QUEUED_REQUESTS", str(max_inflight * 2))),
+        queue_timeout=float(environ.get("QUEUE_TIMEOUT_SECONDS", "10")),
+        keepalive=int(environ.get("KEEPALIVE_SECONDS", "5")),
+    )
@@ -4,10 +4,16 @@ import io
 import json
 import os
 import re
+import time
 import tiktoken
+import uuid
 
-from asyncio import sleep
+from asyncio import Semaphore, gather, sleep
 from math import ceil
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from core.chunking import Chunk, Chunker, TokenChunker
+from core.dedup import NearDuplicateIndex, SectionDeduplicator
+from core.ingestevents import publish_event
 from openai.error import RateLimitError, APIConnectionError
 from pypdf import PdfReader, PdfWriter
 from tenacity import (
@@ -23,6 +29,23 @@ SECTION_OVERLAP = 100
 
 SUPPORTED_BATCH_AOAI_MODEL = {"text-embedding-ada-002": {"token_limit": 8100, "max_batch_size": 16}}
 
+# Cognitive Search accepts at most 1000 actions per indexing request
+INDEX_BATCH_SIZE = 1000
+INDEX_BATCH_CONCURRENCY = 4
+
+# The Blob batch API accepts at most 256 sub-requests per batch
+BLOB_BATCH_SIZE = 256
+BLOB_BATCH_CONCURRENCY = 4
+
+# The ingest lock is a lease on ingest.lock, so it expires on its own if the worker holding it dies
+INGEST_LOCK_LEASE_SECONDS = 60
+
+# MinHash signatures of the ingested sections, used to detect near-duplicates across the corpus
+DEDUP_INDEX_BLOB = "dedup-index.npz"
+# Changed whenever sections are added to or removed from the search index, the search and answer caches of every
+# worker are keyed on it
+INDEX_GENERATION_BLOB = "index-generation.json"
+
 
 def get_data_filepath():
     path = os.path.join(os.getcwd(), "data")
@@ -31,6 +54,11 @@ def get_data_filepath():
     return path
 
 
+def get_upload_filepath():
+    # Uploads still being received are kept out of the data directory, which is listed as the uploaded files
+    return os.path.join(os.getcwd(), "uploads")
+
+
 async def get_ingest_json(container_client):
     ingest = {}
     blob_client = container_client.get_blob_client("ingest.json")
@@ -46,28 +74,101 @@ async def get_ingest_json(container_client):
     return ingest
 
 
-async def set_ingest_json(container_client, data):
+async def set_ingest_json(container_client, data, catalog=None):
     filestream = io.BytesIO()
     filestream.write((json.dumps(data)).encode("utf-8"))
     filestream.seek(0)
     await container_client.upload_blob("ingest.json", filestream, overwrite=True)
+    if catalog is not None:
+        catalog.set_ingested(data)
 
 
-async def is_ingest_lock(container_client):
-    blob_client = container_client.get_blob_client("ingest.lock")
-    ingest_lock = await blob_client.exists()
-    return ingest_lock
+async def get_index_generation(container_client):
+    try:
+        blob = await container_client.get_blob_client(INDEX_GENERATION_BLOB).download_blob()
+    except ResourceNotFoundError:
+        return None
+    filestream = io.BytesIO()
+    await blob.readinto(filestream)
+    return json.loads(filestream.getvalue().decode("utf-8"))
+
+
+async def bump_index_generation(container_client, catalog=None):
+    # A random id rather than a counter, so concurrent writers never need to read it first
+    generation = {"id": uuid.uuid4().hex, "updated": time.time()}
+    if container_client is not None:
+        filestream = io.BytesIO(json.dumps(generation).encode("utf-8"))
+        await container_client.upload_blob(INDEX_GENERATION_BLOB, filestream, overwrite=True)
+    if catalog is not None:
+        catalog.set_index_generation(generation)
+
+
+async def get_dedup_index(container_client, threshold=0.9):
+    index = NearDuplicateIndex(threshold)
+    try:
+        blob = await container_client.get_blob_client(DEDUP_INDEX_BLOB).download_blob()
+    except ResourceNotFoundError:
+        return index
+    filestream = io.BytesIO()
+    await blob.readinto(filestream)
+    index.load_bytes(filestream.getvalue())
+    return index
 
 
-async def create_ingest_lock(container_client):
-    filestream = io.BytesIO()
-    filestream.write("".encode("utf-8"))
-    filestream.seek(0)
-    await container_client.upload_blob("ingest.lock", filestream, overwrite=True)
+async def set_dedup_index(container_client, index):
+    await container_client.upload_blob(DEDUP_INDEX_BLOB, io.BytesIO(index.to_bytes()), overwrite=True)
+
 
+async def requeue_files(container_client, filenames, catalog=None):
+    """
+    Queue ingested files to be ingested again, e.g. because sections they were deduplicated against were removed
+    """
+    if not filenames:
+        return
+    ingest_json = await get_ingest_json(container_client)
+    for filename in filenames:
+        if ingest_json.get(filename, {}).get("status") == 2:
+            print(f"\tQueuing '{filename}' to be ingested again")
+            ingest_json[filename] = {**ingest_json[filename], "operation": 1, "status": 0}
+    await set_ingest_json(container_client, ingest_json, catalog)
 
-async def delete_ingest_lock(container_client):
-    await container_client.delete_blob("ingest.lock")
+
+async def is_ingest_lock(container_client):
+    blob_client = container_client.get_blob_client("ingest.lock")
+    try:
+        properties = await blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        return False
+    return properties.lease.state == "leased"
+
+
+async def create_ingest_lock(container_client, catalog=None, lease_duration=INGEST_LOCK_LEASE_SECONDS):
+    """
+    Acquire the ingest lock and return its lease, which must be renewed more often than `lease_duration`.
+    Returns None if another worker holds the lock.
+    """
+    blob_client = container_client.get_blob_client("ingest.lock")
+    try:
+        if not await blob_client.exists():
+            await blob_client.upload_blob(b"")
+        lease = await blob_client.acquire_lease(lease_duration=lease_duration)
+    except HttpResponseError as e:
+        if e.status_code == 409:
+            return None
+        raise
+    if catalog is not None:
+        catalog.set_ingest_lock(True)
+    return lease
+
+
+async def delete_ingest_lock(container_client, catalog=None, lease=None):
+    try:
+        await container_client.delete_blob("ingest.lock", lease=lease)
+    except HttpResponseError as e:
+        # The lease expired and the lock was already taken over or removed
+        print(f"Could not remove the ingest lock -> {e}")
+    if catalog is not None:
+        catalog.set_ingest_lock(False)
 
 
 def blob_name_from_file_page(filename, page=0):
@@ -271,6 +372,20 @@ def split_text(page_map, filename):
         yield (all_text[start:end], find_page(start))
 
 
+class CharacterChunker(Chunker):
+    def split(self, page_map, filename):
+        for content, pagenum in split_text(page_map, filename):
+            yield Chunk(content, pagenum)
+
+
+def make_chunker(name, embedding_model, max_tokens=500, overlap_tokens=50):
+    if name == "characters":
+        return CharacterChunker()
+    if name == "tokens":
+        return TokenChunker(tiktoken.encoding_for_model(embedding_model), max_tokens, overlap_tokens)
+    raise ValueError(f"Unknown chunker '{name}'")
+
+
 def filename_to_id(filename):
     filename_ascii = re.sub("[^0-9a-zA-Z_-]", "_", filename)
     filename_hash = base64.b16encode(filename.encode("utf-8")).decode("ascii")
@@ -293,20 +408,66 @@ async def compute_embedding(text, openai, openaihost, embedding_deployment, embe
     return response["data"][0]["embedding"]
 
 
-async def create_sections(filename, page_map, openai, openaihost, embedding_deployment, embedding_model):
+def section_id(file_id, pagenum, i):
+    return f"{file_id}-page-{pagenum}-section-{i}"
+
+
+def pack_section_ids(section_ids):
+    """
+    Sections are numbered sequentially, so their ids can be stored as run-length encoded
+    [page, count] pairs instead of the full id list
+    """
+    pages = []
+    for s_id in section_ids:
+        pagenum = int(s_id.rsplit("-page-", 1)[1].split("-section-")[0])
+        if pages and pages[-1][0] == pagenum:
+            pages[-1][1] += 1
+        else:
+            pages.append([pagenum, 1])
+    return pages
+
+
+def unpack_section_ids(filename, pages):
+    file_id = filename_to_id(filename)
+    section_ids = []
+    for pagenum, count in pages:
+        for _ in range(count):
+            section_ids.append(section_id(file_id, pagenum, len(section_ids)))
+    return section_ids
+
+
+def ingested_section_ids(filename, section_ids):
+    """
+    The ingest.json properties recording the ids of a file's indexed sections: run-length encoded when they are
+    numbered sequentially, the full list when deduplication dropped some of them
+    """
+    pages = pack_section_ids(section_ids)
+    if unpack_section_ids(filename, pages) == section_ids:
+        return {"sections": pages}
+    return {"section_ids": section_ids}
+
+
+def stored_section_ids(filename, file_ingest_properties):
+    if "section_ids" in file_ingest_properties:
+        return file_ingest_properties["section_ids"]
+    if "sections" in file_ingest_properties:
+        return unpack_section_ids(filename, file_ingest_properties["sections"])
+    return None
+
+
+def create_sections(filename, page_map, chunker=None):
     file_id = filename_to_id(filename)
-    for i, (content, pagenum) in enumerate(split_text(page_map, filename)):
-        print(f"Creating section: {file_id}-page-{pagenum}-section-{i}")
+    for i, (content, pagenum, token_count) in enumerate((chunker or CharacterChunker()).split(page_map, filename)):
+        print(f"Creating section: {section_id(file_id, pagenum, i)}")
         section = {
-            "id": f"{file_id}-page-{pagenum}-section-{i}",
+            "id": section_id(file_id, pagenum, i),
             "content": content,
             "category": "",
             "sourcepage": blob_name_from_file_page(filename, pagenum),
             "sourcefile": filename,
         }
-        section["embedding"] = await compute_embedding(
-            content, openai, openaihost, embedding_deployment, embedding_model
-        )
+        if token_count is not None:
+            section["token_count"] = token_count
         yield section
 
 
@@ -327,13 +488,22 @@ def calculate_tokens_emb_aoai(input: str, openaimodelname):
     return len(encoding.encode(input))
 
 
-async def update_embeddings_in_batch(filename, page_map, openai, openaihost, openaideployment, openaimodelname):
+async def update_embeddings_in_batch(
+    filename, sections, openai, openaihost, openaideployment, openaimodelname, events=None
+):
     batch_queue = []
     copy_s = []
     batch_response = {}
+    document_ids = set()
     token_count = 0
-    async for s in create_sections(filename, page_map, openai, openaihost, openaideployment, openaimodelname):
-        token_count += calculate_tokens_emb_aoai(s["content"], openaimodelname)
+    for s in sections:
+        if s.get("duplicate_of") in document_ids:
+            # Near-duplicate of an earlier section of this document, it reuses that section's embedding
+            copy_s.append(s)
+            continue
+        document_ids.add(s["id"])
+        section_tokens = s.get("token_count") or calculate_tokens_emb_aoai(s["content"], openaimodelname)
+        token_count += section_tokens
         if (
             token_count <= SUPPORTED_BATCH_AOAI_MODEL[openaimodelname]["token_limit"]
             and len(batch_queue) < SUPPORTED_BATCH_AOAI_MODEL[openaimodelname]["max_batch_size"]
@@ -347,9 +517,11 @@ async def update_embeddings_in_batch(filename, page_map, openai, openaihost, ope
             print(f"Batch Completed. Batch size  {len(batch_queue)} Token count {token_count}")
             for emb, item in zip(emb_responses, batch_queue):
                 batch_response[item["id"]] = emb
+            publish_event(events, "embedded", filename, sections=len(batch_response))
             batch_queue = []
             batch_queue.append(s)
-            token_count = calculate_tokens_emb_aoai(s["content"], openaimodelname)
+            copy_s.append(s)
+            token_count = section_tokens
 
     if batch_queue:
         emb_responses = await compute_embedding_in_batch(
@@ -358,29 +530,129 @@ async def update_embeddings_in_batch(filename, page_map, openai, openaihost, ope
         print(f"Batch Completed. Batch size  {len(batch_queue)} Token count {token_count}")
         for emb, item in zip(emb_responses, batch_queue):
             batch_response[item["id"]] = emb
+        publish_event(events, "embedded", filename, sections=len(batch_response))
 
     for s in copy_s:
-        s["embedding"] = batch_response[s["id"]]
+        # Internal fields are not part of the index schema
+        duplicate_of = s.pop("duplicate_of", None)
+        s.pop("token_count", None)
+        s["embedding"] = batch_response[s["id"]] if s["id"] in batch_response else batch_response[duplicate_of]
         yield s
 
 
-async def index_sections(filename, sections, search_client, search_index):
+async def index_sections(
+    filename, sections, search_client, search_index, events=None, catalog=None, blob_container=None
+):
+    """
+    Upload sections to the search index and return the ids of all the sections that were sent,
+    so they can later be deleted without querying the index.
+    The index generation is bumped after every batch so cached search results go stale in every worker.
+    """
     print(f"Indexing sections from '{filename}' into search index '{search_index}'")
-    i = 0
+    section_ids = []
+    succeeded = 0
     batch = []
     async for s in sections:
         batch.append(s)
-        i += 1
-        if i % 1000 == 0:
-            results = await search_client.upload_documents(documents=batch)
-            succeeded = sum([1 for r in results if r.succeeded])
-            print(f"\tIndexed {len(results)} sections, {succeeded} succeeded")
+        section_ids.append(s["id"])
+        if len(batch) == INDEX_BATCH_SIZE:
+            succeeded += await upload_section_batch(search_client, batch)
+            await bump_index_generation(blob_container, catalog)
+            publish_event(events, "indexed", filename, sections=len(section_ids), succeeded=succeeded)
             batch = []
 
     if len(batch) > 0:
-        results = await search_client.upload_documents(documents=batch)
-        succeeded = sum([1 for r in results if r.succeeded])
-        print(f"\tIndexed {len(results)} sections, {succeeded} succeeded")
+        succeeded += await upload_section_batch(search_client, batch)
+        await bump_index_generation(blob_container, catalog)
+        publish_event(events, "indexed", filename, sections=len(section_ids), succeeded=succeeded)
+    return section_ids
+
+
+async def upload_section_batch(search_client, batch):
+    results = await search_client.upload_documents(documents=batch)
+    succeeded = sum([1 for r in results if r.succeeded])
+    print(f"\tIndexed {len(results)} sections, {succeeded} succeeded")
+    return succeeded
+
+
+async def ingest_file(
+    only_filename,
+    file_ingest_properties,
+    search_client,
+    search_index,
+    blob_container,
+    document_container,
+    form_recognizer_client,
+    openai,
+    openaihost,
+    embedding_deployment,
+    embedding_model,
+    catalog=None,
+    events=None,
+    dedup=None,
+    chunker=None,
+):
+    filename = os.path.join(get_data_filepath(), only_filename)
+    operation = file_ingest_properties.get("operation")
+    if dedup is not None:
+        # Files whose copies were deduplicated against the sections being replaced have to be ingested again
+        await requeue_files(blob_container, dedup.index.remove_file(only_filename), catalog)
+    if operation == 1 or operation == 2:
+        publish_event(events, "stage", only_filename, stage="deleting")
+        await delete_document(
+            blob_container,
+            document_container,
+            search_client,
+            search_index,
+            only_filename,
+            soft_delete=(operation == 1),
+            section_ids=stored_section_ids(only_filename, file_ingest_properties),
+            catalog=catalog,
+        )
+    if operation == 2:
+        publish_event(events, "stage", only_filename, stage="deleted")
+    if operation == 0 or operation == 1:
+        publish_event(events, "stage", only_filename, stage="uploading")
+        await upload_blobs(blob_container, document_container, filename)
+        publish_event(events, "stage", only_filename, stage="extracting")
+        page_map = await get_document_text(form_recognizer_client, filename)
+        publish_event(events, "pages", only_filename, pages=len(page_map))
+        sections = list(create_sections(os.path.basename(filename), page_map, chunker))
+        if dedup is not None:
+            publish_event(events, "stage", only_filename, stage="deduplicating")
+            sections = dedup.deduplicate(os.path.basename(filename), sections)
+        publish_event(events, "stage", only_filename, stage="indexing")
+        sections = update_embeddings_in_batch(
+            os.path.basename(filename),
+            sections,
+            openai,
+            openaihost,
+            embedding_deployment,
+            embedding_model,
+            events,
+        )
+        section_ids = await index_sections(
+            os.path.basename(filename),
+            sections,
+            search_client,
+            search_index,
+            events,
+            catalog,
+            blob_container,
+        )
+        ingest_json = await get_ingest_json(blob_container)
+        ingest_json[os.path.split(filename)[1]] = {
+            "status": 2,
+            **ingested_section_ids(os.path.basename(filename), section_ids),
+        }
+        if "hash" in file_ingest_properties:
+            # Kept so that uploading the same content again does not queue it for ingestion
+            ingest_json[os.path.split(filename)[1]]["hash"] = file_ingest_properties["hash"]
+        await set_ingest_json(blob_container, ingest_json, catalog)
+        if os.path.exists(filename):
+            os.remove(filename)
+        print("Indexing successful")
+        publish_event(events, "stage", only_filename, stage="done", sections=len(section_ids))
 
 
 async def read_files(
@@ -393,57 +665,73 @@ async def read_files(
     openaihost,
     embedding_deployment,
     embedding_model,
+    catalog=None,
+    events=None,
+    max_attempts=1,
+    retry_delay=5,
+    dedup_policy=None,
+    dedup_threshold=0.9,
+    chunker=None,
 ):
     """
-    Recursively read directory structure under `path_pattern`
-    and execute indexing for the individual files
+    Ingest every file that is pending in ingest.json, retrying each file up to `max_attempts` times.
+    Returns the number of attempts and the last error for every file that was processed.
     """
+    results = {}
+    dedup = None
+    if dedup_policy:
+        dedup = SectionDeduplicator(dedup_policy, await get_dedup_index(blob_container, dedup_threshold))
     all_files = await get_all_files(document_container)
     for only_filename in all_files:
-        filename = os.path.join(get_data_filepath(), only_filename)
         ingest_json = await get_ingest_json(blob_container)
         file_ingest_properties = ingest_json.get(only_filename, {})
-        if file_ingest_properties.get("status") == 0:
-            print(f"Processing '{filename}'")
-            ingest_json = await get_ingest_json(blob_container)
-            ingest_json[only_filename] = {**ingest_json[only_filename], "status": 1}
-            await set_ingest_json(blob_container, ingest_json)
-            operation = file_ingest_properties.get("operation")
-            if operation == 1 or operation == 2:
-                await delete_document(
-                    blob_container,
-                    document_container,
+        if file_ingest_properties.get("status") != 0:
+            continue
+        print(f"Processing '{only_filename}'")
+        ingest_json[only_filename] = {**file_ingest_properties, "status": 1}
+        await set_ingest_json(blob_container, ingest_json, catalog)
+        for attempt in range(1, max_attempts + 1):
+            try:
+                await ingest_file(
+                    only_filename,
+                    file_ingest_properties,
                     search_client,
                     search_index,
-                    only_filename,
-                    soft_delete=(operation == 1),
+                    blob_container,
+                    document_container,
+                    form_recognizer_client,
+                    openai,
+                    openaihost,
+                    embedding_deployment,
+                    embedding_model,
+                    catalog,
+                    events,
+                    dedup,
+                    chunker,
                 )
-            if operation == 0 or operation == 1:
-                try:
-                    await upload_blobs(blob_container, document_container, filename)
-                    page_map = await get_document_text(form_recognizer_client, filename)
-                    sections = update_embeddings_in_batch(
-                        os.path.basename(filename),
-                        page_map,
-                        openai,
-                        openaihost,
-                        embedding_deployment,
-                        embedding_model,
-                    )
-                    await index_sections(
-                        os.path.basename(filename),
-                        sections,
-                        search_client,
-                        search_index,
-                    )
-                    ingest_json = await get_ingest_json(blob_container)
-                    ingest_json[os.path.split(filename)[1]] = {"status": 2}
-                    await set_ingest_json(blob_container, ingest_json)
-                    if os.path.exists(filename):
-                        os.remove(filename)
-                    print("Indexing successful")
-                except Exception as e:
-                    print(f"\tGot an error while reading {filename} -> {e} --> skipping file")
+                results[only_filename] = {"attempts": attempt, "error": None}
+                if dedup is not None:
+                    await set_dedup_index(blob_container, dedup.index)
+                break
+            except Exception as e:
+                print(f"\tGot an error while reading {only_filename} (attempt {attempt}) -> {e}")
+                publish_event(events, "error", only_filename, error=str(e), attempt=attempt)
+                results[only_filename] = {"attempts": attempt, "error": str(e)}
+                if attempt < max_attempts:
+                    await sleep(retry_delay * attempt)
+        if results[only_filename]["error"] is not None:
+            # Leave the file pending so the next ingestion picks it up again
+            print(f"\tSkipping {only_filename}")
+            if dedup is not None:
+                dedup.index.remove_file(only_filename)
+            ingest_json = await get_ingest_json(blob_container)
+            ingest_json[only_filename] = {
+                **file_ingest_properties,
+                "status": 0,
+                "error": results[only_filename]["error"],
+            }
+            await set_ingest_json(blob_container, ingest_json, catalog)
+    return results
 
 
 async def upload_documents(
@@ -456,9 +744,16 @@ async def upload_documents(
     openaihost,
     embedding_deployment,
     embedding_model,
+    catalog=None,
+    events=None,
+    max_attempts=1,
+    dedup_policy=None,
+    dedup_threshold=0.9,
+    chunker=None,
 ):
     print("Processing files...")
-    await read_files(
+    publish_event(events, "ingest", state="started")
+    results = await read_files(
         search_client,
         search_index,
         blob_container,
@@ -468,59 +763,122 @@ async def upload_documents(
         openaihost,
         embedding_deployment,
         embedding_model,
+        catalog,
+        events,
+        max_attempts,
+        dedup_policy=dedup_policy,
+        dedup_threshold=dedup_threshold,
+        chunker=chunker,
     )
-    await delete_ingest_lock(blob_container)
+    publish_event(events, "ingest", state="finished")
+    return results
 
 
-async def filter_blobs(prefix, blobs):
-    async for blob in blobs:
-        if re.match(f"{prefix}-\\d+\\.pdf", blob):
-            yield blob
+async def list_page_blobs(blob_container, filename):
+    prefix = os.path.splitext(os.path.basename(filename))[0]
+    page_blob = re.compile(f"{re.escape(prefix)}-\\d+\\.pdf")
+    return [b async for b in blob_container.list_blob_names(name_starts_with=prefix) if page_blob.fullmatch(b)]
+
+
+async def delete_blobs_in_batch(blob_container, blob_names):
+    """
+    Delete blobs with the Blob batch API, keeping several batches in flight.
+    Returns the (name, status code) of every blob that could not be deleted.
+    """
+    semaphore = Semaphore(BLOB_BATCH_CONCURRENCY)
+
+    async def delete_batch(batch):
+        async with semaphore:
+            parts = await blob_container.delete_blobs(*batch, raise_on_any_failure=False)
+            statuses = [part.status_code async for part in parts]
+            print(f"\tRemoved batch of {len(batch)} blobs")
+            # A blob that is already gone is as good as deleted
+            return [(b, status) for b, status in zip(batch, statuses) if not (200 <= status < 300 or status == 404)]
+
+    results = await gather(
+        *[delete_batch(blob_names[i : i + BLOB_BATCH_SIZE]) for i in range(0, len(blob_names), BLOB_BATCH_SIZE)]
+    )
+    return [failure for failures in results for failure in failures]
 
 
 async def remove_blobs(blob_container, filename, exact_match=False):
     print(f"Removing blobs for '{filename or '<all>'}'")
-    if await blob_container.exists():
-        if filename is None or exact_match:
-            blobs = blob_container.list_blob_names()
-        else:
-            prefix = os.path.splitext(os.path.basename(filename))[0]
-            blobs = filter_blobs(
-                prefix,
-                blob_container.list_blob_names(name_starts_with=os.path.splitext(os.path.basename(prefix))[0]),
-            )
-        async for b in blobs:
-            if exact_match:
-                if b == filename:
-                    print(f"\tRemoving blob {b}")
-                    await blob_container.delete_blob(b)
-            else:
-                print(f"\tRemoving blob {b}")
-                await blob_container.delete_blob(b)
+    if not await blob_container.exists():
+        return []
+    if filename is None:
+        blob_names = [b async for b in blob_container.list_blob_names()]
+    elif exact_match:
+        blob_names = [filename]
+    else:
+        blob_names = await list_page_blobs(blob_container, filename)
+    failures = await delete_blobs_in_batch(blob_container, blob_names)
+    for b, status in failures:
+        print(f"\tFailed to remove blob {b} (status {status})")
+    return failures
 
 
-async def remove_from_index(search_client, search_index, filename):
-    print(f"Removing sections from '{filename or '<all>'}' from search index '{search_index}'")
+async def find_section_ids(search_client, filename):
+    """
+    Fallback for files indexed before section ids were tracked: page through the ids of the matching
+    sections in key order, selecting only the key field. Each page starts after the last id of the previous
+    one, as an empty search does not return the results in the same order from one `skip` to the next.
+    """
+    file_filter = None if filename is None else f"sourcefile eq '{os.path.basename(filename)}'"
+    section_ids = []
     while True:
-        search_filter = None if filename is None else f"sourcefile eq '{os.path.basename(filename)}'"
-        r = await search_client.search("", filter=search_filter, top=1000, include_total_count=True)
-        if await r.get_count() == 0:
-            break
-        r = await search_client.delete_documents(documents=[{"id": d["id"]} async for d in r])
-        print(f"\tRemoved {len(r)} sections from index")
-        # It can take a few seconds for search results to reflect changes, so wait a bit
-        await sleep(2)
+        clauses = [file_filter] if file_filter else []
+        if section_ids:
+            clauses.append(f"id gt '{section_ids[-1]}'")
+        r = await search_client.search(
+            "", filter=" and ".join(clauses) or None, select=["id"], order_by=["id"], top=INDEX_BATCH_SIZE
+        )
+        page = [d["id"] async for d in r]
+        section_ids.extend(page)
+        if len(page) < INDEX_BATCH_SIZE:
+            return section_ids
+
 
+async def delete_sections(search_client, section_ids):
+    semaphore = Semaphore(INDEX_BATCH_CONCURRENCY)
 
-async def delete_document(blob_container, document_container, search_client, search_index, filename, soft_delete=False):
+    async def delete_batch(batch):
+        async with semaphore:
+            r = await search_client.delete_documents(documents=[{"id": s_id} for s_id in batch])
+            print(f"\tRemoved {len(r)} sections from index")
+
+    await gather(
+        *[delete_batch(section_ids[i : i + INDEX_BATCH_SIZE]) for i in range(0, len(section_ids), INDEX_BATCH_SIZE)]
+    )
+
+
+async def remove_from_index(search_client, search_index, filename, section_ids=None, catalog=None, blob_container=None):
+    print(f"Removing sections from '{filename or '<all>'}' from search index '{search_index}'")
+    if section_ids is None:
+        section_ids = await find_section_ids(search_client, filename)
+    await delete_sections(search_client, section_ids)
+    await bump_index_generation(blob_container, catalog)
+
+
+async def delete_document(
+    blob_container,
+    document_container,
+    search_client,
+    search_index,
+    filename,
+    soft_delete=False,
+    section_ids=None,
+    catalog=None,
+):
     await remove_blobs(blob_container, filename)
     await remove_blobs(document_container, filename, exact_match=True)
-    await remove_from_index(search_client, search_index, filename)
+    await remove_from_index(search_client, search_index, filename, section_ids, catalog, blob_container)
     if not soft_delete:
         ingest_json = await get_ingest_json(blob_container)
         if filename in ingest_json:
             del ingest_json[filename]
-        await set_ingest_json(blob_container, ingest_json)
+        await set_ingest_json(blob_container, ingest_json, catalog)
         full_path = os.path.join(get_data_filepath(), filename)
         if os.path.exists(full_path):
             os.remove(full_path)
+        if catalog is not None:
+            catalog.remove_file(filename)
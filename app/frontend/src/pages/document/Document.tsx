@@ -163,6 +163,14 @@ const Document = () => {
 
     const handleResponse = (resp: any) => setDocuments(resp);
 
+    // Uploads only return the files that changed, merge them into the current listing
+    const handleDelta = (resp: any) =>
+        setDocuments(documents => ({
+            files: Array.from(new Set([...documents.files, ...resp.delta.files])).sort() as any,
+            ingested: { ...documents.ingested, ...resp.delta.ingested },
+            ingest_lock: resp.ingest_lock
+        }));
+
     const fetchDocuments = () => {
         fetch("/files").then(parseJson).then(handleResponse).catch(handleError);
     };
@@ -179,7 +187,7 @@ const Document = () => {
                 body: formData
             })
                 .then(parseJson)
-                .then(handleResponse)
+                .then(handleDelta)
                 .catch(handleError);
             setFile(undefined);
         }
@@ -193,7 +201,7 @@ const Document = () => {
             body: formData
         })
             .then(parseJson)
-            .then(handleResponse)
+            .then(handleDelta)
             .catch(handleError);
     };
 
@@ -0,0 +1,125 @@
+"""
+Runs the ask and chat approaches in process against local stand-ins for Cognitive Search and OpenAI, so the
+latency and allocations reported are the backend's own on top of the injected service latency.
+
+Example: python -m benchmarks.bench_approaches --approaches rtr,chat --requests 500 --concurrency 16 -o bench.json
+"""
+import argparse
+import asyncio
+import csv
+import os
+import tempfile
+
+from benchmarks.fakes import FakeOpenAI, FakeSearchClient, Latency
+from benchmarks.harness import (
+    add_backend_to_path,
+    measure_allocations,
+    run_load,
+    write_report,
+)
+
+add_backend_to_path()
+
+from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach  # noqa: E402
+from approaches.readdecomposeask import ReadDecomposeAsk  # noqa: E402
+from approaches.readretrieveread import ReadRetrieveReadApproach  # noqa: E402
+from approaches.retrievethenread import RetrieveThenReadApproach  # noqa: E402
+
+APPROACHES = ("rtr", "rrr", "rda", "chat")
+
+QUESTIONS = [
+    "What is included in my Northwind Health Plus plan that is not in standard?",
+    "What does a Product Manager do?",
+    "What happens in a performance review?",
+    "Whats your whistleblower policy?",
+    "Does my plan cover eye exams?",
+]
+
+OVERRIDES = {"retrieval_mode": "hybrid", "semantic_ranker": True, "semantic_captions": False, "top": 3}
+
+
+def write_employee_data(directory: str):
+    # ReadRetrieveReadApproach's employee tool reads data/employeeinfo.csv from the working directory
+    os.makedirs(os.path.join(directory, "data"), exist_ok=True)
+    with open(os.path.join(directory, "data", "employeeinfo.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "title", "insurance", "vacation"])
+        writer.writerow(["Employee1", "Product Manager", "Northwind Health Plus", "20"])
+
+
+def make_call(name: str, search_client: FakeSearchClient, model: str, stream: bool):
+    args = (search_client, "openai", None, model, None, "text-embedding-ada-002", "sourcepage", "content")
+    if name == "chat":
+        approach = ChatReadRetrieveReadApproach(*args)
+
+        async def chat(i: int):
+            history = [{"user": QUESTIONS[i % len(QUESTIONS)]}]
+            if not stream:
+                return await approach.run_without_streaming(history, OVERRIDES)
+            async for _ in approach.run_with_streaming(history, OVERRIDES):
+                pass
+
+        return chat
+
+    approach = {"rtr": RetrieveThenReadApproach, "rrr": ReadRetrieveReadApproach, "rda": ReadDecomposeAsk}[name](*args)
+
+    async def ask(i: int):
+        return await approach.run(QUESTIONS[i % len(QUESTIONS)], OVERRIDES)
+
+    return ask
+
+
+async def benchmark(args: argparse.Namespace) -> dict:
+    search_client = FakeSearchClient(
+        args.documents, args.document_chars, Latency(args.search_latency, args.search_latency / 4, args.seed)
+    )
+    fake_openai = FakeOpenAI(
+        Latency(args.openai_latency, args.openai_latency / 4, args.seed),
+        Latency(args.token_latency, 0, args.seed),
+        args.answer_tokens,
+    )
+    results = {}
+    with fake_openai.patch():
+        for name in args.approaches.split(","):
+            call = make_call(name, search_client, args.model, args.stream)
+            # Warm up caches (tokenizer, prompt templates) so they are not counted against the first requests
+            for i in range(args.warmup):
+                await call(i)
+            print(f"Running {args.requests} '{name}' requests, {args.concurrency} at a time")
+            results[name] = await run_load(call, args.requests, args.concurrency)
+            if args.allocation_samples:
+                results[name].update(await measure_allocations(call, args.allocation_samples))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the RAG approaches in process against local stand-ins for the Azure services.",
+        epilog="Example: python -m benchmarks.bench_approaches --approaches rtr,chat --requests 500 -o bench.json",
+    )
+    parser.add_argument("--approaches", default=",".join(APPROACHES), help="Comma separated approaches to run")
+    parser.add_argument("--requests", type=int, default=200, help="Number of requests per approach")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of requests in flight at a time")
+    parser.add_argument("--warmup", type=int, default=5, help="Number of untimed requests per approach")
+    parser.add_argument("--stream", action="store_true", help="Stream the answers of the chat approach")
+    parser.add_argument("--model", default="gpt-35-turbo", help="Chat model name, decides the tokenizer and limits")
+    parser.add_argument("--search-latency", type=float, default=20, help="Mean search latency in ms")
+    parser.add_argument("--openai-latency", type=float, default=50, help="Mean OpenAI latency before answering in ms")
+    parser.add_argument("--token-latency", type=float, default=0, help="OpenAI latency per answer token in ms")
+    parser.add_argument("--answer-tokens", type=int, default=100, help="Length of the answers in words")
+    parser.add_argument("--documents", type=int, default=1000, help="Number of sections in the search index")
+    parser.add_argument("--document-chars", type=int, default=1000, help="Length of each section in characters")
+    parser.add_argument("--allocation-samples", type=int, default=20, help="Requests measured with tracemalloc")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the injected latencies")
+    parser.add_argument("--output", "-o", help="JSON file the results are written to, printed when not given")
+    args = parser.parse_args()
+
+    unknown = set(args.approaches.split(",")) - set(APPROACHES)
+    if unknown:
+        parser.error(f"Unknown approaches {', '.join(sorted(unknown))}, expected some of {', '.join(APPROACHES)}")
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory() as workdir:
+        write_employee_data(workdir)
+        os.chdir(workdir)
+        results = asyncio.run(benchmark(args))
+    write_report(output, "approaches", vars(args), results)
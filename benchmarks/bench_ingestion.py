@@ -0,0 +1,207 @@
+"""
+Measures the ingestion pipelines, the in-app one in utils.py and scripts/prepdocs.py, on synthetic documents with
+local stand-ins for Form Recognizer, OpenAI embeddings and the search index. Each pipeline runs in its own process
+so its peak RSS is its own.
+
+Example: python -m benchmarks.bench_ingestion --documents 4 --pages 100 --tables 2 -o ingestion.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+import openai
+
+from benchmarks.corpus import (
+    CorpusShape,
+    FakeFormRecognizer,
+    page_texts,
+    synthetic_layout,
+    write_pdf,
+)
+from benchmarks.fakes import FakeIndexClient, FakeOpenAI, Latency
+from benchmarks.harness import add_backend_to_path, write_report
+
+PIPELINES = ("app", "prepdocs")
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def timed(self, name: str, function: Callable, *args: Any, **kwargs: Any) -> Any:
+        with self.stage(name):
+            return function(*args, **kwargs)
+
+
+async def aiter_list(items):
+    for item in items:
+        yield item
+
+
+async def run_app_pipeline(args, paths, form_recognizer, index_client, timer: StageTimer) -> int:
+    import utils
+
+    chunker = utils.make_chunker(args.chunker, EMBEDDING_MODEL)
+    sections_total = 0
+    for path in paths:
+        basename = os.path.basename(path)
+        with timer.stage("extract"):
+            page_map = await utils.get_document_text(form_recognizer, path, args.localpdfparser)
+        with timer.stage("split"):
+            sections = list(utils.create_sections(basename, page_map, chunker))
+        with timer.stage("embed"):
+            embedded = [
+                s
+                async for s in utils.update_embeddings_in_batch(
+                    basename, sections, openai, "openai", None, EMBEDDING_MODEL
+                )
+            ]
+        with timer.stage("index"):
+            await utils.index_sections(basename, aiter_list(embedded), index_client, "benchmark")
+        sections_total += len(sections)
+    return sections_total
+
+
+def run_prepdocs_pipeline(args, paths, timer: StageTimer) -> int:
+    from scripts import prepdocs
+
+    prepdocs.args = argparse.Namespace(
+        verbose=False,
+        localpdfparser=args.localpdfparser,
+        formrecognizerservice="benchmark",
+        searchservice="benchmark",
+        index="benchmark",
+        category="benchmark",
+        openaihost="openai",
+        openaideployment=None,
+        openaimodelname=EMBEDDING_MODEL,
+    )
+    prepdocs.formrecognizer_creds = prepdocs.search_creds = None
+    sections_total = 0
+    for path in paths:
+        page_map = timer.timed("extract", prepdocs.get_document_text, path)
+        sections = timer.timed("split", list, prepdocs.create_sections(os.path.basename(path), page_map, False))
+        embedded = timer.timed("embed", list, prepdocs.update_embeddings_in_batch(sections))
+        timer.timed("index", prepdocs.index_sections, os.path.basename(path), embedded)
+        sections_total += len(sections)
+    return sections_total
+
+
+def run_pipeline(pipeline: str, args: argparse.Namespace) -> dict[str, Any]:
+    add_backend_to_path()
+    import utils
+
+    baseline_rss = peak_rss_mb()
+    shape = CorpusShape(
+        args.pages, args.paragraphs, args.paragraph_chars, args.tables, args.table_rows, args.table_columns
+    )
+    layouts = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = []
+        for i in range(args.documents):
+            path = os.path.join(workdir, f"document{i}.pdf")
+            layouts[path] = synthetic_layout(shape, seed=args.seed + i)
+            write_pdf(path, layouts[path])
+            paths.append(path)
+        text_bytes = sum(len(text.encode("utf-8")) for layout in layouts.values() for text in page_texts(layout))
+        pdf_bytes = sum(os.path.getsize(path) for path in paths)
+
+        timer = StageTimer()
+        fake_openai = FakeOpenAI(Latency(args.embedding_latency))
+        asynchronous = pipeline == "app"
+        form_recognizer = FakeFormRecognizer(layouts, Latency(args.formrecognizer_latency), asynchronous)
+        index_client = FakeIndexClient(Latency(args.index_latency), asynchronous)
+        if pipeline == "prepdocs":
+            from scripts import prepdocs
+
+            prepdocs.DocumentAnalysisClient = form_recognizer
+            prepdocs.SearchClient = index_client
+        # The pipelines print progress for every page and section, keep that off the terminal but still pay for it
+        with fake_openai.patch(), open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            if pipeline == "app":
+                sections = asyncio.run(run_app_pipeline(args, paths, form_recognizer, index_client, timer))
+            else:
+                sections = run_prepdocs_pipeline(args, paths, timer)
+            elapsed = time.perf_counter() - start
+
+    # table_to_html is part of extraction, time it on its own as well
+    tables = [table for layout in layouts.values() for table in layout.tables]
+    start = time.perf_counter()
+    for table in tables:
+        utils.table_to_html(table)
+    table_seconds = time.perf_counter() - start
+
+    return {
+        "documents": len(paths),
+        "pages": sum(len(layout.pages) for layout in layouts.values()),
+        "tables": len(tables),
+        "sections": sections,
+        "indexed": index_client.indexed,
+        "text_mb": round(text_bytes / 1e6, 3),
+        "pdf_mb": round(pdf_bytes / 1e6, 3),
+        "elapsed_s": round(elapsed, 3),
+        "text_mb_per_s": round(text_bytes / 1e6 / elapsed, 3),
+        "sections_per_s": round(sections / elapsed, 1),
+        "stages_s": {name: round(seconds, 4) for name, seconds in timer.stages.items()},
+        "table_to_html_ms_per_table": round(table_seconds * 1000 / len(tables), 4) if tables else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_growth_mb": round(peak_rss_mb() - baseline_rss, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ingestion pipelines on synthetic documents against local stand-ins.",
+        epilog="Example: python -m benchmarks.bench_ingestion --documents 4 --pages 100 --tables 2 -o ingestion.json",
+    )
+    parser.add_argument("--pipelines", default=",".join(PIPELINES), help="Comma separated pipelines to run")
+    parser.add_argument("--documents", type=int, default=2, help="Number of documents")
+    parser.add_argument("--pages", type=int, default=50, help="Pages per document")
+    parser.add_argument("--paragraphs", type=int, default=6, help="Paragraphs per page")
+    parser.add_argument("--paragraph-chars", type=int, default=800, help="Length of each paragraph in characters")
+    parser.add_argument("--tables", type=int, default=1, help="Tables per page")
+    parser.add_argument("--table-rows", type=int, default=20, help="Rows per table, including the header")
+    parser.add_argument("--table-columns", type=int, default=6, help="Columns per table")
+    parser.add_argument("--localpdfparser", action="store_true", help="Extract text with pypdf instead")
+    parser.add_argument("--chunker", default="characters", help="Chunker of the in-app pipeline, characters or tokens")
+    parser.add_argument("--formrecognizer-latency", type=float, default=0, help="Form Recognizer latency in ms")
+    parser.add_argument("--embedding-latency", type=float, default=0, help="Latency of each embedding batch in ms")
+    parser.add_argument("--index-latency", type=float, default=0, help="Latency of each index upload in ms")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic documents")
+    parser.add_argument("--output", "-o", help="JSON file the results are written to, printed when not given")
+    args = parser.parse_args()
+
+    unknown = set(args.pipelines.split(",")) - set(PIPELINES)
+    if unknown:
+        parser.error(f"Unknown pipelines {', '.join(sorted(unknown))}, expected some of {', '.join(PIPELINES)}")
+    results = {}
+    for pipeline in args.pipelines.split(","):
+        print(f"Running the '{pipeline}' ingestion pipeline")
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results[pipeline] = executor.submit(run_pipeline, pipeline, args).result()
+    write_report(args.output, "ingestion", vars(args), results)
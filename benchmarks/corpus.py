@@ -0,0 +1,185 @@
+"""
+Synthetic documents for the ingestion benchmarks: Form Recognizer layout results with long paragraphs and dense
+tables, and PDFs carrying the same text so the local PDF parser path can be measured too.
+"""
+from __future__ import annotations
+
+import random
+import time
+from typing import NamedTuple
+
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from benchmarks.fakes import Latency, synthetic_text
+
+
+class Span(NamedTuple):
+    offset: int
+    length: int
+
+
+class BoundingRegion(NamedTuple):
+    page_number: int
+
+
+class Cell(NamedTuple):
+    row_index: int
+    column_index: int
+    content: str
+    kind: str = "content"
+    row_span: int = 1
+    column_span: int = 1
+
+
+class Table(NamedTuple):
+    row_count: int
+    column_count: int
+    cells: list[Cell]
+    bounding_regions: list[BoundingRegion]
+    spans: list[Span]
+
+
+class Page(NamedTuple):
+    page_number: int
+    spans: list[Span]
+
+
+class Layout(NamedTuple):
+    """
+    The parts of a Form Recognizer AnalyzeResult the ingestion code reads
+    """
+
+    content: str
+    pages: list[Page]
+    tables: list[Table]
+
+
+class CorpusShape(NamedTuple):
+    pages: int = 50
+    paragraphs: int = 6
+    paragraph_chars: int = 800
+    tables: int = 1
+    table_rows: int = 20
+    table_columns: int = 6
+
+
+def synthetic_layout(shape: CorpusShape, seed: int = 0) -> Layout:
+    rng = random.Random(seed)
+    content = ""
+    pages = []
+    tables = []
+    for page_number in range(1, shape.pages + 1):
+        page_start = len(content)
+        blocks = ["paragraph"] * shape.paragraphs + ["table"] * shape.tables
+        rng.shuffle(blocks)
+        for block in blocks:
+            if block == "paragraph":
+                content += synthetic_text(shape.paragraph_chars, rng.randrange(1 << 30)) + "\n"
+                continue
+            cells = []
+            table_start = len(content)
+            for row in range(shape.table_rows):
+                for column in range(shape.table_columns):
+                    text = (
+                        f"Header {column}" if row == 0 else synthetic_text(rng.randint(4, 24), rng.randrange(1 << 30))
+                    )
+                    cells.append(Cell(row, column, text, "columnHeader" if row == 0 else "content"))
+                    content += text + " "
+                content += "\n"
+            tables.append(
+                Table(
+                    shape.table_rows,
+                    shape.table_columns,
+                    cells,
+                    [BoundingRegion(page_number)],
+                    [Span(table_start, len(content) - table_start)],
+                )
+            )
+        pages.append(Page(page_number, [Span(page_start, len(content) - page_start)]))
+    return Layout(content, pages, tables)
+
+
+def page_texts(layout: Layout) -> list[str]:
+    return [layout.content[page.spans[0].offset : sum(page.spans[0])] for page in layout.pages]
+
+
+def write_pdf(path: str, layout: Layout, line_chars: int = 110):
+    """
+    Write a PDF with one page per layout page, holding that page's text in Helvetica
+    """
+    writer = PdfWriter()
+    font = DictionaryObject(
+        {
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+        }
+    )
+    resources = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): writer._add_object(font)})})
+    for text in page_texts(layout):
+        lines = [
+            line[i : i + line_chars] for line in text.splitlines() for i in range(0, max(len(line), 1), line_chars)
+        ]
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        stream = DecodedStreamObject()
+        stream.set_data(("BT /F1 6 Tf 7 TL 24 780 Td " + " ".join(f"({line}) '" for line in escaped) + " ET").encode())
+        page = writer.add_blank_page(612, 792)
+        page[NameObject("/Resources")] = resources
+        page[NameObject("/Contents")] = writer._add_object(stream)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def select_pages(layout: Layout, pages: str | None) -> Layout:
+    if not pages:
+        return layout
+    first, last = (int(page) for page in pages.split("-"))
+    return Layout(
+        layout.content,
+        [page for page in layout.pages if first <= page.page_number <= last],
+        [table for table in layout.tables if first <= table.bounding_regions[0].page_number <= last],
+    )
+
+
+class FakePoller:
+    def __init__(self, result: Layout, asynchronous: bool):
+        self._result = result
+        self.asynchronous = asynchronous
+
+    def result(self):
+        if not self.asynchronous:
+            return self._result
+
+        async def result():
+            return self._result
+
+        return result()
+
+
+class FakeFormRecognizer:
+    """
+    Stands in for DocumentAnalysisClient, aio or not, answering with the layout registered for the analyzed file.
+    Page ranges are honoured like the service does, page numbers and offsets stay relative to the whole document.
+    """
+
+    def __init__(self, layouts: dict[str, Layout], latency: Latency | None = None, asynchronous: bool = True):
+        self.layouts = layouts
+        self.latency = latency or Latency()
+        self.asynchronous = asynchronous
+
+    def begin_analyze_document(self, model: str, document, pages: str | None = None, **kwargs):
+        layout = select_pages(self.layouts[document.name], pages)
+        if not self.asynchronous:
+            time.sleep(self.latency.mean_ms / 1000)
+            return FakePoller(layout, False)
+
+        async def begin():
+            await self.latency.wait()
+            return FakePoller(layout, True)
+
+        return begin()
+
+    def __call__(self, *args, **kwargs) -> FakeFormRecognizer:
+        # prepdocs.py creates its own client, patching the class with an instance returns this one
+        return self
@@ -0,0 +1,319 @@
+"""
+Local stand-ins for the Azure services the backend talks to, so benchmarks measure the backend's own overhead.
+Every call waits for a configurable, seeded latency before answering, and payload sizes are configurable.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import random
+import re
+import time
+import zlib
+from typing import Any, AsyncGenerator, NamedTuple
+
+import openai
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+WORDS = (
+    "plan coverage deductible employee benefits network provider claim premium visit review policy manager "
+    "vacation training health dental vision retirement contribution eligibility dependent annual"
+).split()
+
+
+class Latency:
+    """
+    Latency injected before each call, uniformly distributed within `jitter_ms` of `mean_ms`
+    """
+
+    def __init__(self, mean_ms: float = 0, jitter_ms: float = 0, seed: int = 0):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self.random = random.Random(seed)
+
+    async def wait(self, scale: float = 1):
+        delay = max(self.mean_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms), 0) * scale
+        # Sleep even with no latency so calls still yield to the event loop like real I/O does
+        await asyncio.sleep(delay / 1000)
+
+
+def synthetic_text(chars: int, seed: int) -> str:
+    words = random.Random(seed).choices(WORDS, k=chars // 6 + 1)
+    sentences = [" ".join(words[i : i + 12]).capitalize() + "." for i in range(0, len(words), 12)]
+    return " ".join(sentences)[:chars]
+
+
+class FakeCaption(NamedTuple):
+    text: str
+
+
+class FakeAnswer(NamedTuple):
+    text: str
+
+
+class FakeSearchResults:
+    def __init__(self, documents: list[dict[str, Any]]):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+    async def get_answers(self):
+        return [FakeAnswer(self.documents[0]["content"][:200])] if self.documents else []
+
+    async def get_count(self) -> int:
+        return len(self.documents)
+
+
+class FakeSearchClient:
+    """
+    Answers searches from a synthetic corpus of `documents` sections of `document_chars` characters each.
+    Results are picked deterministically from the query text, so runs with the same seed replay the same results.
+    """
+
+    def __init__(self, documents: int = 1000, document_chars: int = 1000, latency: Latency | None = None):
+        self.latency = latency or Latency()
+        self.documents = [
+            {
+                "id": f"doc-{i}",
+                "content": synthetic_text(document_chars, i),
+                "category": None,
+                "sourcepage": f"document{i // 10}-{i % 10 + 1}.pdf",
+                "sourcefile": f"document{i // 10}.pdf",
+            }
+            for i in range(documents)
+        ]
+
+    async def search(
+        self,
+        search_text: str | None = None,
+        top: int | None = None,
+        query_caption: str | None = None,
+        **kwargs: Any,
+    ) -> FakeSearchResults:
+        await self.latency.wait()
+        start = zlib.crc32((search_text or "").encode("utf-8"))
+        results = []
+        for rank in range(min(top or 50, len(self.documents))):
+            document = {**self.documents[(start + rank * 7919) % len(self.documents)], "@search.score": 1 / (rank + 1)}
+            if query_caption:
+                document["@search.captions"] = [FakeCaption(document["content"][:200])]
+            results.append(document)
+        return FakeSearchResults(results)
+
+
+class FakeIndexingResult(NamedTuple):
+    key: str
+    succeeded: bool = True
+
+
+class FakeIndexClient:
+    """
+    Accepts section uploads like SearchClient.upload_documents, aio or not, and counts what was indexed
+    """
+
+    def __init__(self, latency: Latency | None = None, asynchronous: bool = True):
+        self.latency = latency or Latency()
+        self.asynchronous = asynchronous
+        self.indexed = 0
+
+    def upload_documents(self, documents: list[dict[str, Any]]):
+        self.indexed += len(documents)
+        results = [FakeIndexingResult(document["id"]) for document in documents]
+        if not self.asynchronous:
+            time.sleep(self.latency.mean_ms / 1000)
+            return results
+
+        async def upload():
+            await self.latency.wait()
+            return results
+
+        return upload()
+
+    def __call__(self, *args: Any, **kwargs: Any) -> FakeIndexClient:
+        # prepdocs.py creates its own client, patching the class with an instance returns this one
+        return self
+
+
+class FakeOpenAI:
+    """
+    Stands in for openai.Embedding, openai.ChatCompletion and openai.Completion.
+    Answers are `answer_tokens` words long and streamed one word per chunk, `token_latency` is waited before each
+    chunk (or before a whole answer once per word when not streaming).
+    """
+
+    def __init__(
+        self,
+        latency: Latency | None = None,
+        token_latency: Latency | None = None,
+        answer_tokens: int = 100,
+        embedding_dimensions: int = 1536,
+    ):
+        self.latency = latency or Latency()
+        self.token_latency = token_latency or Latency()
+        self.answer = " ".join(random.Random(0).choices(WORDS, k=answer_tokens)) + " [document0-1.pdf]"
+        self.embedding_dimensions = embedding_dimensions
+
+    def embedding(self, text: str) -> list[float]:
+        return [random.Random(zlib.crc32(text.encode("utf-8"))).uniform(-1, 1)] * self.embedding_dimensions
+
+    def embedding_response(self, input: Any) -> Any:
+        inputs = input if isinstance(input, list) else [input]
+        return openai.util.convert_to_openai_object(
+            {
+                "data": [{"index": i, "embedding": self.embedding(text)} for i, text in enumerate(inputs)],
+                "usage": {"prompt_tokens": sum(len(text.split()) for text in inputs)},
+            }
+        )
+
+    async def embedding_acreate(self, input: Any, **kwargs: Any) -> Any:
+        await self.latency.wait()
+        return self.embedding_response(input)
+
+    def embedding_create(self, input: Any, **kwargs: Any) -> Any:
+        # Used by prepdocs.py, which calls the synchronous API
+        time.sleep(self.latency.mean_ms / 1000)
+        return self.embedding_response(input)
+
+    async def chat_acreate(self, messages: list[dict[str, str]], stream: bool = False, **kwargs: Any):
+        await self.latency.wait()
+        if kwargs.get("functions"):
+            # Query rewriting step of the chat approach
+            query = messages[-1]["content"].replace("Generate search query for: ", "")
+            arguments = json.dumps({"search_query": query})
+            message = {"role": "assistant", "function_call": {"name": "search_sources", "arguments": arguments}}
+            return openai.util.convert_to_openai_object({"choices": [{"message": message}]})
+        if stream:
+            return self.stream()
+        await self.token_latency.wait(scale=len(self.answer.split()))
+        return openai.util.convert_to_openai_object(
+            {"choices": [{"message": {"role": "assistant", "content": self.answer}, "finish_reason": "stop"}]}
+        )
+
+    async def stream(self) -> AsyncGenerator[Any, None]:
+        # The "2023-07-01-preview" API version sends a first chunk without choices
+        yield openai.util.convert_to_openai_object({"choices": []})
+        for word in self.answer.split(" "):
+            await self.token_latency.wait()
+            yield openai.util.convert_to_openai_object({"choices": [{"index": 0, "delta": {"content": word + " "}}]})
+
+    def react_step(self, prompt: str) -> str:
+        # Only the text after the last question is the agent's own scratchpad, the rest are examples
+        scratchpad = prompt.rsplit("Question:", 1)[-1]
+        zero_shot = "Action Input" in prompt
+        if "Observation" in scratchpad and zero_shot:
+            return f" I now know the final answer\nFinal Answer: {self.answer}"
+        if "Observation" in scratchpad:
+            return f" I have the answer\nAction: Finish[{self.answer}]"
+        query = re.sub(r"\s+", " ", scratchpad.split("\n", 1)[0]).strip()
+        if zero_shot:
+            return f" I need to search the benefits documents\nAction: CognitiveSearch\nAction Input: {query}"
+        return f" I need to search the benefits documents\nAction: Search[{query}]"
+
+    async def completion_acreate(self, prompt: Any, **kwargs: Any) -> Any:
+        await self.latency.wait()
+        prompts = prompt if isinstance(prompt, list) else [prompt]
+        choices = [{"index": i, "text": self.react_step(p), "finish_reason": "stop"} for i, p in enumerate(prompts)]
+        await self.token_latency.wait(scale=len(self.answer.split()))
+        return openai.util.convert_to_openai_object(
+            {"choices": choices, "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+        )
+
+    @contextlib.contextmanager
+    def patch(self):
+        """
+        Route the openai module's API calls to this fake for the duration of the block
+        """
+        patched = {
+            (openai.Embedding, "acreate"): self.embedding_acreate,
+            (openai.Embedding, "create"): self.embedding_create,
+            (openai.ChatCompletion, "acreate"): self.chat_acreate,
+            (openai.Completion, "acreate"): self.completion_acreate,
+        }
+        saved_key = openai.api_key
+        saved = {target: getattr(*target) for target in patched}
+        openai.api_key = "fake-key"
+        for (owner, name), fake in patched.items():
+            setattr(owner, name, fake)
+        try:
+            yield self
+        finally:
+            openai.api_key = saved_key
+            for (owner, name), original in saved.items():
+                setattr(owner, name, original)
+
+
+class FakeBlobDownload:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.properties = {"size": len(data)}
+
+    async def readall(self) -> bytes:
+        return self.data
+
+    async def readinto(self, stream) -> int:
+        return stream.write(self.data)
+
+
+class FakeBlob:
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+
+class FakeBlobClient:
+    def __init__(self, container: FakeBlobContainer, name: str):
+        self.container = container
+        self.blob_name = name
+
+    async def upload_blob(self, data: Any, overwrite: bool = False, **kwargs: Any):
+        await self.container.upload_blob(self.blob_name, data, overwrite=overwrite)
+
+    async def download_blob(self, **kwargs: Any) -> FakeBlobDownload:
+        return await self.container.download_blob(self.blob_name)
+
+    async def exists(self) -> bool:
+        return self.blob_name in self.container.blobs
+
+    async def delete_blob(self, **kwargs: Any):
+        await self.container.delete_blob(self.blob_name)
+
+
+class FakeBlobContainer:
+    """
+    In-memory blob container with the subset of the aio ContainerClient API used by the backend
+    """
+
+    def __init__(self, latency: Latency | None = None):
+        self.latency = latency or Latency()
+        self.blobs: dict[str, bytes] = {}
+
+    def get_blob_client(self, name: str) -> FakeBlobClient:
+        return FakeBlobClient(self, name)
+
+    async def upload_blob(self, name: str, data: Any, overwrite: bool = False, **kwargs: Any):
+        await self.latency.wait()
+        if name in self.blobs and not overwrite:
+            raise ResourceExistsError(f"The specified blob already exists: {name}")
+        self.blobs[name] = data.read() if hasattr(data, "read") else bytes(data)
+
+    async def download_blob(self, name: str, **kwargs: Any) -> FakeBlobDownload:
+        await self.latency.wait()
+        if name not in self.blobs:
+            raise ResourceNotFoundError(f"The specified blob does not exist: {name}")
+        return FakeBlobDownload(self.blobs[name])
+
+    async def delete_blob(self, name: str, **kwargs: Any):
+        await self.latency.wait()
+        self.blobs.pop(name, None)
+
+    async def list_blobs(self, name_starts_with: str | None = None, **kwargs: Any):
+        await self.latency.wait()
+        for name, data in list(self.blobs.items()):
+            if name_starts_with is None or name.startswith(name_starts_with):
+                yield FakeBlob(name, len(data))
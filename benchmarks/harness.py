@@ -0,0 +1,129 @@
+"""
+Timing, allocation and reporting helpers shared by the benchmark scripts
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "backend")
+
+
+def add_backend_to_path():
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Nearest-rank percentile of `values`, `p` between 0 and 100
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(-(-p * len(ordered) // 100)), 1)
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize_latencies(latencies_ms: list[float]) -> dict[str, float]:
+    return {
+        "p50_ms": round(percentile(latencies_ms, 50), 3),
+        "p95_ms": round(percentile(latencies_ms, 95), 3),
+        "p99_ms": round(percentile(latencies_ms, 99), 3),
+        "mean_ms": round(sum(latencies_ms) / len(latencies_ms), 3) if latencies_ms else 0.0,
+        "max_ms": round(max(latencies_ms), 3) if latencies_ms else 0.0,
+    }
+
+
+async def run_load(call: Callable[[int], Awaitable[Any]], requests: int, concurrency: int) -> dict[str, Any]:
+    """
+    Run `requests` calls, at most `concurrency` at a time, and report throughput and latency percentiles
+    """
+    latencies_ms: list[float] = []
+    next_request = 0
+    errors: list[str] = []
+
+    async def worker():
+        nonlocal next_request
+        while next_request < requests:
+            i = next_request
+            next_request += 1
+            start = time.perf_counter()
+            try:
+                await call(i)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                continue
+            latencies_ms.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        **summarize_latencies(latencies_ms),
+    }
+
+
+async def measure_allocations(call: Callable[[int], Awaitable[Any]], samples: int) -> dict[str, float]:
+    """
+    Run `samples` calls one at a time under tracemalloc and report, per call, the peak memory allocated while it ran
+    and the number of memory blocks it left allocated (caches filling up, leaks)
+    """
+    tracemalloc.start()
+    try:
+        peaks = []
+        blocks = []
+        for i in range(samples):
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            await call(i)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            after = tracemalloc.take_snapshot()
+            blocks.append(sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0))
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_alloc_kib_per_request": round(sum(peaks) / len(peaks) / 1024, 1) if peaks else 0.0,
+        "retained_blocks_per_request": round(sum(blocks) / len(blocks), 1) if blocks else 0.0,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(path: str | None, benchmark: str, parameters: dict[str, Any], results: dict[str, Any]):
+    report = {
+        "benchmark": benchmark,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"Wrote results to '{path}'")
+    else:
+        print(output)
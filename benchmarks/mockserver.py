@@ -0,0 +1,762 @@
+"""
+A local stand-in for the Azure services the app and scripts/prepdocs.py talk to, serving the subset of the
+Cognitive Search, Blob Storage, Form Recognizer and OpenAI REST APIs they use, so load tests, ingestion benchmarks
+and chaos runs work on a plain Linux box. Every call waits for a seeded latency, a seeded share of calls is
+throttled with a Retry-After (429, or 503 for Blob Storage), answers stream token by token and Form Recognizer
+analyses take time per page.
+
+The Search index client only talks HTTPS, so the server uses a self-signed certificate by default and prints the
+environment that points the app at it, including a CA bundle that trusts it. State is kept in memory.
+
+Example: python -m benchmarks.mockserver --port 8443 --openai-latency 200 --token-latency 20 --throttle-rate 0.02
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import datetime
+import email.utils
+import io
+import ipaddress
+import json
+import math
+import os
+import random
+import re
+import tempfile
+import time
+import uuid
+from collections import deque
+from typing import Any
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+from benchmarks.fakes import FakeOpenAI, Latency, synthetic_text
+from benchmarks.harness import add_backend_to_path
+
+STORAGE_ACCOUNT = "mockstorage"
+# Any base64 value works, the server does not check signatures
+STORAGE_KEY = base64.b64encode(b"mockstorage-key").decode()
+
+SEARCH_INDEX_PATH = re.compile(r"/search/indexes(?:\('([^']+)'\)|/([^/?]+))(/docs/search\.(?:post\.search|index))?")
+
+
+class Throttle:
+    """
+    Throttles a seeded share of calls, and OpenAI calls above `requests_per_minute`, like the services' quotas do
+    """
+
+    def __init__(self, rate: float = 0, retry_after: float = 1, requests_per_minute: int = 0, seed: int = 0):
+        self.rate = rate
+        self.retry_after = retry_after
+        self.requests_per_minute = requests_per_minute
+        self.random = random.Random(seed)
+        self.recent: deque[float] = deque()
+
+    def check(self, service: str) -> float | None:
+        """
+        Return how many seconds the caller should back off, or None if the call is let through
+        """
+        if self.rate and self.random.random() < self.rate:
+            return self.retry_after
+        if service == "openai" and self.requests_per_minute:
+            now = time.monotonic()
+            while self.recent and self.recent[0] <= now - 60:
+                self.recent.popleft()
+            if len(self.recent) >= self.requests_per_minute:
+                return math.ceil(self.recent[0] + 60 - now)
+            self.recent.append(now)
+        return None
+
+
+def throttled(service: str, retry_after: float) -> web.Response:
+    headers = {"Retry-After": str(math.ceil(retry_after)), "retry-after-ms": str(int(retry_after * 1000))}
+    if service == "blob":
+        # Blob Storage throttles with a 503, which is also the status its SDK retries on
+        return blob_error(503, "ServerBusy", "The server is busy.", headers)
+    message = f"Requests to the mock {service} service have exceeded the call rate limit."
+    return web.json_response({"error": {"code": "429", "message": message}}, status=429, headers=headers)
+
+
+def service_of(path: str) -> str | None:
+    if path.startswith("/search/"):
+        return "search"
+    if path.startswith(f"/{STORAGE_ACCOUNT}"):
+        return "blob"
+    if path.startswith("/formrecognizer/"):
+        return "formrecognizer"
+    if path.startswith("/openai/") or path.startswith("/v1/"):
+        return "openai"
+    return None
+
+
+@web.middleware
+async def service_conditions(request: web.Request, handler):
+    server: MockServer = request.app["server"]
+    service = service_of(request.path)
+    if service is None:
+        return await handler(request)
+    server.calls[service] = server.calls.get(service, 0) + 1
+    await server.latencies[service].wait()
+    retry_after = server.throttle.check(service)
+    if retry_after is not None:
+        server.throttled[service] = server.throttled.get(service, 0) + 1
+        return throttled(service, retry_after)
+    return await handler(request)
+
+
+def http_date(timestamp: float) -> str:
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def blob_error(status: int, code: str, message: str, headers: dict[str, str] | None = None) -> web.Response:
+    body = (
+        f'<?xml version="1.0" encoding="utf-8"?><Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>'
+    )
+    return web.Response(
+        status=status,
+        body=body.encode(),
+        content_type="application/xml",
+        headers={"x-ms-error-code": code, **(headers or {})},
+    )
+
+
+class Blob:
+    def __init__(self, data: bytes, content_type: str):
+        self.data = data
+        self.content_type = content_type
+        self.modified = time.time()
+        self.etag = f'"0x{uuid.uuid4().hex[:16].upper()}"'
+        self.lease_id: str | None = None
+        self.lease_expires = 0.0
+        self.lease_duration = -1
+
+    def leased(self) -> bool:
+        return self.lease_id is not None and (self.lease_expires < 0 or self.lease_expires > time.time())
+
+    def headers(self) -> dict[str, str]:
+        return {
+            "ETag": self.etag,
+            "Last-Modified": http_date(self.modified),
+            "x-ms-creation-time": http_date(self.modified),
+            "x-ms-blob-type": "BlockBlob",
+            "x-ms-lease-state": "leased" if self.leased() else "available",
+            "x-ms-lease-status": "locked" if self.leased() else "unlocked",
+            "Content-Type": self.content_type,
+            "Accept-Ranges": "bytes",
+        }
+
+
+class BlobStore:
+    """
+    Containers of block blobs with leases
+    """
+
+    def __init__(self, containers: list[str]):
+        self.containers: dict[str, dict[str, Blob]] = {container: {} for container in containers}
+        self.blocks: dict[tuple[str, str], dict[str, bytes]] = {}
+
+    def lease_conflict(self, blob: Blob, lease_id: str | None) -> web.Response | None:
+        if blob.leased() and lease_id != blob.lease_id:
+            code = "LeaseIdMissing" if lease_id is None else "LeaseIdMismatchWithBlobOperation"
+            return blob_error(412, code, "There is currently a lease on the blob.")
+        return None
+
+    def delete(self, container: str, name: str, lease_id: str | None) -> web.Response:
+        blob = self.containers.get(container, {}).get(name)
+        if blob is None:
+            return blob_error(404, "BlobNotFound", "The specified blob does not exist.")
+        conflict = self.lease_conflict(blob, lease_id)
+        if conflict is not None:
+            return conflict
+        del self.containers[container][name]
+        return web.Response(status=202, headers={"x-ms-delete-type-permanent": "true"})
+
+    async def container_request(self, request: web.Request, container: str) -> web.Response:
+        comp = request.query.get("comp")
+        blobs = self.containers.get(container)
+        if request.method == "PUT" and comp is None:
+            if blobs is not None:
+                return blob_error(409, "ContainerAlreadyExists", "The specified container already exists.")
+            self.containers[container] = {}
+            return web.Response(status=201, headers={"ETag": '"0x1"', "Last-Modified": http_date(time.time())})
+        if request.method == "POST" and comp == "batch":
+            return await self.batch(request)
+        if blobs is None:
+            return blob_error(404, "ContainerNotFound", "The specified container does not exist.")
+        if request.method in ("GET", "HEAD") and comp is None:
+            return web.Response(status=200, headers={"ETag": '"0x1"', "Last-Modified": http_date(time.time())})
+        if request.method == "DELETE":
+            del self.containers[container]
+            return web.Response(status=202)
+        if request.method == "GET" and comp == "list":
+            return self.list_blobs(container, request.query.get("prefix", ""))
+        return blob_error(400, "UnsupportedHttpVerb", f"{request.method} {comp} is not supported by the mock.")
+
+    def list_blobs(self, container: str, prefix: str) -> web.Response:
+        entries = []
+        for name, blob in sorted(self.containers[container].items()):
+            if not name.startswith(prefix):
+                continue
+            headers = blob.headers()
+            entries.append(
+                f"<Blob><Name>{escape(name)}</Name><Properties>"
+                f"<Creation-Time>{headers['x-ms-creation-time']}</Creation-Time>"
+                f"<Last-Modified>{headers['Last-Modified']}</Last-Modified><Etag>{blob.etag}</Etag>"
+                f"<Content-Length>{len(blob.data)}</Content-Length><Content-Type>{blob.content_type}</Content-Type>"
+                f"<BlobType>BlockBlob</BlobType><LeaseStatus>{headers['x-ms-lease-status']}</LeaseStatus>"
+                f"<LeaseState>{headers['x-ms-lease-state']}</LeaseState></Properties></Blob>"
+            )
+        body = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            f'<EnumerationResults ContainerName="{escape(container)}"><Prefix>{escape(prefix)}</Prefix>'
+            f"<Blobs>{''.join(entries)}</Blobs><NextMarker /></EnumerationResults>"
+        )
+        return web.Response(body=body.encode(), content_type="application/xml")
+
+    async def batch(self, request: web.Request) -> web.Response:
+        # Only batches of deletes, which is what ContainerClient.delete_blobs sends
+        boundary = "batchresponse_" + uuid.uuid4().hex
+        request_boundary = re.search(r'boundary="?([^";]+)', request.headers["Content-Type"]).group(1)
+        body = (await request.read()).decode()
+        parts = []
+        for content_id, (method, path, headers) in enumerate(parse_batch(body, request_boundary)):
+            container, _, name = path.lstrip("/").split("?")[0].removeprefix(f"{STORAGE_ACCOUNT}/").partition("/")
+            if method != "DELETE":
+                response = blob_error(400, "UnsupportedBatchRequest", "The mock only batches deletes.")
+            else:
+                response = self.delete(container, name, headers.get("x-ms-lease-id"))
+            extra = "".join(f"{key}: {value}\r\n" for key, value in response.headers.items() if key != "Content-Type")
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n"
+                f"HTTP/1.1 {response.status} {response.reason}\r\n{extra}x-ms-version: 2021-08-06\r\n\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        return web.Response(
+            status=202, body="".join(parts).encode(), headers={"Content-Type": f"multipart/mixed; boundary={boundary}"}
+        )
+
+    async def blob_request(self, request: web.Request, container: str, name: str) -> web.Response:
+        comp = request.query.get("comp")
+        blob = self.containers.get(container, {}).get(name)
+        lease_id = request.headers.get("x-ms-lease-id")
+        if request.method == "PUT" and comp == "lease":
+            return self.lease(request, container, name)
+        if container not in self.containers:
+            return blob_error(404, "ContainerNotFound", "The specified container does not exist.")
+        if request.method == "PUT" and comp == "block":
+            self.blocks.setdefault((container, name), {})[request.query["blockid"]] = await request.read()
+            return web.Response(status=201)
+        if request.method == "PUT":
+            if blob is not None and request.headers.get("If-None-Match") == "*":
+                return blob_error(409, "BlobAlreadyExists", "The specified blob already exists.")
+            if blob is not None:
+                conflict = self.lease_conflict(blob, lease_id)
+                if conflict is not None:
+                    return conflict
+            data = await request.read()
+            if comp == "blocklist":
+                staged = self.blocks.pop((container, name), {})
+                block_ids = re.findall(r"<(?:Latest|Uncommitted|Committed)>([^<]*)<", data.decode())
+                data = b"".join(staged[block_id] for block_id in block_ids)
+            content_type = request.headers.get("x-ms-blob-content-type", "application/octet-stream")
+            stored = Blob(data, content_type)
+            if blob is not None and blob.leased():
+                stored.lease_id, stored.lease_expires = blob.lease_id, blob.lease_expires
+            self.containers[container][name] = stored
+            return web.Response(status=201, headers={"ETag": stored.etag, "Last-Modified": http_date(stored.modified)})
+        if request.method == "DELETE":
+            return self.delete(container, name, lease_id)
+        if blob is None:
+            return blob_error(404, "BlobNotFound", "The specified blob does not exist.")
+        if request.method == "HEAD":
+            return web.Response(status=200, headers={**blob.headers(), "Content-Length": str(len(blob.data))})
+        if request.method == "GET":
+            return self.download(request, blob)
+        return blob_error(400, "UnsupportedHttpVerb", f"{request.method} {comp} is not supported by the mock.")
+
+    def download(self, request: web.Request, blob: Blob) -> web.Response:
+        headers = blob.headers()
+        range_header = request.headers.get("x-ms-range") or request.headers.get("Range")
+        if not range_header:
+            return web.Response(status=200, body=blob.data, headers=headers)
+        first, _, last = range_header.removeprefix("bytes=").partition("-")
+        start = int(first)
+        if start >= len(blob.data):
+            return blob_error(416, "InvalidRange", "The range specified is invalid for the size of the resource.")
+        end = min(int(last) if last else len(blob.data) - 1, len(blob.data) - 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(blob.data)}"
+        return web.Response(status=206, body=blob.data[start : end + 1], headers=headers)
+
+    def lease(self, request: web.Request, container: str, name: str) -> web.Response:
+        blob = self.containers.get(container, {}).get(name)
+        if blob is None:
+            return blob_error(404, "BlobNotFound", "The specified blob does not exist.")
+        action = request.headers.get("x-ms-lease-action")
+        lease_id = request.headers.get("x-ms-lease-id")
+        if action == "acquire":
+            if blob.leased() and request.headers.get("x-ms-proposed-lease-id") != blob.lease_id:
+                return blob_error(409, "LeaseAlreadyPresent", "There is already a lease present.")
+            duration = int(request.headers.get("x-ms-lease-duration", "-1"))
+            blob.lease_id = request.headers.get("x-ms-proposed-lease-id") or str(uuid.uuid4())
+            blob.lease_duration = duration
+            blob.lease_expires = -1 if duration < 0 else time.time() + duration
+            return web.Response(status=201, headers={"x-ms-lease-id": blob.lease_id, "ETag": blob.etag})
+        if not blob.leased() and action == "renew" and blob.lease_id == lease_id:
+            # An expired lease can be renewed as long as nobody else took it
+            blob.lease_expires = time.time() + blob.lease_duration
+            return web.Response(status=200, headers={"x-ms-lease-id": blob.lease_id, "ETag": blob.etag})
+        if lease_id != blob.lease_id or not blob.leased():
+            return blob_error(409, "LeaseIdMismatchWithLeaseOperation", "The lease ID specified did not match.")
+        if action == "renew":
+            blob.lease_expires = -1 if blob.lease_duration < 0 else time.time() + blob.lease_duration
+        elif action in ("release", "break"):
+            blob.lease_id = None
+        return web.Response(status=200, headers={"x-ms-lease-id": lease_id, "ETag": blob.etag})
+
+
+def parse_batch(body: str, boundary: str) -> list[tuple[str, str, dict[str, str]]]:
+    """
+    Split a multipart/mixed Blob batch body into the (method, path, headers) of its sub-requests
+    """
+    requests = []
+    for part in body.split(f"--{boundary}"):
+        match = re.search(r"^(GET|PUT|DELETE|HEAD|POST) (\S+) HTTP/1\.1\r?\n((?:.+\r?\n)*)", part, re.MULTILINE)
+        if match:
+            headers = dict(line.split(": ", 1) for line in match.group(3).splitlines() if ": " in line)
+            requests.append((match.group(1), match.group(2), {key.lower(): value for key, value in headers.items()}))
+    return requests
+
+
+class SearchStore:
+    """
+    In-memory indexes searched by term overlap, by cosine similarity when a vector is given, or both.
+    `documents` synthetic sections are preloaded in every new index so searches have results before ingestion.
+    """
+
+    def __init__(self, documents: int = 0, document_chars: int = 1000, embedding=None):
+        self.indexes: dict[str, dict[str, Any]] = {}
+        self.documents = documents
+        self.document_chars = document_chars
+        self.embedding = embedding
+        add_backend_to_path()
+        from core.vectorindex import FILTER_OPERATORS, parse_filter
+
+        self.parse_filter = parse_filter
+        self.filter_operators = FILTER_OPERATORS
+
+    def create_index(self, definition: dict[str, Any]) -> dict[str, Any]:
+        key = next((field["name"] for field in definition.get("fields", []) if field.get("key")), "id")
+        index = {"definition": definition, "key": key, "documents": {}}
+        for i in range(self.documents):
+            content = synthetic_text(self.document_chars, i)
+            index["documents"][f"doc-{i}"] = {
+                key: f"doc-{i}",
+                "content": content,
+                "embedding": self.embedding(content) if self.embedding else None,
+                "category": None,
+                "sourcepage": f"document{i // 10}-{i % 10 + 1}.pdf",
+                "sourcefile": f"document{i // 10}.pdf",
+            }
+        self.indexes[definition["name"]] = index
+        return index
+
+    def index(self, name: str) -> dict[str, Any]:
+        # Like the containers, an index is created on first use so prepdocs.py and the app can run in any order
+        return self.indexes.get(name) or self.create_index({"name": name, "fields": []})
+
+    def upload(self, name: str, actions: list[dict[str, Any]]) -> dict[str, Any]:
+        index = self.index(name)
+        results = []
+        for action in actions:
+            kind = action.pop("@search.action", "upload")
+            key = action[index["key"]]
+            documents = index["documents"]
+            if kind == "delete":
+                documents.pop(key, None)
+            elif kind in ("merge", "mergeOrUpload") and key in documents:
+                documents[key].update(action)
+            else:
+                documents[key] = action
+            results.append({"key": key, "status": True, "errorMessage": None, "statusCode": 200})
+        return {"value": results}
+
+    def search(self, name: str, query: dict[str, Any]) -> dict[str, Any]:
+        index = self.index(name)
+        clauses = self.parse_filter(query.get("filter"))
+        terms = set(re.findall(r"\w+", (query.get("search") or "").lower())) - {"*"}
+        # The 2023-07-01-Preview API sends a single "vector", later versions a list of "vectors"
+        vector_queries = query.get("vectors") or [query.get("vector") or {}]
+        vectors = [vector["value"] for vector in vector_queries if vector.get("value")]
+        scored = []
+        for document in index["documents"].values():
+            if not all(
+                document.get(field) is not None and self.filter_operators[op](document[field], value)
+                if op in ("gt", "lt")
+                else self.filter_operators[op](document.get(field), value)
+                for field, op, value in clauses
+            ):
+                continue
+            score = 1.0 if not terms and not vectors else 0.0
+            if terms:
+                words = re.findall(r"\w+", (document.get("content") or "").lower())
+                score += sum(word in terms for word in words) / (len(words) or 1)
+            for vector in vectors:
+                score += cosine(vector, document.get("embedding"))
+            if score > 0:
+                scored.append((score, document))
+        scored.sort(key=lambda item: -item[0])
+        # Only the ascending key order used to page through an index is supported
+        if query.get("orderby"):
+            scored.sort(key=lambda item: item[1].get(query["orderby"].split()[0]) or "")
+        skip = query.get("skip") or 0
+        top = query.get("top") or 50
+        select = query.get("select")
+        results = []
+        for score, document in scored[skip : skip + top]:
+            result = {key: value for key, value in document.items() if not select or key in select.split(",")}
+            result["@search.score"] = score
+            if query.get("captions"):
+                result["@search.captions"] = [{"text": (document.get("content") or "")[:200], "highlights": None}]
+            results.append(result)
+        response: dict[str, Any] = {"value": results}
+        if query.get("count"):
+            response["@odata.count"] = len(scored)
+        if query.get("answers") and results:
+            answer = {"key": results[0].get(index["key"]), "text": results[0].get("content", "")[:200], "score": 1.0}
+            response["@search.answers"] = [answer]
+        return response
+
+
+def cosine(a: list[float], b: list[float] | None) -> float:
+    if not b:
+        return 0.0
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def analyze_result(data: bytes, model: str, pages: str | None) -> dict[str, Any]:
+    """
+    A layout AnalyzeResult for a PDF, with its text extracted locally. For a page range the content only holds
+    those pages but page numbers stay those of the whole document, like the service does.
+    """
+    from pypdf import PdfReader
+
+    try:
+        texts = [page.extract_text() or "" for page in PdfReader(io.BytesIO(data)).pages]
+    except Exception:
+        texts = [synthetic_text(2000, len(data))]
+    first, last = 1, len(texts)
+    if pages:
+        first, _, last_page = pages.partition("-")
+        first, last = int(first), int(last_page or first)
+    content = ""
+    result_pages = []
+    for page_number, text in enumerate(texts, start=1):
+        if first <= page_number <= last:
+            result_pages.append(
+                {
+                    "pageNumber": page_number,
+                    "angle": 0,
+                    "width": 8.5,
+                    "height": 11,
+                    "unit": "inch",
+                    "spans": [{"offset": len(content), "length": len(text)}],
+                    "words": [],
+                    "lines": [],
+                }
+            )
+            content += text
+    return {
+        "apiVersion": "2022-08-31",
+        "modelId": model,
+        "stringIndexType": "unicodeCodePoint",
+        "content": content,
+        "pages": result_pages,
+        "tables": [],
+        "paragraphs": [],
+        "styles": [],
+    }
+
+
+class MockServer:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.latencies = {
+            "search": Latency(args.search_latency, args.jitter, args.seed),
+            "blob": Latency(args.blob_latency, args.jitter, args.seed + 1),
+            "formrecognizer": Latency(args.formrecognizer_latency, args.jitter, args.seed + 2),
+            "openai": Latency(args.openai_latency, args.jitter, args.seed + 3),
+        }
+        self.throttle = Throttle(args.throttle_rate, args.retry_after, args.openai_rpm, args.seed)
+        self.openai = FakeOpenAI(answer_tokens=args.answer_tokens, embedding_dimensions=args.embedding_dimensions)
+        self.token_latency = Latency(args.token_latency, args.jitter, args.seed + 4)
+        self.blobs = BlobStore(args.containers.split(","))
+        self.search = SearchStore(args.documents, args.document_chars, self.openai.embedding)
+        self.operations: dict[str, tuple[float, dict[str, Any]]] = {}
+        self.calls: dict[str, int] = {}
+        self.throttled: dict[str, int] = {}
+
+    def application(self) -> web.Application:
+        app = web.Application(middlewares=[service_conditions], client_max_size=1024**3)
+        app["server"] = self
+        app.router.add_route("*", "/search/{tail:.*}", self.search_request)
+        app.router.add_route("*", f"/{STORAGE_ACCOUNT}/{{container}}", self.container_request)
+        app.router.add_route("*", f"/{STORAGE_ACCOUNT}/{{container}}/{{blob:.+}}", self.blob_request)
+        app.router.add_post("/formrecognizer/documentModels/{model}:analyze", self.analyze)
+        app.router.add_get("/formrecognizer/documentModels/{model}/analyzeResults/{operation}", self.analyze_result)
+        app.router.add_post("/openai/deployments/{deployment}/{operation:.+}", self.openai_request)
+        app.router.add_post("/v1/{operation:.+}", self.openai_request)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": self.calls, "throttled": self.throttled})
+
+    async def search_request(self, request: web.Request) -> web.Response:
+        if request.path.rstrip("/") == "/search/indexes":
+            if request.method == "POST":
+                definition = await request.json()
+                self.search.create_index(definition)
+                return web.json_response(definition, status=201)
+            return web.json_response({"value": [{"name": name} for name in self.search.indexes]})
+        match = SEARCH_INDEX_PATH.match(request.path)
+        if match is None:
+            return web.json_response({"error": {"code": "NotFound", "message": request.path}}, status=404)
+        name = match.group(1) or match.group(2)
+        operation = match.group(3)
+        if operation is None and request.method == "GET":
+            if name not in self.search.indexes:
+                error = {"code": "", "message": f"No index with the name '{name}'"}
+                return web.json_response({"error": error}, status=404)
+            return web.json_response(self.search.indexes[name]["definition"])
+        if operation is None and request.method == "DELETE":
+            self.search.indexes.pop(name, None)
+            return web.Response(status=204)
+        if operation is None and request.method == "PUT":
+            definition = await request.json()
+            self.search.create_index(definition)
+            return web.json_response(definition, status=201)
+        body = await request.json()
+        if operation.endswith("index"):
+            return web.json_response(self.search.upload(name, body["value"]))
+        return web.json_response(self.search.search(name, body))
+
+    async def container_request(self, request: web.Request) -> web.Response:
+        return await self.blobs.container_request(request, request.match_info["container"])
+
+    async def blob_request(self, request: web.Request) -> web.Response:
+        return await self.blobs.blob_request(request, request.match_info["container"], request.match_info["blob"])
+
+    async def analyze(self, request: web.Request) -> web.Response:
+        model = request.match_info["model"]
+        result = analyze_result(await request.read(), model, request.query.get("pages"))
+        operation = uuid.uuid4().hex
+        ready = time.monotonic() + len(result["pages"]) * self.args.formrecognizer_page_latency / 1000
+        self.operations[operation] = (ready, result)
+        location = (
+            f"{request.scheme}://{request.host}/formrecognizer/documentModels/{model}/analyzeResults/{operation}"
+            f"?api-version={request.query.get('api-version', '2022-08-31')}"
+        )
+        return web.Response(status=202, headers={"Operation-Location": location, **self.retry_after(ready)})
+
+    async def analyze_result(self, request: web.Request) -> web.Response:
+        operation = self.operations.get(request.match_info["operation"])
+        if operation is None:
+            return web.json_response({"error": {"code": "NotFound", "message": "Operation not found"}}, status=404)
+        ready, result = operation
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        body: dict[str, Any] = {"createdDateTime": now, "lastUpdatedDateTime": now, "status": "running"}
+        if time.monotonic() < ready:
+            return web.json_response(body, headers=self.retry_after(ready))
+        del self.operations[request.match_info["operation"]]
+        return web.json_response({**body, "status": "succeeded", "analyzeResult": result})
+
+    @staticmethod
+    def retry_after(ready: float) -> dict[str, str]:
+        # The SDK polls again after retry-after-ms, a zero would make it fall back to its default interval
+        return {"retry-after-ms": str(max(int((ready - time.monotonic()) * 1000), 1))}
+
+    async def openai_request(self, request: web.Request) -> web.StreamResponse:
+        operation = request.match_info["operation"]
+        body = await request.json()
+        if operation == "embeddings":
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            data = [
+                {"object": "embedding", "index": i, "embedding": self.openai.embedding(str(text))}
+                for i, text in enumerate(inputs)
+            ]
+            tokens = sum(len(str(text).split()) for text in inputs)
+            usage = {"prompt_tokens": tokens, "total_tokens": tokens}
+            return web.json_response({"object": "list", "data": data, "model": body.get("model"), "usage": usage})
+        if operation == "completions":
+            prompts = body["prompt"] if isinstance(body["prompt"], list) else [body["prompt"]]
+            await self.token_latency.wait(scale=len(self.openai.answer.split()))
+            choices = [
+                {"index": i, "text": self.openai.react_step(prompt), "finish_reason": "stop", "logprobs": None}
+                for i, prompt in enumerate(prompts)
+            ]
+            usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            return web.json_response({"object": "text_completion", "choices": choices, "usage": usage})
+        if operation != "chat/completions":
+            return web.json_response({"error": {"code": "NotFound", "message": operation}}, status=404)
+        messages = body["messages"]
+        if body.get("functions"):
+            query = messages[-1]["content"].replace("Generate search query for: ", "")
+            call = {"name": "search_sources", "arguments": json.dumps({"search_query": query})}
+            message = {"role": "assistant", "content": None, "function_call": call}
+            return web.json_response({"object": "chat.completion", "choices": [{"index": 0, "message": message}]})
+        words = self.openai.answer.split(" ")
+        usage = {
+            "prompt_tokens": sum(len(str(m.get("content") or "").split()) for m in messages),
+            "completion_tokens": len(words),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if not body.get("stream"):
+            await self.token_latency.wait(scale=len(words))
+            message = {"role": "assistant", "content": self.openai.answer}
+            choices = [{"index": 0, "message": message, "finish_reason": "stop"}]
+            return web.json_response({"object": "chat.completion", "choices": choices, "usage": usage})
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        # Azure OpenAI's "2023-07-01-preview" API version sends a first chunk without choices
+        await response.write(b'data: {"object": "chat.completion.chunk", "choices": []}\n\n')
+        for i, word in enumerate(words):
+            await self.token_latency.wait()
+            delta = {"content": word + (" " if i < len(words) - 1 else "")}
+            finish_reason = "stop" if i == len(words) - 1 else None
+            choices = [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            chunk = {"object": "chat.completion.chunk", "choices": choices}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+
+def write_certificate(directory: str, host: str) -> tuple[str, str, str]:
+    """
+    Write a self-signed certificate for `host`, its key, and a CA bundle of the default roots plus that certificate
+    """
+    import certifi
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "azure-search-openai mock services")])
+    names: list[x509.GeneralName] = [x509.DNSName("localhost")]
+    for address in {host, "127.0.0.1"}:
+        try:
+            names.append(x509.IPAddress(ipaddress.ip_address(address)))
+        except ValueError:
+            names.append(x509.DNSName(address))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(x509.SubjectAlternativeName(names), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    certificate_path = os.path.join(directory, "mockserver.crt")
+    key_path = os.path.join(directory, "mockserver.key")
+    bundle_path = os.path.join(directory, "ca-bundle.pem")
+    pem = certificate.public_bytes(serialization.Encoding.PEM)
+    with open(certificate_path, "wb") as f:
+        f.write(pem)
+    with open(key_path, "wb") as f:
+        encoding = serialization.Encoding.PEM
+        f.write(key.private_bytes(encoding, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    with open(certifi.where(), "rb") as roots, open(bundle_path, "wb") as f:
+        f.write(roots.read() + b"\n" + pem)
+    return certificate_path, key_path, bundle_path
+
+
+def client_environment(base_url: str, bundle_path: str | None, containers: list[str]) -> dict[str, str]:
+    """
+    The settings that point the app at the mock server, see setup_clients in app/backend/app.py
+    """
+    environment = {
+        "OPENAI_HOST": "azure",
+        "AZURE_OPENAI_CHATGPT_MODEL": "gpt-35-turbo",
+        "AZURE_OPENAI_CHATGPT_DEPLOYMENT": "chat",
+        "AZURE_OPENAI_EMB_DEPLOYMENT": "embedding",
+        "AZURE_SEARCH_INDEX": "gptkbindex",
+        "AZURE_STORAGE_CONTAINER": containers[0],
+        "AZURE_STORAGE_DOCUMENT_CONTAINER": containers[-1],
+        "AZURE_SEARCH_ENDPOINT": f"{base_url}/search",
+        "AZURE_SEARCH_SERVICE_KEY": "mock",
+        "AZURE_STORAGE_ENDPOINT": f"{base_url}/{STORAGE_ACCOUNT}",
+        "AZURE_STORAGE_ACCOUNT": STORAGE_ACCOUNT,
+        "AZURE_STORAGE_ACCOUNT_KEY": STORAGE_KEY,
+        "AZURE_FORMRECOGNIZER_ENDPOINT": f"{base_url}/",
+        "AZURE_FORMRECOGNIZER_KEY": "mock",
+        "AZURE_OPENAI_ENDPOINT": base_url,
+        "AZURE_OPENAI_KEY": "mock",
+    }
+    if bundle_path:
+        # Read by requests and by the ssl module's default context, which aiohttp uses
+        environment["REQUESTS_CA_BUNDLE"] = environment["SSL_CERT_FILE"] = bundle_path
+    return environment
+
+
+def argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Serve local stand-ins for Cognitive Search, Blob Storage, Form Recognizer and OpenAI.",
+        epilog="Example: python -m benchmarks.mockserver --port 8443 --openai-latency 200 --token-latency 20",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8443, help="Port to listen on")
+    parser.add_argument("--no-tls", action="store_true", help="Serve plain HTTP, the Search index client needs TLS")
+    parser.add_argument("--cert-dir", help="Directory for the certificate and CA bundle, a temporary one by default")
+    parser.add_argument(
+        "--containers", default="content,documents", help="Blob containers to create, pages first and documents last"
+    )
+    parser.add_argument("--search-latency", type=float, default=30, help="Latency of each Search call in ms")
+    parser.add_argument("--blob-latency", type=float, default=10, help="Latency of each Blob Storage call in ms")
+    parser.add_argument(
+        "--formrecognizer-latency", type=float, default=50, help="Latency of each Form Recognizer call in ms"
+    )
+    parser.add_argument("--formrecognizer-page-latency", type=float, default=200, help="Analysis time per page in ms")
+    parser.add_argument("--openai-latency", type=float, default=300, help="Latency before each OpenAI response in ms")
+    parser.add_argument("--token-latency", type=float, default=15, help="Latency per generated token in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="Latencies vary uniformly within this many ms")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="Share of calls answered with 429, 0 to 1")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After of throttled calls in seconds")
+    parser.add_argument(
+        "--openai-rpm", type=int, default=0, help="OpenAI requests per minute before 429s, 0 for no limit"
+    )
+    parser.add_argument("--answer-tokens", type=int, default=100, help="Length of the chat answers in tokens")
+    parser.add_argument("--embedding-dimensions", type=int, default=1536, help="Dimensions of the embeddings")
+    parser.add_argument("--documents", type=int, default=200, help="Synthetic sections preloaded in new indexes")
+    parser.add_argument("--document-chars", type=int, default=1000, help="Length of the preloaded sections")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the latencies, throttling and synthetic data")
+    return parser
+
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+
+    ssl_context = None
+    bundle_path = None
+    if not args.no_tls:
+        import ssl
+
+        certificate_path, key_path, bundle_path = write_certificate(
+            args.cert_dir or tempfile.mkdtemp(prefix="mockserver-"), args.host
+        )
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(certificate_path, key_path)
+    base_url = f"{'http' if args.no_tls else 'https'}://{args.host}:{args.port}"
+    print("Point the app at the mock services with:")
+    for key, value in client_environment(base_url, bundle_path, args.containers.split(",")).items():
+        print(f"export {key}={value}")
+    print(f"Call counts are served at {base_url}/stats", flush=True)
+    web.run_app(MockServer(args).application(), host=args.host, port=args.port, ssl_context=ssl_context, print=None)
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import io
+import json
+import os
+import random
+import time
+from typing import Any
+
+from locust import events
+
+QUESTIONS = [
+    "What is included in my Northwind Health Plus plan that is not in standard?",
+    "What does a Product Manager do?",
+    "What happens in a performance review?",
+    "Whats your whistleblower policy?",
+    "Does my plan cover eye exams?",
+    "What is the deductible for the employee plan for a visit to Overlake in Bellevue?",
+]
+
+FOLLOW_UPS = [
+    "Does that apply to my family too?",
+    "Are there any exceptions?",
+    "Can you summarize that in a table?",
+]
+
+OVERRIDES = {
+    "retrieval_mode": "hybrid",
+    "semantic_ranker": True,
+    "semantic_captions": False,
+    "top": 3,
+    "suggest_followup_questions": False,
+}
+
+
+def env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def env_list(name: str, default: str) -> list[str]:
+    return [value.strip() for value in os.getenv(name, default).split(",") if value.strip()]
+
+
+def chat_payload(history: list[dict[str, str]], approach: str = "rrr") -> dict[str, Any]:
+    return {"history": history, "approach": approach, "overrides": OVERRIDES}
+
+
+def delta_content(event: dict[str, Any]) -> str | None:
+    choices = event.get("choices")
+    return (choices[0].get("delta") or {}).get("content") if choices else None
+
+
+def fire(name: str, response_time_ms: float, response_length: int = 0, exception: Exception | None = None):
+    """
+    Report a custom measurement, it shows up in the statistics like a request of type STREAM
+    """
+    events.request.fire(
+        request_type="STREAM",
+        name=name,
+        response_time=response_time_ms,
+        response_length=response_length,
+        exception=exception,
+        context={},
+    )
+
+
+def read_stream(response, start: float) -> tuple[str, dict[str, Any] | None]:
+    """
+    Read an NDJSON answer stream, reporting time to first token and stream completion,
+    and return the answer and the extra info (data points, thoughts) sent before it
+    """
+    answer = []
+    extra_info = None
+    first_token = None
+    for line in response.iter_lines():
+        if not line:
+            continue
+        event = json.loads(line)
+        if "error" in event:
+            raise RuntimeError(event["error"])
+        content = delta_content(event)
+        if content is None:
+            if "data_points" in event:
+                extra_info = event
+            continue
+        if first_token is None:
+            first_token = time.perf_counter()
+            fire("time_to_first_token", (first_token - start) * 1000)
+        answer.append(content)
+    if first_token is None:
+        raise RuntimeError("The stream ended without an answer")
+    fire("stream_completion", (time.perf_counter() - start) * 1000, response_length=len(answer))
+    return "".join(answer), extra_info
+
+
+def citations(data_points: list[str]) -> list[str]:
+    # Data points are "<sourcepage>: <content>"
+    return [point.split(":", 1)[0] for point in data_points if ":" in point]
+
+
+def sample_pdf(label: str) -> bytes:
+    """
+    A small one page PDF whose content differs per label, so re-uploads of the same label are unchanged
+    """
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    writer.add_blank_page(612, 792)
+    writer.add_metadata({"/Title": f"Load test document {label}"})
+    stream = io.BytesIO()
+    writer.write(stream)
+    return stream.getvalue()
+
+
+def pick(values: list[str]) -> str:
+    return random.choice(values)
@@ -0,0 +1,26 @@
+"""
+Mixed traffic for the app: chat streaming, citation clicking, ask and document admin users.
+
+Examples:
+    locust -f locustfile.py -H http://localhost:50505
+    LOADTEST_SHAPE=step LOADTEST_STEP_USERS=10 locust -f locustfile.py -H http://localhost:50505 --headless
+    LOADTEST_SHAPE=soak LOADTEST_SOAK_USERS=40 locust -f locustfile.py -H http://localhost:50505 --headless
+"""
+import os
+
+from loadtests.users import AdminUser, AskUser, ChatStreamUser, CitationUser
+
+__all__ = ["AdminUser", "AskUser", "ChatStreamUser", "CitationUser"]
+
+# Locust only allows one shape class per locustfile, expose the one that was asked for
+SHAPE = os.getenv("LOADTEST_SHAPE", "")
+if SHAPE == "step":
+    from loadtests.shapes import StepLoadShape  # noqa: F401
+
+    __all__.append("StepLoadShape")
+elif SHAPE == "soak":
+    from loadtests.shapes import SoakShape  # noqa: F401
+
+    __all__.append("SoakShape")
+elif SHAPE:
+    raise ValueError(f"LOADTEST_SHAPE must be step or soak, not {SHAPE}")
@@ -0,0 +1,41 @@
+"""
+Load shapes for capacity planning. A step load finds the user count where latency or errors turn, a soak holds a
+steady load for long enough to show leaks, quota throttling and slow degradation.
+"""
+from locust import LoadTestShape
+
+from loadtests.common import env_int
+
+
+class StepLoadShape(LoadTestShape):
+    """
+    Adds LOADTEST_STEP_USERS users every LOADTEST_STEP_SECONDS, for LOADTEST_STEPS steps
+    """
+
+    step_users = env_int("LOADTEST_STEP_USERS", 10)
+    step_seconds = env_int("LOADTEST_STEP_SECONDS", 120)
+    steps = env_int("LOADTEST_STEPS", 5)
+    spawn_rate = env_int("LOADTEST_SPAWN_RATE", 2)
+
+    def tick(self):
+        run_time = self.get_run_time()
+        if run_time >= self.step_seconds * self.steps:
+            return None
+        step = int(run_time // self.step_seconds) + 1
+        return step * self.step_users, self.spawn_rate
+
+
+class SoakShape(LoadTestShape):
+    """
+    Ramps up to LOADTEST_SOAK_USERS over LOADTEST_SOAK_RAMP_SECONDS and holds them for LOADTEST_SOAK_SECONDS
+    """
+
+    users = env_int("LOADTEST_SOAK_USERS", 20)
+    ramp_seconds = env_int("LOADTEST_SOAK_RAMP_SECONDS", 300)
+    soak_seconds = env_int("LOADTEST_SOAK_SECONDS", 3600)
+
+    def tick(self):
+        run_time = self.get_run_time()
+        if run_time >= self.ramp_seconds + self.soak_seconds:
+            return None
+        return self.users, max(self.users / max(self.ramp_seconds, 1), 0.1)
@@ -0,0 +1,161 @@
+"""
+Weighted user classes modelling the traffic mix of the app. Pacing only uses `wait_time`, so every user keeps
+exactly one request in flight while it is active and the configured concurrency is the real concurrency.
+"""
+import time
+import uuid
+
+from locust import HttpUser, between, task
+
+from loadtests.common import (
+    FOLLOW_UPS,
+    QUESTIONS,
+    chat_payload,
+    citations,
+    env_int,
+    env_list,
+    fire,
+    pick,
+    read_stream,
+    sample_pdf,
+)
+
+
+class ChatStreamUser(HttpUser):
+    """
+    The typical user: a short conversation on /chat_stream, reading the answer as it streams
+    """
+
+    weight = env_int("LOADTEST_CHAT_STREAM_WEIGHT", 6)
+    wait_time = between(5, 20)
+
+    def on_start(self):
+        self.client.get("/")
+        self.history = []
+
+    @task
+    def chat_stream(self):
+        # Conversations are a question and up to two follow-ups
+        if len(self.history) >= 3:
+            self.history = []
+        question = pick(FOLLOW_UPS) if self.history else pick(QUESTIONS)
+        history = self.history + [{"user": question}]
+        start = time.perf_counter()
+        with self.client.post(
+            "/chat_stream", json=chat_payload(history), stream=True, catch_response=True, name="/chat_stream"
+        ) as response:
+            if response.status_code != 200:
+                response.failure(f"Status {response.status_code}")
+                return
+            try:
+                answer, _ = read_stream(response, start)
+            except Exception as e:
+                fire("stream_completion", (time.perf_counter() - start) * 1000, exception=e)
+                response.failure(str(e))
+                return
+            response.success()
+        self.history = history[:-1] + [{"user": question, "bot": answer}]
+
+
+class CitationUser(HttpUser):
+    """
+    Asks on /chat_stream and then opens the cited pages, like a user checking the sources of an answer
+    """
+
+    weight = env_int("LOADTEST_CITATION_WEIGHT", 2)
+    wait_time = between(5, 15)
+
+    @task
+    def chat_and_open_citations(self):
+        start = time.perf_counter()
+        with self.client.post(
+            "/chat_stream",
+            json=chat_payload([{"user": pick(QUESTIONS)}]),
+            stream=True,
+            catch_response=True,
+            name="/chat_stream",
+        ) as response:
+            if response.status_code != 200:
+                response.failure(f"Status {response.status_code}")
+                return
+            try:
+                _, extra_info = read_stream(response, start)
+            except Exception as e:
+                response.failure(str(e))
+                return
+            response.success()
+        # The data points arrive before the answer, in the extra info event of the stream
+        for page in citations((extra_info or {}).get("data_points", []))[:2]:
+            self.client.get(f"/content/{page}", name="/content/[page]")
+
+
+class AskUser(HttpUser):
+    """
+    One-off questions on /ask, spread over the approaches in LOADTEST_ASK_APPROACHES
+    """
+
+    weight = env_int("LOADTEST_ASK_WEIGHT", 2)
+    wait_time = between(5, 20)
+
+    def on_start(self):
+        self.approaches = env_list("LOADTEST_ASK_APPROACHES", "rtr")
+
+    @task
+    def ask(self):
+        approach = pick(self.approaches)
+        self.client.post(
+            "/ask",
+            json={"question": pick(QUESTIONS), "approach": approach, "overrides": chat_payload([])["overrides"]},
+            name=f"/ask ({approach})",
+        )
+
+
+class AdminUser(HttpUser):
+    """
+    Manages documents: polls /files the way the documents page does, and now and then uploads a document.
+    Ingestion is only started when LOADTEST_INGEST=1, as it spends Form Recognizer and embedding quota.
+    """
+
+    weight = env_int("LOADTEST_ADMIN_WEIGHT", 1)
+    wait_time = between(2, 5)
+
+    def on_start(self):
+        self.etag = None
+        self.label = uuid.uuid4().hex[:8]
+        self.ingest = env_int("LOADTEST_INGEST", 0) == 1
+        self.job = None
+
+    @task(10)
+    def poll_files(self):
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        with self.client.get("/files", headers=headers, catch_response=True) as response:
+            if response.status_code == 304:
+                response.success()
+            elif response.status_code == 200:
+                self.etag = response.headers.get("ETag")
+                response.success()
+            else:
+                response.failure(f"Status {response.status_code}")
+        if self.job:
+            with self.client.get(
+                f"/ingest-jobs/{self.job}", name="/ingest-jobs/[job]", catch_response=True
+            ) as response:
+                if response.status_code == 200 and response.json().get("state") in ("succeeded", "failed"):
+                    self.job = None
+                response.success()
+
+    @task(1)
+    def upload(self):
+        filename = f"loadtest-{self.label}.pdf"
+        files = {"files": (filename, sample_pdf(self.label), "application/pdf")}
+        self.client.post("/upload-files", files=files)
+        if self.ingest and not self.job:
+            with self.client.get("/ingest-files", catch_response=True) as response:
+                # Another admin user may already hold the ingestion lock
+                if response.status_code == 200:
+                    self.job = response.json().get("job")
+                    response.success()
+                elif response.status_code == 403:
+                    response.success()
+                else:
+                    response.failure(f"Status {response.status_code}")
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from azure.core.credentials import AzureKeyCredential
+from azure.identity import AzureDeveloperCliCredential
+from azure.search.documents import SearchClient
+
+args = argparse.Namespace(verbose=False)
+
+VECTORS_FILENAME = "embeddings.npy"
+SECTIONS_FILENAME = "sections.jsonl"
+
+PAGE_SIZE = 1000
+
+
+class EmbeddingSnapshotWriter:
+    """
+    Writes a snapshot of section embeddings one row at a time: a float32 `embeddings.npy` matrix that can be
+    memory-mapped, and a `sections.jsonl` table with the remaining fields of each section in the same row order.
+    Vectors are streamed to a temporary file and only prefixed with the .npy header once the number of rows is
+    known, so memory use does not grow with the size of the index.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self.rows = 0
+        self.dimensions = None
+        self.vectors = tempfile.TemporaryFile(dir=output_dir)
+        self.sections = open(os.path.join(output_dir, SECTIONS_FILENAME + ".tmp"), "w", encoding="utf-8")
+
+    def write(self, section: dict, embedding: list[float]):
+        vector = np.asarray(embedding, dtype="<f4")
+        if self.dimensions is None:
+            self.dimensions = len(vector)
+        elif len(vector) != self.dimensions:
+            raise ValueError(f"Section {section.get('id')} has {len(vector)} dimensions instead of {self.dimensions}")
+        self.vectors.write(vector.tobytes())
+        self.sections.write(json.dumps(section, ensure_ascii=False) + "\n")
+        self.rows += 1
+
+    def close(self):
+        self.sections.close()
+        os.replace(self.sections.name, os.path.join(self.output_dir, SECTIONS_FILENAME))
+        header = {"descr": "<f4", "fortran_order": False, "shape": (self.rows, self.dimensions or 0)}
+        with open(os.path.join(self.output_dir, VECTORS_FILENAME), "wb") as f:
+            np.lib.format.write_array_header_1_0(f, header)
+            self.vectors.seek(0)
+            shutil.copyfileobj(self.vectors, f)
+        self.vectors.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self.sections.close()
+            os.remove(self.sections.name)
+            self.vectors.close()
+
+
+def export_embeddings(search_client, writer: EmbeddingSnapshotWriter, fields: list[str], filter: str = None):
+    """
+    Page through the sections in key order, starting each page after the last id of the previous one, so the
+    export neither depends on the order of an unsorted search nor runs into the service's $skip limit
+    """
+    skipped = 0
+    last_id = None
+    while True:
+        clauses = [f"({filter})"] if filter else []
+        if last_id is not None:
+            clauses.append(f"id gt '{last_id}'")
+        page = list(
+            search_client.search(
+                "",
+                filter=" and ".join(clauses) or None,
+                select=list(dict.fromkeys(fields + ["id", "embedding"])),
+                order_by=["id"],
+                top=PAGE_SIZE,
+            )
+        )
+        for document in page:
+            embedding = document.get("embedding")
+            if not embedding:
+                skipped += 1
+                continue
+            writer.write({field: document.get(field) for field in fields}, embedding)
+        if args.verbose:
+            print(f"\tExported {writer.rows} sections")
+        if len(page) < PAGE_SIZE:
+            break
+        last_id = page[-1]["id"]
+    if skipped:
+        print(f"Skipped {skipped} sections without an embedding")
+    return writer.rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the section embeddings stored in a search index to a local snapshot that can be memory-mapped.",
+        epilog="Example: exportembeddings.py ./snapshot --searchservice mysearch --index myindex -v",
+    )
+    parser.add_argument("output", help="Directory the snapshot is written to")
+    parser.add_argument(
+        "--searchservice",
+        help="Name of the Azure Cognitive Search service where content is indexed",
+    )
+    parser.add_argument("--index", help="Name of the Azure Cognitive Search index to export")
+    parser.add_argument(
+        "--searchkey",
+        required=False,
+        help="Optional. Use this Azure Cognitive Search account key instead of the current user identity to login (use az login to set current user for Azure)",
+    )
+    parser.add_argument(
+        "--tenantid", required=False, help="Optional. Use this to define the Azure directory where to authenticate)"
+    )
+    parser.add_argument(
+        "--fields",
+        default="id,content,category,sourcepage,sourcefile",
+        help="Comma separated fields stored next to each vector. The local vector index needs content to answer questions",
+    )
+    parser.add_argument("--filter", required=False, help="Optional. OData filter selecting the sections to export")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
+    args = parser.parse_args()
+
+    search_creds = (
+        AzureKeyCredential(args.searchkey)
+        if args.searchkey
+        else AzureDeveloperCliCredential(tenant_id=args.tenantid, process_timeout=60)
+    )
+    search_client = SearchClient(
+        endpoint=f"https://{args.searchservice}.search.windows.net/", index_name=args.index, credential=search_creds
+    )
+    with EmbeddingSnapshotWriter(args.output) as writer:
+        rows = export_embeddings(search_client, writer, args.fields.split(","), args.filter)
+    print(f"Exported {rows} sections to '{args.output}'")
@@ -57,6 +57,21 @@ def calculate_tokens_emb_aoai(input: str):
     return len(encoding.encode(input))
 
 
+def search_endpoint():
+    return getattr(args, "searchendpoint", None) or f"https://{args.searchservice}.search.windows.net/"
+
+
+def storage_endpoint():
+    return getattr(args, "storageendpoint", None) or f"https://{args.storageaccount}.blob.core.windows.net"
+
+
+def formrecognizer_endpoint():
+    return (
+        getattr(args, "formrecognizerendpoint", None)
+        or f"https://{args.formrecognizerservice}.cognitiveservices.azure.com/"
+    )
+
+
 def blob_name_from_file_page(filename, page=0):
     if os.path.splitext(filename)[1].lower() == ".pdf":
         return os.path.splitext(os.path.basename(filename))[0] + f"-{page}" + ".pdf"
@@ -65,9 +80,7 @@ def blob_name_from_file_page(filename, page=0):
 
 
 def upload_blobs(filename):
-    blob_service = BlobServiceClient(
-        account_url=f"https://{args.storageaccount}.blob.core.windows.net", credential=storage_creds
-    )
+    blob_service = BlobServiceClient(account_url=storage_endpoint(), credential=storage_creds)
     blob_container = blob_service.get_container_client(args.container)
     if not blob_container.exists():
         blob_container.create_container()
@@ -95,9 +108,7 @@ def upload_blobs(filename):
 def remove_blobs(filename):
     if args.verbose:
         print(f"Removing blobs for '{filename or '<all>'}'")
-    blob_service = BlobServiceClient(
-        account_url=f"https://{args.storageaccount}.blob.core.windows.net", credential=storage_creds
-    )
+    blob_service = BlobServiceClient(account_url=storage_endpoint(), credential=storage_creds)
     blob_container = blob_service.get_container_client(args.container)
     if blob_container.exists():
         if filename is None:
@@ -149,7 +160,7 @@ def get_document_text(filename):
         if args.verbose:
             print(f"Extracting text from '{filename}' using Azure Form Recognizer")
         form_recognizer_client = DocumentAnalysisClient(
-            endpoint=f"https://{args.formrecognizerservice}.cognitiveservices.azure.com/",
+            endpoint=formrecognizer_endpoint(),
             credential=formrecognizer_creds,
             headers={"x-ms-useragent": "azure-search-chat-demo/1.0.0"},
         )
@@ -320,14 +331,12 @@ def compute_embedding_in_batch(texts):
 def create_search_index():
     if args.verbose:
         print(f"Ensuring search index {args.index} exists")
-    index_client = SearchIndexClient(
-        endpoint=f"https://{args.searchservice}.search.windows.net/", credential=search_creds
-    )
+    index_client = SearchIndexClient(endpoint=search_endpoint(), credential=search_creds)
     if args.index not in index_client.list_index_names():
         index = SearchIndex(
             name=args.index,
             fields=[
-                SimpleField(name="id", type="Edm.String", key=True),
+                SimpleField(name="id", type="Edm.String", key=True, sortable=True),
                 SearchableField(name="content", type="Edm.String", analyzer_name="en.microsoft"),
                 SearchField(
                     name="embedding",
@@ -391,6 +400,7 @@ def update_embeddings_in_batch(sections):
                 batch_response[item["id"]] = emb
             batch_queue = []
             batch_queue.append(s)
+            copy_s.append(s)
             token_count = calculate_tokens_emb_aoai(s["content"])
 
     if batch_queue:
@@ -408,9 +418,7 @@ def update_embeddings_in_batch(sections):
 def index_sections(filename, sections):
     if args.verbose:
         print(f"Indexing sections from '{filename}' into search index '{args.index}'")
-    search_client = SearchClient(
-        endpoint=f"https://{args.searchservice}.search.windows.net/", index_name=args.index, credential=search_creds
-    )
+    search_client = SearchClient(endpoint=search_endpoint(), index_name=args.index, credential=search_creds)
     i = 0
     batch = []
     for s in sections:
@@ -433,9 +441,7 @@ def index_sections(filename, sections):
 def remove_from_index(filename):
     if args.verbose:
         print(f"Removing sections from '{filename or '<all>'}' from search index '{args.index}'")
-    search_client = SearchClient(
-        endpoint=f"https://{args.searchservice}.search.windows.net/", index_name=args.index, credential=search_creds
-    )
+    search_client = SearchClient(endpoint=search_endpoint(), index_name=args.index, credential=search_creds)
     while True:
         filter = None if filename is None else f"sourcefile eq '{os.path.basename(filename)}'"
         r = search_client.search("", filter=filter, top=1000, include_total_count=True)
@@ -585,6 +591,27 @@ if __name__ == "__main__":
         help="Optional. Use this Azure Form Recognizer account key instead of the current user identity to login (use az login to set current user for Azure)",
     )
 
+    parser.add_argument(
+        "--searchendpoint",
+        default=os.getenv("AZURE_SEARCH_ENDPOINT"),
+        help="Optional. Use this endpoint instead of the one of --searchservice, e.g. a local stand-in (see benchmarks/mockserver.py)",
+    )
+    parser.add_argument(
+        "--storageendpoint",
+        default=os.getenv("AZURE_STORAGE_ENDPOINT"),
+        help="Optional. Use this Blob Storage account URL instead of the one of --storageaccount",
+    )
+    parser.add_argument(
+        "--formrecognizerendpoint",
+        default=os.getenv("AZURE_FORMRECOGNIZER_ENDPOINT"),
+        help="Optional. Use this endpoint instead of the one of --formrecognizerservice",
+    )
+    parser.add_argument(
+        "--openaiendpoint",
+        default=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        help="Optional. Use this endpoint instead of the one of --openaiservice",
+    )
+
     parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
     args = parser.parse_args()
 
@@ -603,7 +630,7 @@ if __name__ == "__main__":
         storage_creds = default_creds if args.storagekey is None else args.storagekey
     if not args.localpdfparser:
         # check if Azure Form Recognizer credentials are provided
-        if args.formrecognizerservice is None:
+        if args.formrecognizerservice is None and args.formrecognizerendpoint is None:
             print(
                 "Error: Azure Form Recognizer service is not provided. Please provide formrecognizerservice or use --localpdfparser for local pypdf parser."
             )
@@ -623,7 +650,7 @@ if __name__ == "__main__":
             else:
                 openai.api_key = args.openaikey
                 openai.api_type = "azure"
-            openai.api_base = f"https://{args.openaiservice}.openai.azure.com"
+            openai.api_base = args.openaiendpoint or f"https://{args.openaiservice}.openai.azure.com"
             openai.api_version = "2023-05-15"
         else:
             print("using normal openai")
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from core.admission import AdmissionController
+
+
+class SlowApp:
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = 0
+
+    async def __call__(self, scope, receive, send):
+        self.started += 1
+        await self.release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def call(app, path="/chat"):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await app({"type": "http", "path": path}, None, send)
+    return messages[0]["status"], dict(messages[0]["headers"])
+
+
+@pytest.mark.asyncio
+async def test_queues_then_rejects_beyond_the_limits():
+    inner = SlowApp()
+    app = AdmissionController(inner, max_inflight=1, max_queued=1, queue_timeout=5, paths=["/chat"])
+    first = asyncio.create_task(call(app))
+    queued = asyncio.create_task(call(app))
+    await asyncio.sleep(0)
+    assert (inner.started, app.inflight, app.queued) == (1, 1, 1)
+
+    status, headers = await call(app)
+    assert status == 503
+    assert headers[b"retry-after"] == b"3"
+    # Other routes are not limited
+    other = asyncio.create_task(call(app, "/files"))
+    await asyncio.sleep(0)
+    assert inner.started == 2
+
+    inner.release.set()
+    assert [(await task)[0] for task in (first, queued, other)] == [200, 200, 200]
+    assert (app.inflight, app.queued) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_rejects_requests_that_wait_too_long():
+    inner = SlowApp()
+    app = AdmissionController(inner, max_inflight=1, max_queued=5, queue_timeout=0.01, paths=["/ask"])
+    first = asyncio.create_task(call(app, "/ask"))
+    await asyncio.sleep(0)
+    assert (await call(app, "/ask"))[0] == 503
+    inner.release.set()
+    assert (await first)[0] == 200
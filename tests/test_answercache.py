@@ -0,0 +1,66 @@
+from core.answercache import AnswerCache
+
+
+def test_lookup_returns_most_similar_answer_above_threshold():
+    cache = AnswerCache(threshold=0.9)
+    scope = AnswerCache.make_scope("ask", {"top": 3})
+    cache.store([1.0, 0.0, 0.0], scope, {"answer": "x"})
+    cache.store([0.0, 1.0, 0.0], scope, {"answer": "y"})
+
+    assert cache.lookup([0.1, 0.95, 0.0], scope) == {"answer": "y"}
+    assert cache.lookup([0.0, 0.0, 1.0], scope) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lookup_requires_matching_overrides():
+    cache = AnswerCache(threshold=0.9)
+    cache.store([1.0, 0.0], AnswerCache.make_scope("ask", {"top": 3, "semantic_ranker": True}), {"answer": "x"})
+
+    assert cache.lookup([1.0, 0.0], AnswerCache.make_scope("ask", {"semantic_ranker": True, "top": 3})) is not None
+    assert cache.lookup([1.0, 0.0], AnswerCache.make_scope("ask", {"top": 5})) is None
+    assert cache.lookup([1.0, 0.0], AnswerCache.make_scope("chat", {"top": 3, "semantic_ranker": True})) is None
+
+
+def test_evicts_least_recently_used_entry():
+    cache = AnswerCache(threshold=0.99, max_entries=2)
+    cache.store([1.0, 0.0, 0.0], "s", {"answer": "a"})
+    cache.store([0.0, 1.0, 0.0], "s", {"answer": "b"})
+    cache.lookup([1.0, 0.0, 0.0], "s")
+    cache.store([0.0, 0.0, 1.0], "s", {"answer": "c"})
+
+    assert len(cache) == 2
+    assert cache.lookup([1.0, 0.0, 0.0], "s") == {"answer": "a"}
+    assert cache.lookup([0.0, 1.0, 0.0], "s") is None
+    assert cache.lookup([0.0, 0.0, 1.0], "s") == {"answer": "c"}
+
+
+def test_generation_change_clears_cache():
+    cache = AnswerCache()
+    cache.sync_generation("v1")
+    cache.store([1.0, 0.0], "s", {"answer": "a"}, "v1")
+    cache.sync_generation("v1")
+    assert len(cache) == 1
+    cache.sync_generation("v2")
+    assert len(cache) == 0
+    assert cache.lookup([1.0, 0.0], "s") is None
+
+
+def test_store_drops_answer_looked_up_in_previous_generation():
+    cache = AnswerCache()
+    cache.sync_generation("v1")
+    assert cache.lookup([1.0, 0.0], "s") is None
+    generation = cache.generation
+    # An ingestion finished while the answer was being generated
+    cache.sync_generation("v2")
+    cache.store([1.0, 0.0], "s", {"answer": "stale"}, generation)
+
+    assert len(cache) == 0
+    cache.store([1.0, 0.0], "s", {"answer": "fresh"}, cache.generation)
+    assert cache.lookup([1.0, 0.0], "s") == {"answer": "fresh"}
+
+
+def test_returned_answers_are_copies():
+    cache = AnswerCache()
+    cache.store([1.0, 0.0], "s", {"answer": "a"})
+    cache.lookup([1.0, 0.0], "s").pop("answer")
+    assert cache.lookup([1.0, 0.0], "s") == {"answer": "a"}
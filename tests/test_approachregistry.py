@@ -0,0 +1,41 @@
+import pytest
+
+from approaches.registry import ApproachRegistry, enabled_approaches, lazy_approach
+from approaches.retrievethenread import RetrieveThenReadApproach
+
+
+def test_approaches_are_built_on_first_use():
+    built = []
+
+    def factory(approach_id):
+        def build():
+            built.append(approach_id)
+            return object()
+
+        return build
+
+    registry = ApproachRegistry({"rtr": factory("rtr"), "rrr": factory("rrr")})
+    assert built == []
+    first = registry.get("rrr")
+    assert registry.get("rrr") is first
+    assert built == ["rrr"]
+    assert registry.get("missing") is None
+
+
+def test_allow_list_hides_other_approaches():
+    registry = ApproachRegistry({"rtr": object, "rrr": object}, enabled=enabled_approaches(" rrr, "))
+    assert registry.get("rtr") is None
+    assert registry.get("rrr") is not None
+    assert enabled_approaches("") is None
+
+    with pytest.raises(ValueError, match="Unknown approaches rdx"):
+        ApproachRegistry({"rtr": object}, enabled=["rdx"])
+
+
+def test_lazy_approach_imports_and_builds_the_class():
+    build = lazy_approach(
+        "approaches.retrievethenread", "RetrieveThenReadApproach", None, "azure", "", "gpt-35-turbo", "", "", "", ""
+    )
+    approach = build()
+    assert isinstance(approach, RetrieveThenReadApproach)
+    assert approach.openai_host == "azure"
@@ -0,0 +1,183 @@
+import io
+
+import openai
+import pytest
+import pytest_asyncio
+from aiohttp.test_utils import TestServer
+from azure.ai.formrecognizer.aio import DocumentAnalysisClient
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.search.documents.aio import SearchClient
+from azure.storage.blob.aio import BlobServiceClient
+from benchmarks.corpus import (
+    CorpusShape,
+    FakeFormRecognizer,
+    synthetic_layout,
+    write_pdf,
+)
+from benchmarks.fakes import FakeBlobContainer, FakeOpenAI, FakeSearchClient
+from benchmarks.harness import percentile, run_load
+from benchmarks.mockserver import (
+    STORAGE_ACCOUNT,
+    STORAGE_KEY,
+    MockServer,
+    argument_parser,
+)
+
+import utils
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([5.0], 99) == 5.0
+    assert percentile([], 50) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_fake_search_client_replays_results():
+    client = FakeSearchClient(documents=50, document_chars=300)
+    first = [doc async for doc in await client.search("eye exams", top=3, query_caption="extractive")]
+    second = [doc async for doc in await client.search("eye exams", top=3, query_caption="extractive")]
+    assert [doc["id"] for doc in first] == [doc["id"] for doc in second]
+    assert len(first) == 3
+    assert len(first[0]["content"]) == 300
+    assert first[0]["@search.captions"][0].text == first[0]["content"][:200]
+
+
+@pytest.mark.asyncio
+async def test_fake_openai_drives_zero_shot_agent():
+    fake = FakeOpenAI(answer_tokens=5)
+    prompt = "Action Input: the input\n\nQuestion: What is covered?\nThought:"
+    action = (await fake.completion_acreate(prompt=[prompt])).choices[0].text
+    assert "Action: CognitiveSearch\nAction Input: What is covered?" in action
+    final = (await fake.completion_acreate(prompt=[prompt + action + "\nObservation: sources\nThought:"])).choices[0]
+    assert "Final Answer:" in final.text
+
+
+@pytest.mark.asyncio
+async def test_fake_openai_streams_answer():
+    fake = FakeOpenAI(answer_tokens=3)
+    with fake.patch():
+        stream = await openai.ChatCompletion.acreate(messages=[{"role": "user", "content": "hi"}], stream=True)
+        chunks = [chunk async for chunk in stream]
+    assert chunks[0]["choices"] == []
+    assert "".join(chunk["choices"][0]["delta"]["content"] for chunk in chunks[1:]).strip() == fake.answer
+
+
+@pytest.mark.asyncio
+async def test_fake_blob_container_round_trip():
+    container = FakeBlobContainer()
+    await container.get_blob_client("a.pdf").upload_blob(b"data")
+    assert await (await container.download_blob("a.pdf")).readall() == b"data"
+    assert [blob.name async for blob in container.list_blobs()] == ["a.pdf"]
+    # Missing and existing blobs raise the errors of the real client, which the backend handles
+    with pytest.raises(ResourceNotFoundError):
+        await container.download_blob("b.pdf")
+    with pytest.raises(ResourceExistsError):
+        await container.upload_blob("a.pdf", b"data")
+
+
+@pytest.mark.asyncio
+async def test_run_load_reports_errors_and_percentiles():
+    async def call(i):
+        if i == 3:
+            raise ValueError("boom")
+
+    result = await run_load(call, requests=10, concurrency=2)
+    assert result["errors"] == 1
+    assert result["first_error"] == "ValueError: boom"
+    assert result["p99_ms"] >= result["p50_ms"]
+
+
+def test_synthetic_layout_spans_cover_pages_and_tables():
+    layout = synthetic_layout(CorpusShape(pages=3, paragraphs=2, paragraph_chars=100, tables=1, table_rows=3), seed=1)
+    assert [page.page_number for page in layout.pages] == [1, 2, 3]
+    assert sum(page.spans[0].length for page in layout.pages) == len(layout.content)
+    table = layout.tables[0]
+    assert len(table.cells) == 3 * table.column_count
+    assert layout.content[table.spans[0].offset :].startswith(table.cells[0].content)
+
+
+@pytest.mark.asyncio
+async def test_fake_form_recognizer_feeds_get_document_text(tmp_path):
+    layout = synthetic_layout(CorpusShape(pages=2, paragraphs=1, paragraph_chars=80, tables=1, table_rows=2))
+    path = str(tmp_path / "doc.pdf")
+    write_pdf(path, layout)
+
+    page_map = await utils.get_document_text(FakeFormRecognizer({path: layout}), path)
+
+    assert [page for page, _, _ in page_map] == [0, 1]
+    assert all("<table>" in text for _, _, text in page_map)
+    local_page_map = await utils.get_document_text(None, path, localpdfparser=True)
+    assert "Header 0" in local_page_map[0][2]
+
+
+@pytest_asyncio.fixture
+async def mock_services():
+    args = argument_parser().parse_args(
+        ["--documents", "20", "--answer-tokens", "5", "--formrecognizer-page-latency", "1", "--openai-rpm", "3"]
+    )
+    for name in ("search", "blob", "formrecognizer", "openai", "token"):
+        setattr(args, f"{name}_latency", 0)
+    server = TestServer(MockServer(args).application())
+    await server.start_server()
+    yield str(server.make_url("")).rstrip("/")
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_mock_services_blob_leases_and_batch_delete(mock_services):
+    async with BlobServiceClient(f"{mock_services}/{STORAGE_ACCOUNT}", credential=STORAGE_KEY) as service:
+        container = service.get_container_client("content")
+        await container.upload_blob("a-0.pdf", io.BytesIO(b"page"), overwrite=True)
+        lock = container.get_blob_client("ingest.lock")
+        await lock.upload_blob(b"")
+        lease = await lock.acquire_lease(lease_duration=15)
+        assert (await lock.get_blob_properties()).lease.state == "leased"
+        with pytest.raises(Exception):
+            await container.delete_blob("ingest.lock")
+        await container.delete_blob("ingest.lock", lease=lease)
+
+        parts = await container.delete_blobs("a-0.pdf", "missing.pdf", raise_on_any_failure=False)
+        assert [part.status_code async for part in parts] == [202, 404]
+        assert [name async for name in container.list_blob_names()] == []
+
+
+@pytest.mark.asyncio
+async def test_mock_services_search_and_form_recognizer(mock_services, tmp_path):
+    async with SearchClient(f"{mock_services}/search", "gptkbindex", AzureKeyCredential("mock")) as client:
+        await client.upload_documents([{"id": "new", "content": "eye exams", "sourcefile": "a.pdf"}])
+        results = await client.search("eye exams", filter="sourcefile eq 'a.pdf'", top=3, query_caption="extractive")
+        assert [doc["id"] async for doc in results] == ["new"]
+
+    path = str(tmp_path / "doc.pdf")
+    write_pdf(path, synthetic_layout(CorpusShape(pages=3, paragraphs=1, paragraph_chars=80, tables=0)))
+    async with DocumentAnalysisClient(f"{mock_services}/", AzureKeyCredential("mock")) as client:
+        with open(path, "rb") as f:
+            poller = await client.begin_analyze_document("prebuilt-layout", document=f, pages="2-3")
+        result = await poller.result()
+    assert [page.page_number for page in result.pages] == [2, 3]
+    assert sum(page.spans[0].length for page in result.pages) == len(result.content) > 0
+
+
+@pytest.mark.asyncio
+async def test_mock_services_openai_streams_and_throttles(mock_services, monkeypatch):
+    monkeypatch.setattr(openai, "api_base", mock_services)
+    monkeypatch.setattr(openai, "api_type", "azure")
+    monkeypatch.setattr(openai, "api_version", "2023-07-01-preview")
+    monkeypatch.setattr(openai, "api_key", "mock")
+    messages = [{"role": "user", "content": "hi"}]
+
+    embedding = await openai.Embedding.acreate(engine="embedding", input=["a", "b"])
+    assert len(embedding["data"]) == 2
+    stream = await openai.ChatCompletion.acreate(engine="chat", messages=messages, stream=True)
+    chunks = [chunk async for chunk in stream]
+    assert chunks[0]["choices"] == []
+    assert len(chunks) == 1 + len(FakeOpenAI(answer_tokens=5).answer.split(" "))
+    # Only 3 requests per minute are allowed
+    await openai.ChatCompletion.acreate(engine="chat", messages=messages)
+    with pytest.raises(openai.error.RateLimitError):
+        await openai.ChatCompletion.acreate(engine="chat", messages=messages)
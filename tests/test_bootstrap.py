@@ -0,0 +1,74 @@
+import io
+import json
+
+import pytest
+import pytest_asyncio
+from aiohttp.test_utils import TestServer
+from azure.storage.blob.aio import BlobServiceClient
+from benchmarks.mockserver import (
+    STORAGE_ACCOUNT,
+    STORAGE_KEY,
+    MockServer,
+    argument_parser,
+)
+
+from bootstrap import BOOTSTRAP_LOCK_BLOB, acquire_bootstrap_lease, bootstrap
+
+
+class MockSearchIndexClient:
+    def __init__(self, *index_names):
+        self.index_names = list(index_names)
+        self.created = []
+
+    async def list_index_names(self):
+        for name in self.index_names:
+            yield name
+
+    async def create_index(self, index):
+        self.created.append(index.name)
+        self.index_names.append(index.name)
+
+
+@pytest_asyncio.fixture
+async def containers():
+    args = argument_parser().parse_args(["--documents", "1"])
+    for name in ("search", "blob", "formrecognizer", "openai", "token"):
+        setattr(args, f"{name}_latency", 0)
+    server = TestServer(MockServer(args).application())
+    await server.start_server()
+    url = str(server.make_url("")).rstrip("/")
+    async with BlobServiceClient(f"{url}/{STORAGE_ACCOUNT}", credential=STORAGE_KEY) as service:
+        yield service.get_container_client("content"), service.get_container_client("documents")
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_bootstrap_creates_index_and_records_documents(containers):
+    blob_container, document_container = containers
+    await document_container.upload_blob("a.pdf", io.BytesIO(b"a"))
+    await document_container.upload_blob("b.pdf", io.BytesIO(b"b"))
+    await blob_container.upload_blob("ingest.json", json.dumps({"a.pdf": {"status": 0}}))
+    index_client = MockSearchIndexClient("other")
+
+    assert await bootstrap(index_client, "gptkbindex", blob_container, document_container)
+    assert index_client.created == ["gptkbindex"]
+    ingest_json = json.loads(await (await blob_container.download_blob("ingest.json")).readall())
+    assert ingest_json == {"a.pdf": {"status": 0}, "b.pdf": {"status": 2}}
+
+    # Running it again changes nothing, and the lease was released so it is not skipped
+    assert await bootstrap(index_client, "gptkbindex", blob_container, document_container)
+    assert index_client.created == ["gptkbindex"]
+    lock = await blob_container.get_blob_client(BOOTSTRAP_LOCK_BLOB).get_blob_properties()
+    assert lock.lease.state != "leased"
+
+
+@pytest.mark.asyncio
+async def test_bootstrap_skips_while_another_instance_holds_the_lease(containers):
+    blob_container, document_container = containers
+    lease = await acquire_bootstrap_lease(blob_container)
+    assert await acquire_bootstrap_lease(blob_container) is None
+
+    index_client = MockSearchIndexClient()
+    assert not await bootstrap(index_client, "gptkbindex", blob_container, document_container)
+    assert index_client.created == []
+    await lease.release()
@@ -1,6 +1,8 @@
 import json
 
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from core.modelhelper import num_tokens_from_messages
+from core.sourcepacker import Source
 
 
 def test_get_search_query():
@@ -21,3 +23,29 @@ def test_get_search_query_returns_default():
     query = chat_approach.get_search_query(json.loads(payload), default_query)
 
     assert query == default_query
+
+
+def test_pack_prompt_keeps_history_within_context_window():
+    chat_approach = ChatReadRetrieveReadApproach(None, "", "gpt-35-turbo", "gpt-35-turbo", "", "", "", "")
+    turn = "Does my plan cover annual eye exams and glasses for my dependents? " * 20
+    history = [{"user": turn, "bot": turn} for _ in range(10)] + [{"user": "What about contact lenses?"}]
+    sources = [Source(f"benefits-{i}.pdf", "Vision coverage includes one exam per year. " * 100, 1) for i in range(20)]
+
+    messages, results, source_budget = chat_approach.pack_prompt("You answer questions.", history, sources)
+
+    prompt_tokens = sum(num_tokens_from_messages(message, "gpt-35-turbo") for message in messages)
+    assert prompt_tokens <= chat_approach.chatgpt_token_limit - chat_approach.response_token_limit
+    # Part of the window was set aside for the history rather than filled with sources
+    assert len(messages) > 2
+    assert messages[-1]["content"].startswith("What about contact lenses?")
+    assert 0 < len(results) < len(sources)
+
+
+def test_get_messages_from_history_stops_before_overflowing_turn():
+    chat_approach = ChatReadRetrieveReadApproach(None, "", "gpt-35-turbo", "gpt-35-turbo", "", "", "", "")
+    history = [{"user": "first question " * 50, "bot": "first answer " * 50}, {"user": "short", "bot": "short"}]
+    messages = chat_approach.get_messages_from_history(
+        "system", "gpt-35-turbo", history + [{"user": "last"}], "last", max_tokens=100
+    )
+    assert [message["content"] for message in messages] == ["system", "short", "short", "last"]
+    assert sum(num_tokens_from_messages(message, "gpt-35-turbo") for message in messages) <= 100
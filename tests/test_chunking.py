@@ -0,0 +1,105 @@
+import re
+
+import pytest
+
+from core.chunking import TokenChunker
+
+
+class WordEncoding:
+    """Encodes every word, with its trailing whitespace, as one token"""
+
+    def encode(self, text):
+        return re.findall(r"\S+\s*|\s+", text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+class ByteEncoding:
+    """Encodes every UTF-8 byte as one token, like a byte-level BPE does for rare characters"""
+
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode(self, tokens):
+        return bytes(tokens).decode("utf-8", errors="replace")
+
+
+def sentence(n, words=5):
+    return " ".join([f"s{n}w{i}" for i in range(words - 1)] + [f"s{n}end."]) + " "
+
+
+def test_chunks_respect_budget_and_sentence_boundaries():
+    text = "".join(sentence(n) for n in range(10))
+    chunker = TokenChunker(WordEncoding(), max_tokens=12, overlap_tokens=5)
+    chunks = list(chunker.split([(0, 0, text)], "a.pdf"))
+
+    for chunk in chunks:
+        assert chunk.token_count == len(WordEncoding().encode(chunk.content)) <= 12
+        assert chunk.content.startswith("s") and chunk.content.rstrip().endswith("end.")
+    # Every chunk after the first repeats the last sentence of the previous one
+    assert chunks[1].content.startswith(sentence(1))
+    assert "".join(c.content for c in chunks).count("s9end.") == 1
+
+
+def test_paragraph_breaks_close_nearly_full_chunks():
+    text = sentence(0, 8) + "\n" + sentence(1, 3) + sentence(2, 3)
+    chunker = TokenChunker(WordEncoding(), max_tokens=10, overlap_tokens=0)
+    chunks = list(chunker.split([(0, 0, text)], "a.pdf"))
+    assert [c.content for c in chunks] == [sentence(0, 8) + "\n", sentence(1, 3) + sentence(2, 3)]
+
+
+def test_tables_are_kept_whole_or_split_by_rows():
+    small = "<table><tr><td>a b</td></tr></table>"
+    rows = "".join(f"<tr><td>r{i} x y z</td></tr>" for i in range(4))
+    large = f"<table>{rows}</table>"
+    text = sentence(0, 3) + small + sentence(1, 3) + large
+    chunker = TokenChunker(WordEncoding(), max_tokens=6, overlap_tokens=3)
+    chunks = list(chunker.split([(0, 0, text)], "a.pdf"))
+
+    contents = [c.content for c in chunks]
+    assert any(small in content for content in contents)
+    row_chunks = [content for content in contents if "<tr><td>r" in content]
+    assert all(content.startswith("<table><tr>") and content.endswith("</table>") for content in row_chunks)
+    assert sum(content.count("<tr>") for content in row_chunks) == 4
+
+
+def test_page_numbers_follow_chunk_start():
+    page_one = sentence(0, 6)
+    page_two = sentence(1, 6)
+    chunker = TokenChunker(WordEncoding(), max_tokens=6, overlap_tokens=0)
+    chunks = list(chunker.split([(0, 0, page_one), (1, len(page_one), page_two)], "a.pdf"))
+    assert [c.pagenum for c in chunks] == [0, 1]
+
+
+def test_oversized_sentences_are_cut_at_token_boundaries():
+    chunker = TokenChunker(WordEncoding(), max_tokens=4, overlap_tokens=1)
+    chunks = list(chunker.split([(0, 0, sentence(0, 10))], "a.pdf"))
+    assert [c.token_count for c in chunks] == [4, 4, 2]
+    assert "".join(c.content for c in chunks) == sentence(0, 10)
+
+
+def test_oversized_sentences_are_not_cut_inside_characters():
+    text = "ab" + "é" * 5 + "€"
+    chunker = TokenChunker(ByteEncoding(), max_tokens=3, overlap_tokens=1)
+    pieces = list(chunker.pieces(text))
+    assert [p.text for p in pieces] == ["ab", "é", "é", "é", "é", "é", "€"]
+    assert [p.tokens for p in pieces] == [2, 2, 2, 2, 2, 2, 3]
+    assert [p.start for p in pieces] == [0, 2, 3, 4, 5, 6, 7]
+
+    # A character longer than a chunk is kept whole rather than split
+    chunker = TokenChunker(ByteEncoding(), max_tokens=2, overlap_tokens=1)
+    assert [p.text for p in chunker.pieces("a€")] == ["a", "€"]
+
+
+def test_token_count_is_that_of_the_chunk_text():
+    # The table and the sentence after it are separate pieces but share a token once joined
+    text = "<table><tr>a</tr></table>next words."
+    chunker = TokenChunker(WordEncoding(), max_tokens=10, overlap_tokens=0)
+    chunks = list(chunker.split([(0, 0, text)], "a.pdf"))
+    assert [c.token_count for c in chunks] == [2]
+
+
+def test_overlap_must_be_smaller_than_budget():
+    with pytest.raises(ValueError):
+        TokenChunker(WordEncoding(), max_tokens=10, overlap_tokens=10)
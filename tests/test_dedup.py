@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from core.dedup import MinHasher, NearDuplicateIndex, SectionDeduplicator
+
+FOOTER = (
+    "Contoso Electronics confidential. This document is provided for informational purposes only and does not "
+    "constitute a contract. Benefits are subject to change, see the plan documents for the binding terms."
+)
+PAGE_ONE = "Northwind Health Plus covers emergency services, mental health care and prescription drugs for employees."
+PAGE_TWO = "The employee handbook describes the performance review process, which happens twice a year with managers."
+
+
+def section(id, content):
+    return {"id": id, "content": content, "sourcefile": id.split("-")[0]}
+
+
+def test_minhash_similarity_tracks_jaccard():
+    hasher = MinHasher(num_perm=128)
+    footer = hasher.signature(FOOTER)
+    assert (footer == hasher.signature(FOOTER.upper() + " Page 3")).mean() > 0.8
+    assert (footer == hasher.signature("<td>" + FOOTER + "</td>")).mean() == 1
+    assert (footer == hasher.signature(PAGE_ONE)).mean() < 0.1
+
+
+def test_keep_first_drops_near_duplicates_across_files():
+    dedup = SectionDeduplicator("keep_first", NearDuplicateIndex(threshold=0.8))
+    first = dedup.deduplicate("a.pdf", [section("a-0", PAGE_ONE), section("a-1", FOOTER)])
+    second = dedup.deduplicate("b.pdf", [section("b-0", PAGE_TWO), section("b-1", FOOTER + " Page 2")])
+
+    assert [s["id"] for s in first] == ["a-0", "a-1"]
+    assert [s["id"] for s in second] == ["b-0"]
+    assert dedup.index.duplicate_of == ["", "", "", "a-1"]
+
+
+def test_drop_removes_boilerplate_repeated_within_document():
+    dedup = SectionDeduplicator("drop", NearDuplicateIndex(threshold=0.8))
+    kept = dedup.deduplicate(
+        "a.pdf",
+        [
+            section("a-0", PAGE_ONE + " " + FOOTER),
+            section("a-1", FOOTER),
+            section("a-2", PAGE_TWO),
+            section("a-3", FOOTER),
+        ],
+    )
+    assert [s["id"] for s in kept] == ["a-0", "a-2"]
+
+
+def test_reference_keeps_duplicates_with_back_reference():
+    dedup = SectionDeduplicator("reference", NearDuplicateIndex(threshold=0.8))
+    kept = dedup.deduplicate("a.pdf", [section("a-0", FOOTER), section("a-1", PAGE_ONE), section("a-2", FOOTER)])
+    assert [s.get("duplicate_of") for s in kept] == [None, None, "a-0"]
+
+
+def test_remove_file_reports_files_with_dropped_copies():
+    dedup = SectionDeduplicator("keep_first", NearDuplicateIndex(threshold=0.8))
+    dedup.deduplicate("a.pdf", [section("a-0", FOOTER)])
+    dedup.deduplicate("b.pdf", [section("b-0", FOOTER), section("b-1", PAGE_TWO)])
+
+    assert dedup.index.remove_file("a.pdf") == {"b.pdf"}
+    assert dedup.index.ids == ["b-0", "b-1"]
+    assert dedup.index.remove_file("a.pdf") == set()
+
+    # b.pdf is re-ingested, its copy of the footer is now the canonical one
+    dedup.index.remove_file("b.pdf")
+    assert [s["id"] for s in dedup.deduplicate("b.pdf", [section("b-0", FOOTER)])] == ["b-0"]
+
+
+def test_index_round_trips_through_bytes():
+    dedup = SectionDeduplicator("keep_first", NearDuplicateIndex(threshold=0.8))
+    sections = [section(f"a-{i}", f"{PAGE_ONE} {i}" * (i + 1)) for i in range(70)] + [section("a-x", FOOTER)]
+    dedup.deduplicate("a.pdf", sections)
+
+    loaded = NearDuplicateIndex(threshold=0.8)
+    loaded.load_bytes(dedup.index.to_bytes())
+    assert loaded.ids == dedup.index.ids
+    assert np.array_equal(loaded.signatures, dedup.index.signatures)
+    assert loaded.find(MinHasher().signature(FOOTER)) == "a-x"
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        SectionDeduplicator("merge", NearDuplicateIndex())
+
+
+def test_drop_keeps_boilerplate_of_later_file_indexable():
+    dedup = SectionDeduplicator("drop", NearDuplicateIndex(threshold=0.8))
+    first = dedup.deduplicate("a.pdf", [section("a-0", PAGE_ONE), section("a-1", FOOTER), section("a-2", FOOTER)])
+    second = dedup.deduplicate("b.pdf", [section("b-0", PAGE_TWO), section("b-1", FOOTER)])
+
+    # The footer was dropped from a.pdf, so b.pdf's copy is the only one in the search index
+    assert [s["id"] for s in first] == ["a-0"]
+    assert [s["id"] for s in second] == ["b-0", "b-1"]
+    assert dedup.index.ids == ["a-0", "b-0", "b-1"]
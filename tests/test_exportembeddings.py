@@ -0,0 +1,59 @@
+import json
+import re
+
+import numpy as np
+import pytest
+from scripts import exportembeddings
+from scripts.exportembeddings import EmbeddingSnapshotWriter, export_embeddings
+
+from core.vectorindex import LocalVectorIndex
+
+
+class MockSearchClient:
+    def __init__(self, documents):
+        self.documents = documents
+        self.calls = []
+
+    def search(self, search_text, filter=None, select=None, order_by=None, top=None):
+        self.calls.append((filter, select, order_by, top))
+        after = re.search(r"id gt '([^']*)'", filter or "")
+        documents = sorted(self.documents, key=lambda d: d["id"])
+        return iter([d for d in documents if after is None or d["id"] > after.group(1)][:top])
+
+
+def test_export_embeddings_pages_through_index(monkeypatch, tmp_path):
+    monkeypatch.setattr(exportembeddings, "PAGE_SIZE", 2)
+    documents = [
+        {"id": f"s-{i}", "content": f"section {i}", "category": None, "embedding": [float(i), 1.0, 0.0]}
+        for i in range(5)
+    ]
+    documents[3]["embedding"] = None
+    search_client = MockSearchClient(documents[::-1])
+
+    with EmbeddingSnapshotWriter(str(tmp_path)) as writer:
+        rows = export_embeddings(search_client, writer, ["content"], filter="category eq 'x'")
+
+    assert rows == 4
+    assert [call[0] for call in search_client.calls] == [
+        "(category eq 'x')",
+        "(category eq 'x') and id gt 's-1'",
+        "(category eq 'x') and id gt 's-3'",
+    ]
+    assert search_client.calls[0][1:] == (["content", "id", "embedding"], ["id"], 2)
+    vectors = np.load(tmp_path / "embeddings.npy", mmap_mode="r")
+    assert vectors.dtype == np.float32
+    assert vectors.tolist() == [[0, 1, 0], [1, 1, 0], [2, 1, 0], [4, 1, 0]]
+    with open(tmp_path / "sections.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line)["content"] for line in f] == ["section 0", "section 1", "section 2", "section 4"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["embeddings.npy", "sections.jsonl"]
+
+    index = LocalVectorIndex.load(str(tmp_path))
+    assert index.sections[index.search([4.0, 1.0, 0.0], top=1)[0][0]]["content"] == "section 4"
+
+
+def test_writer_rejects_mismatched_dimensions(tmp_path):
+    with pytest.raises(ValueError):
+        with EmbeddingSnapshotWriter(str(tmp_path)) as writer:
+            writer.write({"id": "a"}, [1.0, 2.0])
+            writer.write({"id": "b"}, [1.0])
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+import core.filecatalog
+from core.filecatalog import FileCatalog
+
+
+@pytest.fixture
+def mock_storage(monkeypatch):
+    calls = []
+
+    async def mock_get_all_files(container):
+        calls.append("list")
+        return ["b.pdf", "a.pdf"]
+
+    async def mock_get_ingest_json(container):
+        return {"a.pdf": {"status": 2}}
+
+    async def mock_is_ingest_lock(container):
+        return False
+
+    monkeypatch.setattr(core.filecatalog, "get_all_files", mock_get_all_files)
+    monkeypatch.setattr(core.filecatalog, "get_ingest_json", mock_get_ingest_json)
+    monkeypatch.setattr(core.filecatalog, "is_ingest_lock", mock_is_ingest_lock)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_ensure_fresh_reconciles_only_when_stale(mock_storage):
+    catalog = FileCatalog(refresh_interval=60)
+    await catalog.ensure_fresh(None, None)
+    await catalog.ensure_fresh(None, None)
+    assert mock_storage == ["list"]
+    assert catalog.snapshot() == {
+        "files": ["a.pdf", "b.pdf"],
+        "ingested": {"a.pdf": {"status": 2}},
+        "ingest_lock": False,
+    }
+
+    catalog.refresh_interval = 0
+    await catalog.ensure_fresh(None, None)
+    assert mock_storage == ["list", "list"]
+
+
+def test_etag_follows_content():
+    catalog = FileCatalog()
+    catalog.reset(["a.pdf"], {}, False)
+    etag = catalog.etag
+
+    other = FileCatalog()
+    other.reset(["a.pdf"], {}, False)
+    assert other.etag == etag
+
+    catalog.add_files(["b.pdf"])
+    assert catalog.etag != etag
+    catalog.remove_file("b.pdf")
+    assert catalog.etag == etag
+    catalog.set_ingest_lock(True)
+    assert catalog.etag != etag
+
+
+@pytest.mark.asyncio
+async def test_index_version_follows_persisted_generation(monkeypatch):
+    calls = []
+    stored = {"id": "g1", "updated": 0}
+
+    async def mock_get_index_generation(container):
+        calls.append("generation")
+        return stored
+
+    monkeypatch.setattr(core.filecatalog, "get_index_generation", mock_get_index_generation)
+    catalog = FileCatalog(generation_interval=60)
+    await catalog.ensure_index_generation(None)
+    version = catalog.index_version
+
+    # Another worker re-ingested a file, the generation is only read again once the interval has passed
+    stored = {"id": "g2", "updated": 0}
+    await catalog.ensure_index_generation(None)
+    assert catalog.index_version == version
+    catalog.generation_checked_at -= 60
+    await catalog.ensure_index_generation(None)
+    assert catalog.index_version != version
+    assert calls == ["generation", "generation"]
+
+
+def test_index_version_differs_while_sections_settle():
+    catalog = FileCatalog(settle_seconds=5)
+    catalog.set_index_generation({"id": "g1", "updated": time.time()})
+    settling = catalog.index_version
+    catalog.set_index_generation({"id": "g1", "updated": time.time() - 5})
+    assert catalog.index_version == "g1"
+    assert settling != "g1"
+
+
+@pytest.mark.asyncio
+async def test_ensure_loaded_only_loads_once(mock_storage):
+    catalog = FileCatalog(refresh_interval=0)
+    await catalog.ensure_loaded(None, None)
+    await catalog.ensure_loaded(None, None)
+    assert mock_storage == ["list"]
+    assert catalog.snapshot()["files"] == ["a.pdf", "b.pdf"]
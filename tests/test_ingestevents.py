@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from core.ingestevents import IngestEventBus, publish_event
+
+
+@pytest.mark.asyncio
+async def test_subscribers_receive_published_events():
+    events = IngestEventBus()
+    subscription = events.subscribe(heartbeat_interval=0.01)
+    assert await subscription.__anext__() is None
+
+    publish_event(events, "pages", "a.pdf", pages=3)
+    event = await subscription.__anext__()
+    assert event["type"] == "pages"
+    assert event["file"] == "a.pdf"
+    assert event["pages"] == 3
+
+    await subscription.aclose()
+    assert events.subscribers == set()
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_drops_oldest_events():
+    events = IngestEventBus(max_queue=2)
+    subscription = events.subscribe()
+    pending = asyncio.ensure_future(subscription.__anext__())
+    await asyncio.sleep(0)
+    for i in range(4):
+        publish_event(events, "indexed", "a.pdf", sections=i)
+    assert (await pending)["sections"] == 2
+    assert (await subscription.__anext__())["sections"] == 3
+    await subscription.aclose()
+
+
+def test_publish_event_without_bus():
+    publish_event(None, "stage", "a.pdf", stage="uploading")
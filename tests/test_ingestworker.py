@@ -0,0 +1,224 @@
+import asyncio
+import io
+import json
+
+import pytest
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+
+import ingestworker
+import utils
+from ingestworker import IngestJobRunner, enqueue_ingest_job, get_ingest_job
+
+
+class MockLease:
+    def __init__(self, blob, lost=False):
+        self.blob = blob
+        self.lost = lost
+        self.renewals = 0
+
+    async def renew(self):
+        if self.lost:
+            raise HttpResponseError("The lease ID specified did not match the lease ID for the blob.")
+        self.renewals += 1
+
+
+class MockDownloader:
+    def __init__(self, data):
+        self.data = data
+
+    async def readinto(self, stream):
+        stream.write(self.data)
+
+
+class MockBlobClient:
+    def __init__(self, container, name):
+        self.container = container
+        self.name = name
+
+    async def exists(self):
+        return self.name in self.container.blobs
+
+    async def download_blob(self):
+        self.container.downloads.append(self.name)
+        if self.name not in self.container.blobs:
+            raise ResourceNotFoundError()
+        return MockDownloader(self.container.blobs[self.name])
+
+    async def upload_blob(self, data):
+        await self.container.upload_blob(self.name, data)
+
+    async def acquire_lease(self, lease_duration):
+        if self.name in self.container.leases:
+            error = HttpResponseError()
+            error.status_code = 409
+            raise error
+        self.container.leases[self.name] = MockLease(self, self.container.lose_leases)
+        return self.container.leases[self.name]
+
+
+class MockContainerClient:
+    def __init__(self):
+        self.blobs = {}
+        self.leases = {}
+        self.downloads = []
+        self.lose_leases = False
+
+    def get_blob_client(self, name):
+        return MockBlobClient(self, name)
+
+    async def upload_blob(self, name, data, overwrite=False):
+        self.blobs[name] = data.read() if isinstance(data, io.IOBase) else data
+
+    async def delete_blob(self, name, lease=None):
+        self.blobs.pop(name)
+        self.leases.pop(name, None)
+
+    async def list_blob_names(self, name_starts_with=""):
+        for name in list(self.blobs):
+            if name.startswith(name_starts_with):
+                yield name
+
+
+@pytest.fixture
+def mock_upload_documents(monkeypatch):
+    calls = []
+
+    async def mock_upload_documents(*args, **kwargs):
+        calls.append(args)
+        return {"a.pdf": {"attempts": 1, "error": None}}
+
+    monkeypatch.setattr(ingestworker, "upload_documents", mock_upload_documents)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_run_pending_processes_queued_jobs(mock_upload_documents):
+    container = MockContainerClient()
+    container.blobs["ingest.json"] = json.dumps({"a.pdf": {"operation": 0, "status": 1}}).encode("utf-8")
+    job = await enqueue_ingest_job(container)
+
+    await IngestJobRunner(container, ()).run_pending()
+
+    assert len(mock_upload_documents) == 1
+    job = await get_ingest_job(container, job["id"])
+    assert job["state"] == "succeeded"
+    assert job["files"] == {"a.pdf": {"attempts": 1, "error": None}}
+    # The interrupted file was reset to pending before ingestion and the lock was released afterwards
+    assert json.loads(container.blobs["ingest.json"]) == {"a.pdf": {"operation": 0, "status": 0}}
+    assert "ingest.lock" not in container.blobs
+
+
+@pytest.mark.asyncio
+async def test_run_pending_skips_when_lock_is_held(mock_upload_documents):
+    container = MockContainerClient()
+    job = await enqueue_ingest_job(container)
+    container.blobs["ingest.lock"] = b""
+    container.leases["ingest.lock"] = MockLease(None)
+
+    await IngestJobRunner(container, ()).run_pending()
+
+    assert mock_upload_documents == []
+    assert (await get_ingest_job(container, job["id"]))["state"] == "queued"
+
+
+@pytest.mark.asyncio
+async def test_run_pending_without_jobs(mock_upload_documents):
+    container = MockContainerClient()
+    await IngestJobRunner(container, ()).run_pending()
+    assert mock_upload_documents == []
+    assert container.blobs == {}
+
+
+@pytest.mark.asyncio
+async def test_idle_poll_does_not_download_finished_jobs(mock_upload_documents):
+    container = MockContainerClient()
+    jobs = [await enqueue_ingest_job(container) for _ in range(3)]
+    await IngestJobRunner(container, ()).run_pending()
+    assert len(mock_upload_documents) == 1
+    assert all(not name.startswith(ingestworker.PENDING_BLOB_PREFIX) for name in container.blobs)
+    container.downloads.clear()
+
+    await IngestJobRunner(container, ()).run_pending()
+
+    assert len(mock_upload_documents) == 1
+    assert container.downloads == []
+    assert "ingest.lock" not in container.blobs
+    for job in jobs:
+        assert (await get_ingest_job(container, job["id"]))["state"] == "succeeded"
+
+
+@pytest.fixture
+def slow_upload_documents(monkeypatch):
+    calls = []
+
+    async def slow_upload_documents(*args, **kwargs):
+        calls.append(args)
+        await asyncio.sleep(0.2)
+        return {"a.pdf": {"attempts": 1, "error": None}}
+
+    monkeypatch.setattr(ingestworker, "upload_documents", slow_upload_documents)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_run_pending_renews_lease_while_ingesting(monkeypatch, slow_upload_documents):
+    container = MockContainerClient()
+    job = await enqueue_ingest_job(container)
+    leases = []
+    create_ingest_lock = ingestworker.create_ingest_lock
+
+    async def tracked_create_ingest_lock(*args):
+        leases.append(await create_ingest_lock(*args))
+        return leases[-1]
+
+    monkeypatch.setattr(ingestworker, "create_ingest_lock", tracked_create_ingest_lock)
+    await IngestJobRunner(container, (), lease_duration=0.09).run_pending()
+
+    assert leases[0].renewals >= 2
+    assert (await get_ingest_job(container, job["id"]))["state"] == "succeeded"
+
+
+@pytest.mark.asyncio
+async def test_lost_lease_leaves_job_for_another_worker(slow_upload_documents):
+    container = MockContainerClient()
+    container.lose_leases = True
+    job = await enqueue_ingest_job(container)
+
+    await IngestJobRunner(container, (), lease_duration=0.09).run_pending()
+
+    # Ingestion was stopped and the job is still pending, so the next holder of the lock resumes it
+    assert (await get_ingest_job(container, job["id"]))["state"] == "running"
+    assert ingestworker.pending_blob_name(job["id"]) in container.blobs
+    assert "ingest.lock" not in container.blobs
+
+    container.lose_leases = False
+    await IngestJobRunner(container, (), lease_duration=0.09).run_pending()
+
+    assert len(slow_upload_documents) == 2
+    assert (await get_ingest_job(container, job["id"]))["state"] == "succeeded"
+    assert ingestworker.pending_blob_name(job["id"]) not in container.blobs
+
+
+@pytest.mark.asyncio
+async def test_read_files_retries_each_file(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    container = MockContainerClient()
+    ingest_json = {"a.pdf": {"operation": 0, "status": 0}, "b.pdf": {"operation": 0, "status": 0}}
+    container.blobs["ingest.json"] = json.dumps(ingest_json).encode("utf-8")
+    container.blobs["a.pdf"] = container.blobs["b.pdf"] = b""
+    attempts = []
+
+    async def flaky_ingest_file(only_filename, *args):
+        attempts.append(only_filename)
+        if only_filename == "b.pdf" or attempts.count(only_filename) < 2:
+            raise RuntimeError(f"{only_filename} failed")
+
+    monkeypatch.setattr(utils, "ingest_file", flaky_ingest_file)
+    results = await utils.read_files(
+        None, "index", container, container, None, None, "azure", "", "", max_attempts=3, retry_delay=0
+    )
+
+    assert results == {"a.pdf": {"attempts": 2, "error": None}, "b.pdf": {"attempts": 3, "error": "b.pdf failed"}}
+    assert attempts == ["a.pdf", "a.pdf", "b.pdf", "b.pdf", "b.pdf"]
+    # The file that kept failing is left pending with its error
+    assert json.loads(container.blobs["ingest.json"])["b.pdf"] == {"operation": 0, "status": 0, "error": "b.pdf failed"}
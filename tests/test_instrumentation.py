@@ -0,0 +1,82 @@
+import pytest
+
+from core import instrumentation
+from core.instrumentation import current_breakdown, mark, stage, start_breakdown
+
+
+def test_stage_records_breakdown_and_histogram(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(
+        instrumentation.STAGE_DURATION, "record", lambda value, attributes: recorded.append((value, attributes))
+    )
+    breakdown = start_breakdown("rtr")
+
+    with stage("search", top=3, retrieval_mode="hybrid", filter=None) as search_stage:
+        search_stage.set(results=2)
+    mark("first_token")
+
+    result = breakdown.to_dict()
+    assert result["approach"] == "rtr"
+    assert [s["stage"] for s in result["stages"]] == ["search"]
+    assert result["stages"][0]["top"] == 3
+    assert result["stages"][0]["results"] == 2
+    assert "filter" not in result["stages"][0]
+    assert result["first_token"] <= result["total_ms"]
+    # Counts are left out of the metric attributes
+    assert recorded[0][1] == {"retrieval_mode": "hybrid", "stage": "search", "approach": "rtr"}
+
+
+def test_stage_records_duration_when_stage_fails():
+    breakdown = start_breakdown("chat")
+    with pytest.raises(RuntimeError):
+        with stage("completion"):
+            raise RuntimeError("boom")
+    assert current_breakdown() is breakdown
+    assert breakdown.stages[0]["stage"] == "completion"
+
+
+def stream_event(content):
+    return {"choices": [{"delta": {"content": content}}]}
+
+
+@pytest.mark.asyncio
+async def test_instrument_stream_records_time_to_first_token(monkeypatch):
+    first_tokens = []
+    disconnects = []
+    monkeypatch.setattr(
+        instrumentation.STREAM_TIME_TO_FIRST_TOKEN, "record", lambda value, attributes: first_tokens.append(value)
+    )
+    monkeypatch.setattr(instrumentation.STREAM_DISCONNECTS, "add", lambda value, attributes: disconnects.append(value))
+
+    async def events():
+        yield {"data_points": [], "thoughts": ""}
+        yield {"choices": []}
+        yield stream_event("Hello")
+        yield stream_event(" world")
+
+    received = [event async for event in instrumentation.instrument_stream(events(), "rrr")]
+
+    assert len(received) == 4
+    assert len(first_tokens) == 1
+    assert disconnects == []
+
+
+@pytest.mark.asyncio
+async def test_instrument_stream_closes_upstream_when_client_disconnects(monkeypatch):
+    disconnects = []
+    monkeypatch.setattr(instrumentation.STREAM_DISCONNECTS, "add", lambda value, attributes: disconnects.append(value))
+    closed = []
+
+    async def events():
+        try:
+            for i in range(100):
+                yield stream_event(str(i))
+        finally:
+            closed.append(True)
+
+    stream = instrumentation.instrument_stream(events(), "rrr")
+    assert await stream.__anext__() == stream_event("0")
+    await stream.aclose()
+
+    assert closed == [True]
+    assert disconnects == [1]
@@ -0,0 +1,24 @@
+from lookuptool import load_lookup_table
+from preload import approach_modules
+
+
+def test_approach_modules_follow_allow_lists(monkeypatch):
+    monkeypatch.delenv("ASK_APPROACHES", raising=False)
+    monkeypatch.setenv("CHAT_APPROACHES", "rrr")
+    assert approach_modules() == {
+        "approaches.retrievethenread",
+        "approaches.readretrieveread",
+        "approaches.readdecomposeask",
+        "approaches.chatreadretrieveread",
+    }
+    monkeypatch.setenv("ASK_APPROACHES", "rtr")
+    assert approach_modules() == {"approaches.retrievethenread", "approaches.chatreadretrieveread"}
+
+
+def test_lookup_table_is_read_once(tmp_path):
+    path = tmp_path / "employees.csv"
+    path.write_text("name,title\nEmployee1,Engineer\n")
+    table = load_lookup_table(str(path), "name")
+    path.write_text("name,title\nEmployee2,Manager\n")
+    assert load_lookup_table(str(path), "name") is table
+    assert table == {"Employee1": "name:Employee1\ntitle:Engineer"}
@@ -0,0 +1,94 @@
+import pytest
+
+from core.searchcache import CachedSearchClient
+
+
+class MockAsyncPageIterator:
+    def __init__(self, data):
+        self.data = data
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.data:
+            raise StopAsyncIteration
+        return self.data.pop(0)
+
+
+class MockSearchClient:
+    def __init__(self):
+        self.calls = []
+
+    async def search(self, search_text, **kwargs):
+        self.calls.append((search_text, kwargs))
+        return MockAsyncPageIterator([{"id": str(len(self.calls)), "content": search_text}])
+
+    async def upload_documents(self, documents):
+        return documents
+
+
+@pytest.fixture
+def generation():
+    state = {"value": "1"}
+
+    async def get_generation():
+        return state["value"]
+
+    return state, get_generation
+
+
+@pytest.mark.asyncio
+async def test_identical_searches_are_served_from_cache(generation):
+    search_client = MockSearchClient()
+    cached = CachedSearchClient(search_client, generation[1])
+
+    first = [doc async for doc in await cached.search("q", filter=None, top=3, vector=[0.1, 0.2])]
+    second = [doc async for doc in await cached.search("q", top=3, vector=[0.1, 0.2], vector_fields="embedding")]
+    third = [doc async for doc in await cached.search("q", top=3, vector=[0.1, 0.2])]
+
+    assert first == third == [{"id": "1", "content": "q"}]
+    assert second == [{"id": "2", "content": "q"}]
+    assert len(search_client.calls) == 2
+    assert (cached.hits, cached.misses) == (1, 2)
+
+
+@pytest.mark.asyncio
+async def test_vector_fingerprint_distinguishes_vectors(generation):
+    search_client = MockSearchClient()
+    cached = CachedSearchClient(search_client, generation[1])
+    await cached.search("q", vector=[0.1, 0.2])
+    await cached.search("q", vector=[0.1, 0.3])
+    assert len(search_client.calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_generation_change_invalidates_entries(generation):
+    state, get_generation = generation
+    search_client = MockSearchClient()
+    cached = CachedSearchClient(search_client, get_generation)
+    await cached.search("q", top=3)
+    state["value"] = "2"
+    results = [doc async for doc in await cached.search("q", top=3)]
+    assert results == [{"id": "2", "content": "q"}]
+
+
+@pytest.mark.asyncio
+async def test_ttl_and_eviction(generation):
+    search_client = MockSearchClient()
+    cached = CachedSearchClient(search_client, generation[1], max_entries=1, ttl=0)
+    await cached.search("a")
+    await cached.search("a")
+    assert len(search_client.calls) == 2
+
+    cached.ttl = None
+    await cached.search("b")
+    await cached.search("a")
+    assert len(cached.entries) == 1
+    assert len(search_client.calls) == 4
+
+
+@pytest.mark.asyncio
+async def test_other_calls_pass_through(generation):
+    cached = CachedSearchClient(MockSearchClient(), generation[1])
+    assert await cached.upload_documents(["doc"]) == ["doc"]
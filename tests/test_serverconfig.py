@@ -0,0 +1,47 @@
+import os
+
+from serverconfig import cgroup_cpu_limit, cgroup_memory_limit, server_config
+
+
+def write_cgroup_v2(root, cpu_max, memory_max):
+    (root / "cpu.max").write_text(cpu_max + "\n")
+    (root / "memory.max").write_text(memory_max + "\n")
+
+
+def test_reads_cgroup_v2_and_v1_limits(tmp_path):
+    write_cgroup_v2(tmp_path, "150000 100000", "1073741824")
+    assert cgroup_cpu_limit(str(tmp_path)) == 1.5
+    assert cgroup_memory_limit(str(tmp_path)) == 1073741824
+
+    write_cgroup_v2(tmp_path, "max 100000", "max")
+    assert cgroup_cpu_limit(str(tmp_path)) is None
+    assert cgroup_memory_limit(str(tmp_path)) is None
+
+    v1 = tmp_path / "v1"
+    (v1 / "cpu").mkdir(parents=True)
+    (v1 / "memory").mkdir()
+    (v1 / "cpu" / "cpu.cfs_quota_us").write_text("200000")
+    (v1 / "cpu" / "cpu.cfs_period_us").write_text("100000")
+    (v1 / "memory" / "memory.limit_in_bytes").write_text(str(2**63 - 4096))
+    assert cgroup_cpu_limit(str(v1)) == 2
+    assert cgroup_memory_limit(str(v1)) is None
+
+
+def test_workers_follow_cpu_and_memory_limits(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(16)))
+    write_cgroup_v2(tmp_path, "150000 100000", str(4 * 1024**3))
+    config = server_config({}, str(tmp_path))
+    assert config.workers == 2
+    assert config.max_queued == config.max_inflight * 2
+
+    # 1 GiB only leaves room for two 300 MB workers
+    write_cgroup_v2(tmp_path, "800000 100000", str(1024**3))
+    assert server_config({}, str(tmp_path)).workers == 2
+    assert server_config({"WEB_CONCURRENCY": "5"}, str(tmp_path)).workers == 5
+
+
+def test_total_inflight_is_spread_across_workers(tmp_path):
+    write_cgroup_v2(tmp_path, "max 100000", "max")
+    config = server_config({"WEB_CONCURRENCY": "3", "TOTAL_INFLIGHT_REQUESTS": "40"}, str(tmp_path))
+    assert config.max_inflight == 14
+    assert config.max_queued == 28
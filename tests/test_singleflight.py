@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from core.singleflight import SingleFlight, request_key
+
+
+def test_request_key_normalizes_questions():
+    assert request_key("rtr", "What is  covered?", {"top": 3}) == request_key("rtr", " what is covered? ", {"top": 3})
+    assert request_key("rtr", "What is covered?", {}) != request_key("rrr", "What is covered?", {})
+    assert request_key("rrr", [{"user": "Hi  there"}], None) == request_key("rrr", [{"user": "hi there"}], {})
+    assert request_key("rrr", [{"user": "hi"}], {"top": 3}) != request_key("rrr", [{"user": "hi"}], {"top": 5})
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_run():
+    single_flight = SingleFlight()
+    runs = []
+    release = asyncio.Event()
+
+    async def compute():
+        runs.append(1)
+        await release.wait()
+        return {"answer": "42"}
+
+    waiters = [asyncio.create_task(single_flight.run("key", compute)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    assert [await waiter for waiter in waiters] == [{"answer": "42"}] * 5
+    assert len(runs) == 1
+    assert single_flight.coalesced == 4
+
+    # Nothing is kept once the run finished
+    await single_flight.run("key", compute)
+    assert len(runs) == 2
+
+
+@pytest.mark.asyncio
+async def test_work_is_only_cancelled_when_every_caller_left():
+    single_flight = SingleFlight()
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def compute():
+        started.set()
+        await release.wait()
+        return "done"
+
+    first = asyncio.create_task(single_flight.run("key", compute))
+    second = asyncio.create_task(single_flight.run("key", compute))
+    await started.wait()
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    assert await second == "done"
+
+    release.clear()
+    only = asyncio.create_task(single_flight.run("key", compute))
+    await asyncio.sleep(0)
+    task = single_flight.calls["key"].task
+    only.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert "key" not in single_flight.calls
+
+
+@pytest.mark.asyncio
+async def test_streams_fan_out_to_late_subscribers():
+    single_flight = SingleFlight()
+    runs = []
+    step = asyncio.Event()
+
+    async def events():
+        runs.append(1)
+        yield {"n": 1}
+        await step.wait()
+        yield {"n": 2}
+
+    async def read(stream):
+        return [event["n"] async for event in stream]
+
+    first = asyncio.create_task(read(single_flight.stream("key", events)))
+    await asyncio.sleep(0.01)
+    late = asyncio.create_task(read(single_flight.stream("key", events)))
+    await asyncio.sleep(0.01)
+    step.set()
+    assert await first == [1, 2]
+    assert await late == [1, 2]
+    assert len(runs) == 1
+    assert single_flight.streams == {}
+
+
+@pytest.mark.asyncio
+async def test_stream_stops_when_the_last_subscriber_leaves():
+    single_flight = SingleFlight()
+    closed = asyncio.Event()
+
+    async def events():
+        try:
+            yield {"n": 1}
+            await asyncio.Event().wait()
+        finally:
+            closed.set()
+
+    stream = single_flight.stream("key", events)
+    assert await stream.__anext__() == {"n": 1}
+    await stream.aclose()
+    await asyncio.wait_for(closed.wait(), 1)
+    assert single_flight.streams == {}
+
+
+@pytest.mark.asyncio
+async def test_stream_that_is_never_iterated_does_not_keep_the_work_alive():
+    single_flight = SingleFlight()
+    closed = asyncio.Event()
+
+    async def events():
+        try:
+            yield {"n": 1}
+            await asyncio.Event().wait()
+        finally:
+            closed.set()
+
+    stream = single_flight.stream("key", events)
+    abandoned = single_flight.stream("key", events)
+    assert await stream.__anext__() == {"n": 1}
+    await stream.aclose()
+    await abandoned.aclose()
+    await asyncio.wait_for(closed.wait(), 1)
+    assert single_flight.streams == {}
@@ -0,0 +1,48 @@
+from core.sourcepacker import Source, SourcePacker, search_score
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_pack_orders_sources_by_score():
+    packer = SourcePacker(count_words)
+    sources = [Source("a.pdf", "low scoring", 1.0), Source("b.pdf", "high scoring", 2.0)]
+    assert packer.pack(sources, 100) == ["b.pdf: high scoring", "a.pdf: low scoring"]
+
+
+def test_pack_truncates_first_source_that_does_not_fit_at_sentence_boundary():
+    packer = SourcePacker(count_words)
+    first = " ".join(["word"] * 30)
+    second = "One " + " ".join(["two"] * 20) + ". Three " + " ".join(["four"] * 40) + "."
+    sources = [Source("a.pdf", first, 3), Source("b.pdf", second, 2), Source("c.pdf", "left out", 1)]
+
+    packed = packer.pack(sources, 60)
+
+    assert packed == ["a.pdf: " + first, "b.pdf: One " + " ".join(["two"] * 20) + ". "]
+
+
+def test_pack_skips_truncation_below_minimum_tokens():
+    packer = SourcePacker(count_words)
+    sources = [Source("a.pdf", " ".join(["word"] * 30), 2), Source("b.pdf", "Short. " * 30, 1)]
+    assert packer.pack(sources, 40) == ["a.pdf: " + " ".join(["word"] * 30)]
+
+
+def test_pack_caches_token_counts():
+    calls = []
+
+    def counting(text):
+        calls.append(text)
+        return count_words(text)
+
+    packer = SourcePacker(counting)
+    sources = [Source("a.pdf", "some content", 1)]
+    packer.pack(sources, 100)
+    packer.pack(sources, 100)
+    assert calls.count("some content") == 1
+
+
+def test_search_score_prefers_reranker_score():
+    assert search_score({"@search.score": 0.5, "@search.reranker_score": 2.5}) == 2.5
+    assert search_score({"@search.score": 0.5}) == 0.5
+    assert search_score({}) == 0
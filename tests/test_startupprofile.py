@@ -0,0 +1,38 @@
+import sys
+
+from core.startupprofile import StartupProfile, package_of
+
+
+def test_package_of_keeps_namespace_packages_apart():
+    assert package_of("azure.search.documents.aio") == "azure.search"
+    assert package_of("opentelemetry") == "opentelemetry"
+    assert package_of("langchain.agents") == "langchain"
+
+
+def test_records_imports_and_steps(tmp_path, monkeypatch):
+    package = tmp_path / "profiledpkg"
+    package.mkdir()
+    (package / "__init__.py").write_text("from profiledpkg import child\n")
+    (package / "child.py").write_text("import time\ntime.sleep(0.02)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    profile = StartupProfile(top=5)
+    profile.install()
+    try:
+        with profile.step("import"):
+            import profiledpkg  # noqa: F401
+    finally:
+        profile.uninstall()
+        sys.modules.pop("profiledpkg.child", None)
+        sys.modules.pop("profiledpkg", None)
+
+    imports = {entry["module"]: entry for entry in profile.imports}
+    assert imports["profiledpkg.child"]["self_ms"] >= 20
+    assert imports["profiledpkg"]["cumulative_ms"] >= imports["profiledpkg.child"]["cumulative_ms"]
+    assert imports["profiledpkg"]["self_ms"] < imports["profiledpkg.child"]["self_ms"]
+
+    report = profile.emit()
+    assert profile.timer not in sys.meta_path
+    assert report["slowest_imports"][0]["module"] == "profiledpkg"
+    assert report["packages"]["profiledpkg"] >= 20
+    assert [step["step"] for step in report["steps"]] == ["import"]
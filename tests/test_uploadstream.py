@@ -0,0 +1,77 @@
+import hashlib
+import os
+
+import pytest
+
+from core.uploadstream import (
+    MultipartUploadError,
+    UploadTooLargeError,
+    save_multipart_files,
+)
+
+BOUNDARY = "----testboundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def multipart_body(*parts):
+    body = b""
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename is not None else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + content + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+async def chunked(body, size=7):
+    for i in range(0, len(body), size):
+        yield body[i : i + size]
+
+
+@pytest.mark.asyncio
+async def test_save_multipart_files(tmp_path):
+    content = b"%PDF-1.4 " * 1000
+    body = multipart_body(("files", "a.pdf", content), ("other", None, b"ignored"), ("files", "../b.pdf", b"b"))
+
+    saved = await save_multipart_files(CONTENT_TYPE, chunked(body), str(tmp_path), str(tmp_path / ".uploads"))
+
+    assert saved == [
+        {"filename": "a.pdf", "hash": hashlib.sha256(content).hexdigest(), "size": len(content)},
+        {"filename": "b.pdf", "hash": hashlib.sha256(b"b").hexdigest(), "size": 1},
+    ]
+    assert (tmp_path / "a.pdf").read_bytes() == content
+    assert sorted(os.listdir(tmp_path)) == [".uploads", "a.pdf", "b.pdf"]
+    assert os.listdir(tmp_path / ".uploads") == []
+
+
+@pytest.mark.asyncio
+async def test_save_multipart_files_truncated_body_keeps_existing_file(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"old")
+    body = multipart_body(("files", "a.pdf", b"new content"))
+
+    with pytest.raises(ValueError):
+        await save_multipart_files(CONTENT_TYPE, chunked(body[:-30]), str(tmp_path), str(tmp_path / ".uploads"))
+
+    assert sorted(os.listdir(tmp_path)) == [".uploads", "a.pdf"]
+    assert os.listdir(tmp_path / ".uploads") == []
+    assert (tmp_path / "a.pdf").read_bytes() == b"old"
+
+
+@pytest.mark.asyncio
+async def test_save_multipart_files_rejects_body_over_max_size(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"old")
+    body = multipart_body(("files", "a.pdf", b"a" * 100), ("files", "b.pdf", b"b" * 1000))
+
+    with pytest.raises(UploadTooLargeError):
+        await save_multipart_files(
+            CONTENT_TYPE, chunked(body), str(tmp_path), str(tmp_path / ".uploads"), max_size=len(body) - 1
+        )
+
+    # The parts received before the limit was crossed are not saved either
+    assert sorted(os.listdir(tmp_path)) == [".uploads", "a.pdf"]
+    assert os.listdir(tmp_path / ".uploads") == []
+    assert (tmp_path / "a.pdf").read_bytes() == b"old"
+
+
+@pytest.mark.asyncio
+async def test_save_multipart_files_requires_multipart(tmp_path):
+    with pytest.raises(MultipartUploadError):
+        await save_multipart_files("application/json", chunked(b"{}"), str(tmp_path), str(tmp_path / ".uploads"))
@@ -0,0 +1,192 @@
+import re
+
+import pytest
+
+import utils
+from core.chunking import Chunk, Chunker
+from core.dedup import NearDuplicateIndex, SectionDeduplicator
+from utils import (
+    filename_to_id,
+    ingest_file,
+    pack_section_ids,
+    remove_blobs,
+    remove_from_index,
+    unpack_section_ids,
+)
+
+FOOTER = (
+    "Contoso Electronics confidential. This document is provided for informational purposes only and does not "
+    "constitute a contract. Benefits are subject to change, see the plan documents for the binding terms."
+)
+
+
+class AsyncSearchResultsIterator:
+    def __init__(self, results):
+        self.results = iter(results)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MockSearchClient:
+    def __init__(self, ids):
+        self.ids = ids
+        self.searches = []
+        self.deleted = []
+
+    async def search(self, *args, **kwargs):
+        self.searches.append(kwargs)
+        after = re.search(r"id gt '([^']*)'", kwargs["filter"] or "")
+        page = [i for i in sorted(self.ids) if after is None or i > after.group(1)][: kwargs["top"]]
+        return AsyncSearchResultsIterator([{"id": i} for i in page])
+
+    async def delete_documents(self, documents):
+        self.deleted.extend(d["id"] for d in documents)
+        return documents
+
+
+class MockIndexClient:
+    def __init__(self):
+        self.documents = {}
+
+    async def upload_documents(self, documents):
+        self.documents.update((d["id"], d) for d in documents)
+        return [MockIndexingResult() for _ in documents]
+
+    async def delete_documents(self, documents):
+        for d in documents:
+            self.documents.pop(d["id"], None)
+        return documents
+
+
+class MockIndexingResult:
+    succeeded = True
+
+
+class PageChunker(Chunker):
+    def split(self, page_map, filename):
+        for pagenum, _, text in page_map:
+            yield Chunk(text, pagenum)
+
+
+class MockBlobResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class MockContainerClient:
+    def __init__(self, names, failing=()):
+        self.names = names
+        self.failing = failing
+        self.batches = []
+
+    async def exists(self):
+        return True
+
+    def list_blob_names(self, name_starts_with=""):
+        return AsyncSearchResultsIterator([n for n in self.names if n.startswith(name_starts_with)])
+
+    async def delete_blobs(self, *blobs, **kwargs):
+        assert kwargs.get("raise_on_any_failure") is False
+        self.batches.append(blobs)
+        return AsyncSearchResultsIterator([MockBlobResponse(403 if b in self.failing else 202) for b in blobs])
+
+
+def test_pack_section_ids_roundtrip():
+    file_id = filename_to_id("a.pdf")
+    section_ids = [
+        f"{file_id}-page-0-section-0",
+        f"{file_id}-page-0-section-1",
+        f"{file_id}-page-1-section-2",
+        f"{file_id}-page-3-section-3",
+        f"{file_id}-page-3-section-4",
+    ]
+    assert pack_section_ids(section_ids) == [[0, 2], [1, 1], [3, 2]]
+    assert unpack_section_ids("a.pdf", [[0, 2], [1, 1], [3, 2]]) == section_ids
+
+
+@pytest.mark.asyncio
+async def test_remove_from_index_with_known_ids():
+    search_client = MockSearchClient([])
+    section_ids = [f"id-{i}" for i in range(2500)]
+    await remove_from_index(search_client, "index", "a.pdf", section_ids)
+    assert search_client.searches == []
+    assert sorted(search_client.deleted) == sorted(section_ids)
+
+
+@pytest.mark.asyncio
+async def test_remove_from_index_scans_ids():
+    section_ids = [f"id-{i}" for i in range(2000)]
+    search_client = MockSearchClient(section_ids)
+    await remove_from_index(search_client, "index", "a.pdf")
+    assert len(search_client.searches) == 3
+    assert all(s["select"] == ["id"] and s["order_by"] == ["id"] for s in search_client.searches)
+    assert search_client.searches[0]["filter"] == "sourcefile eq 'a.pdf'"
+    last_id = sorted(section_ids)[999]
+    assert search_client.searches[1]["filter"] == f"sourcefile eq 'a.pdf' and id gt '{last_id}'"
+    assert sorted(search_client.deleted) == sorted(section_ids)
+
+
+@pytest.mark.asyncio
+async def test_remove_blobs_in_batches():
+    pages = [f"a-{i}.pdf" for i in range(600)]
+    container = MockContainerClient(pages + ["a.pdf", "ab-1.pdf"], failing=["a-7.pdf"])
+    failures = await remove_blobs(container, "a.pdf")
+    assert [len(b) for b in container.batches] == [256, 256, 88]
+    assert sorted(b for batch in container.batches for b in batch) == sorted(pages)
+    assert failures == [("a-7.pdf", 403)]
+
+
+@pytest.mark.asyncio
+async def test_remove_blobs_exact_match_skips_listing():
+    container = MockContainerClient([])
+    assert await remove_blobs(container, "a.pdf", exact_match=True) == []
+    assert container.batches == [("a.pdf",)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("policy", ["keep_first", "drop"])
+async def test_delete_deduplicated_file_leaves_nothing_in_index(monkeypatch, tmp_path, policy):
+    monkeypatch.chdir(tmp_path)
+    ingest_json = {}
+
+    async def get_ingest_json(container):
+        return dict(ingest_json)
+
+    async def set_ingest_json(container, data, catalog=None):
+        ingest_json.clear()
+        ingest_json.update(data)
+
+    async def get_document_text(form_recognizer_client, filename):
+        texts = ["Northwind Health Plus covers emergency services.", FOOTER, FOOTER, "Reviews are twice a year."]
+        return [(pagenum, 0, text) for pagenum, text in enumerate(texts)]
+
+    async def embed(filename, sections, *args):
+        for s in sections:
+            yield {**s, "embedding": [0.0]}
+
+    async def nothing(*args, **kwargs):
+        return []
+
+    monkeypatch.setattr(utils, "get_ingest_json", get_ingest_json)
+    monkeypatch.setattr(utils, "set_ingest_json", set_ingest_json)
+    monkeypatch.setattr(utils, "get_document_text", get_document_text)
+    monkeypatch.setattr(utils, "update_embeddings_in_batch", embed)
+    monkeypatch.setattr(utils, "upload_blobs", nothing)
+    monkeypatch.setattr(utils, "remove_blobs", nothing)
+    monkeypatch.setattr(utils, "requeue_files", nothing)
+
+    search_client = MockIndexClient()
+    dedup = SectionDeduplicator(policy, NearDuplicateIndex(threshold=0.8))
+    args = (search_client, "index", None, None, None, None, "azure", "embedding", "text-embedding-ada-002")
+    await ingest_file("a.pdf", {"operation": 0}, *args, dedup=dedup, chunker=PageChunker())
+    assert 0 < len(search_client.documents) < 4
+
+    await ingest_file("a.pdf", {**ingest_json["a.pdf"], "operation": 2}, *args, dedup=dedup, chunker=PageChunker())
+    assert search_client.documents == {}
@@ -0,0 +1,62 @@
+import json
+
+import numpy as np
+import pytest
+
+from core.vectorindex import LocalSearchClient, LocalVectorIndex, parse_filter
+
+SECTIONS = [
+    {"id": "a-0", "content": "alpha", "category": "handbook", "sourcepage": "a-1.pdf"},
+    {"id": "b-0", "content": "beta", "category": "benefits", "sourcepage": "b-1.pdf"},
+    {"id": "c-0", "content": "gamma", "category": "benefit's", "sourcepage": "c-1.pdf"},
+]
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    np.save(tmp_path / "embeddings.npy", np.array([[1, 0, 0], [0.8, 0.6, 0], [0, 0, 2]], dtype=np.float32))
+    with open(tmp_path / "sections.jsonl", "w", encoding="utf-8") as f:
+        for section in SECTIONS:
+            f.write(json.dumps(section) + "\n")
+    return tmp_path
+
+
+def test_parse_filter():
+    assert parse_filter(None) == []
+    assert parse_filter("category ne 'it''s' and sourcefile eq 'a.pdf'") == [
+        ("category", "ne", "it's"),
+        ("sourcefile", "eq", "a.pdf"),
+    ]
+    assert parse_filter("id gt 'a-1'") == [("id", "gt", "a-1")]
+    with pytest.raises(ValueError):
+        parse_filter("search.ismatch('x')")
+
+
+def test_search_ranks_by_cosine_similarity(snapshot):
+    index = LocalVectorIndex.load(str(snapshot))
+    assert isinstance(index.vectors, np.memmap)
+
+    matches = index.search([1.0, 0.1, 0.0], top=2)
+    assert [row for row, _ in matches] == [0, 1]
+    assert matches[0][1] == pytest.approx(1 / np.sqrt(1.01))
+
+    assert [row for row, _ in index.search([1.0, 0.1, 0.0], top=5, filter="category ne 'handbook'")] == [1, 2]
+    assert [row for row, _ in index.search([1.0, 0.0, 0.0], top=5, filter="category eq 'benefit''s'")] == [2]
+    assert [row for row, _ in index.search([1.0, 0.1, 0.0], top=5, filter="id gt 'a-0'")] == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_local_search_client(snapshot):
+    class MockFallback:
+        async def search(self, search_text, **kwargs):
+            return ["fallback", search_text]
+
+    client = LocalSearchClient(LocalVectorIndex.load(str(snapshot)), fallback=MockFallback())
+    results = await client.search(
+        "query", filter="category ne 'benefits'", top=3, vector=[0.1, 1.0, 0.05], top_k=50, query_caption="extractive"
+    )
+    documents = [doc async for doc in results]
+    assert [doc["id"] for doc in documents] == ["a-0", "c-0"]
+    assert documents[0]["@search.captions"][0].text == "alpha"
+
+    assert await client.search("query", top=3) == ["fallback", "query"]